@@ -1,4 +1,4 @@
-import time, collections
+import time, collections, importlib.util
 import moderngl as mgl
 
 # ----------------------------------------------------------------------------------------------------------------------
@@ -24,6 +24,19 @@ ZGROUPSIZE = 1
 
 NB_BODY = 32 * 4
 
+# CPU kernel when USE_COMPUTE_SHADER = 0
+#   direct     : all pairs O(N^2)
+#   symmetric  : every pair once O(N^2 / 2), equal and opposite forces, tiled by TILE_SIZE bodies
+#   numpy_blocked : all pairs O(N^2) in NumPy, NUMPY_TILE x NUMPY_TILE blocks of float64 matrix products, no numba
+NBODY_KERNEL = "direct"
+
+# no numba / llvmlite wheel for this Python: the NumPy kernel
+if importlib.util.find_spec("numba") is None:
+    NBODY_KERNEL = "numpy_blocked"
+
+TILE_SIZE    = 256 # bodies per tile for the symmetric kernel
+NUMPY_TILE   = 256 # bodies per tile for the numpy_blocked kernel, 2 float64 tiles^2 should fit in L2
+
 EPS     = 0.3      # soft
 DT      = 1.0/256.0 # time step
 EPS2    = EPS * EPS
@@ -24,6 +24,7 @@ class App:
         print("YGROUPSIZE=", YGROUPSIZE)
         print("ZGROUPSIZE=", ZGROUPSIZE)
         print("NB_BODY=", NB_BODY)
+        print("NBODY_KERNEL=", NBODY_KERNEL)
 
         #
         self.lastTime = time.time()
@@ -93,8 +94,7 @@ class App:
 
             compute_shader_source = compute_shader_source   .replace("XGROUPSIZE_VAL", str(XGROUPSIZE)) \
                                                             .replace("YGROUPSIZE_VAL", str(YGROUPSIZE)) \
-                                                            .replace("ZGROUPSIZE_VAL", str(ZGROUPSIZE)) \
-                                                            .replace("NB_BODY_VAL", str(NB_BODY)) \
+                                                            .replace("ZGROUPSIZE_VAL", str(ZGROUPSIZE))
 
             self.compute_shader = self.ctx.compute_shader(compute_shader_source)
 
@@ -102,6 +102,12 @@ class App:
 
         self.bodies = Bodies(self)
 
+        # body count and timestep are uniforms, not compiled in
+        if USE_COMPUTE_SHADER:
+            self.compute_shader['nb_body'] = self.bodies.nb_body
+            self.compute_shader['dt'] = self.bodies.dt
+            self.compute_shader['eps2'] = self.bodies.eps2
+
         self.frame_tex = self.surf_to_texture(self.display)
         self.frame_tex.use(0)
         self.screen_program['tex'] = 0
@@ -238,20 +244,12 @@ class App:
             self.display.fill((0, 0, 0, 0))
 
             if USE_COMPUTE_SHADER:
-                self.bodies.ssbo_in.bind_to_storage_buffer(0)
-                # self.bodies.ssbo_out.bind_to_storage_buffer(1)
-
-                ##n_group = 1 + (len(inputs) - 1) // groupsize
-                ##compute_shader.run(group_x=n_group)
-
-                if NB_BODY > XGROUPSIZE:
-                    self.compute_shader.run(group_x=NB_BODY // XGROUPSIZE, group_y=1, group_z=1)
-                else:
-                    self.compute_shader.run(group_x=1, group_y=1, group_z=1)
+                self.bodies.step_compute_shader(self.compute_shader)
 
-                a = self.bodies.ssbo_in.read_chunks(4, 0, 4, 16 * NB_BODY)
+                # the state at the end of the step
+                a = self.bodies.ssbo_in.read_chunks(4, 0, 4, 16 * self.bodies.nb_body)
                 d = np.frombuffer(a, dtype='f4')
-                particules = d.reshape(NB_BODY, 16)
+                particules = d.reshape(-1, 16)
                 #particules = []
 
             else:
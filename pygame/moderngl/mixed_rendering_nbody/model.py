@@ -5,12 +5,17 @@ import moderngl as mgl
 import glm, math
 import pywavefront
 import random, copy
-import numba
+from jit import numba
+import numpy_blocked
 
 # -----------------------------------------------------------------------------------------------------------
 
 class Bodies:
 
+    # nbody_cs.glsl
+    PASS_INTEGRATE = 0
+    PASS_FORCE     = 1
+
     def __init__(self, app):
         self.app = app
         self.ctx = app.ctx
@@ -24,24 +29,36 @@ class Bodies:
         # };
 
         particles_array = self.get_particles()
+        self.nb_body    = particles_array.size // 16
+        self.dt         = DT
+        self.eps2       = EPS2
+
+        # ping-pong: the compute shader reads ssbo_in and writes the next state to ssbo_out, swapped after the step
         self.ssbo_in    = self.ctx.buffer(data    = particles_array)
         self.ssbo_out   = self.ctx.buffer(reserve = particles_array.nbytes)
 
+        self.kernel     = self.get_kernel(NBODY_KERNEL)
+
     @staticmethod
     @numba.njit(fastmath=True)
-    def calc_bodies(bodies):
+    def calc_bodies(bodies, dt, eps2):
 
-        bodies = bodies.reshape(NB_BODY, 16)
+        # body count and timestep are arguments: one compiled kernel for any N and dt
+        bodies = bodies.reshape(-1, 16)
+        half_dt = 0.5 * dt
 
         # leap 1/2
         for body in bodies:
-            body[VELX] += body[ACCX] * HALF_DT
-            body[VELY] += body[ACCY] * HALF_DT
-            body[VELZ] += body[ACCZ] * HALF_DT
+            body[VELX] += body[ACCX] * half_dt
+            body[VELY] += body[ACCY] * half_dt
+            body[VELZ] += body[ACCZ] * half_dt
 
-            body[POSX] += body[VELX] * DT
-            body[POSY] += body[VELY] * DT
-            body[POSZ] += body[VELZ] * DT
+            body[POSX] += body[VELX] * dt
+            body[POSY] += body[VELY] * dt
+            body[POSZ] += body[VELZ] * dt
+
+            # the kick above used the acc of the last step, accumulate the new one from zero
+            body[ACCX] = body[ACCY] = body[ACCZ] = 0.0
 
         # O2
         for pi in bodies:
@@ -52,7 +69,7 @@ class Bodies:
                     DRZ = pj[POSZ] - pi[POSZ]
 
                     DR2 = DRX * DRX + DRY * DRY + DRZ * DRZ
-                    DR2 += EPS2
+                    DR2 += eps2
 
                     PHI = pj[MASS] / (math.sqrt(DR2) * DR2)
 
@@ -62,19 +79,140 @@ class Bodies:
 
         # leap 1/2
         for body in bodies:
-            body[VELX] += body[ACCX] * HALF_DT
-            body[VELY] += body[ACCY] * HALF_DT
-            body[VELZ] += body[ACCZ] * HALF_DT
+            body[VELX] += body[ACCX] * half_dt
+            body[VELY] += body[ACCY] * half_dt
+            body[VELZ] += body[ACCZ] * half_dt
+
+        return bodies
+
+    @staticmethod
+    @numba.njit(fastmath=True)
+    def calc_bodies_symmetric(bodies, dt, eps2):
+
+        # body count and timestep are arguments: one compiled kernel for any N and dt
+        bodies = bodies.reshape(-1, 16)
+        nb_body = bodies.shape[0]
+        half_dt = 0.5 * dt
+
+        # leap 1/2
+        for body in bodies:
+            body[VELX] += body[ACCX] * half_dt
+            body[VELY] += body[ACCY] * half_dt
+            body[VELZ] += body[ACCZ] * half_dt
+
+            body[POSX] += body[VELX] * dt
+            body[POSY] += body[VELY] * dt
+            body[POSZ] += body[VELZ] * dt
 
+            # the kick above used the acc of the last step, accumulate the new one from zero
             body[ACCX] = body[ACCY] = body[ACCZ] = 0.0
 
+        # O2 / 2, every unordered pair once (Newton 3rd law), tile by tile so both tiles stay in cache
+        for ti in range(0, nb_body, TILE_SIZE):
+            ti_end = min(ti + TILE_SIZE, nb_body)
+
+            for tj in range(ti, nb_body, TILE_SIZE):
+                tj_end = min(tj + TILE_SIZE, nb_body)
+
+                for i in range(ti, ti_end):
+                    pi = bodies[i]
+                    PIX, PIY, PIZ, MI = pi[POSX], pi[POSY], pi[POSZ], pi[MASS]
+                    AX = AY = AZ = 0.0
+
+                    for j in range(i + 1 if tj == ti else tj, tj_end):
+                        pj = bodies[j]
+
+                        DRX = pj[POSX] - PIX
+                        DRY = pj[POSY] - PIY
+                        DRZ = pj[POSZ] - PIZ
+
+                        DR2 = DRX * DRX + DRY * DRY + DRZ * DRZ
+                        DR2 += eps2
+
+                        INV_DR3 = 1.0 / (math.sqrt(DR2) * DR2)
+                        PHI_I = pj[MASS] * INV_DR3
+                        PHI_J = MI * INV_DR3
+
+                        AX += DRX * PHI_I
+                        AY += DRY * PHI_I
+                        AZ += DRZ * PHI_I
+
+                        pj[ACCX] -= DRX * PHI_J
+                        pj[ACCY] -= DRY * PHI_J
+                        pj[ACCZ] -= DRZ * PHI_J
+
+                    pi[ACCX] += AX
+                    pi[ACCY] += AY
+                    pi[ACCZ] += AZ
+
+        # leap 1/2
+        for body in bodies:
+            body[VELX] += body[ACCX] * half_dt
+            body[VELY] += body[ACCY] * half_dt
+            body[VELZ] += body[ACCZ] * half_dt
+
         return bodies
 
+    @staticmethod
+    def calc_bodies_numpy_blocked(bodies, dt, eps2):
+
+        # no numba: the leapfrog on whole columns, the forces from numpy_blocked.py on the column views
+        bodies = bodies.reshape(-1, 16)
+        half_dt = 0.5 * dt
+
+        pos = bodies[:, POSX:POSZ + 1]
+        vel = bodies[:, VELX:VELZ + 1]
+        acc = bodies[:, ACCX:ACCZ + 1]
+
+        # leap 1/2
+        vel += acc * half_dt
+        pos += vel * dt
+
+        # the kernel accumulates, the potential is not used
+        acc.fill(0.0)
+        pot = np.zeros(bodies.shape[0], dtype=bodies.dtype)
+        numpy_blocked.accel(bodies[:, POSX], bodies[:, POSY], bodies[:, POSZ], bodies[:, MASS],
+                            bodies[:, ACCX], bodies[:, ACCY], bodies[:, ACCZ], pot, eps2)
+
+        # leap 1/2
+        vel += acc * half_dt
+
+        return bodies
+
+    def get_kernel(self, name):
+        kernels = {
+            "direct"        : self.calc_bodies,
+            "symmetric"     : self.calc_bodies_symmetric,
+            "numpy_blocked" : self.calc_bodies_numpy_blocked,
+        }
+
+        return kernels[name]
+
+    def step_compute_shader(self, compute_shader):
+        # one leapfrog step, IN -> OUT, see nbody_cs.glsl
+        self.ssbo_in.bind_to_storage_buffer(0)
+        self.ssbo_out.bind_to_storage_buffer(1)
+
+        # the shader skips the invocations past nb_body, round up
+        nb_group = (self.nb_body + XGROUPSIZE - 1) // XGROUPSIZE
+
+        compute_shader['pass_id'] = self.PASS_INTEGRATE
+        compute_shader.run(group_x=nb_group, group_y=1, group_z=1)
+
+        # the force pass reads the new position of every body
+        self.ctx.memory_barrier()
+
+        compute_shader['pass_id'] = self.PASS_FORCE
+        compute_shader.run(group_x=nb_group, group_y=1, group_z=1)
+        self.ctx.memory_barrier()
+
+        self.ssbo_in, self.ssbo_out = self.ssbo_out, self.ssbo_in
+
     def update(self):
-        a = self.ssbo_in.read_chunks(4, 0, 4, 16 * NB_BODY)
+        a = self.ssbo_in.read_chunks(4, 0, 4, 16 * self.nb_body)
         d = np.frombuffer(a, dtype='f4')
 
-        self.particules = self.calc_bodies(copy.copy(d))
+        self.particules = self.kernel(copy.copy(d), self.dt, self.eps2)
 
         self.ssbo_in.write(self.particules)
 
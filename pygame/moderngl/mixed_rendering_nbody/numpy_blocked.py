@@ -0,0 +1,62 @@
+from config import *
+import numpy as np
+
+# -----------------------------------------------------------------------------------------------------------
+# Direct sum in NumPy, no numba: the fallback NBODY_KERNEL when numba / llvmlite have no wheel for the Python
+#
+# i tile x j tile blocks of NUMPY_TILE bodies, every block is two matrix products (BLAS):
+#   r_ij^2 = |x_i|^2 + |x_j|^2 - 2 x_i . x_j
+#   a_i    = sum_j phi_ij (x_j - x_i) = phi @ x_j - (sum_j phi_ij) x_i,   phi_ij = m_j / (r_ij^2 + eps^2)^1.5
+# in float64: the expansion of r^2 cancels for close pairs. Two NUMPY_TILE^2 matrices are alive at once,
+# 256 bodies: 1 MB, about the size of an L2, memory stays bounded for any N
+
+def accel(x, y, z, m, ax, ay, az, pot, eps2, tile_size=NUMPY_TILE):
+    n = x.shape[0]
+
+    pos = np.stack((x, y, z), axis=1).astype(np.float64)
+    mass = m.astype(np.float64)
+    pos2 = np.einsum("ij,ij->i", pos, pos)
+
+    for i0 in range(0, n, tile_size):
+        i1 = min(i0 + tile_size, n)
+        pi = pos[i0:i1]
+
+        acc = np.zeros((i1 - i0, 3))
+        phi_sum = np.zeros(i1 - i0)
+        pot_i = np.zeros(i1 - i0)
+
+        for j0 in range(0, n, tile_size):
+            j1 = min(j0 + tile_size, n)
+            pj = pos[j0:j1]
+
+            # 1 / sqrt(r^2 + eps^2), in place
+            inv_r = pi @ pj.T
+            inv_r *= -2.0
+            inv_r += pos2[i0:i1, None]
+            inv_r += pos2[None, j0:j1]
+            np.maximum(inv_r, 0.0, out=inv_r)
+            inv_r += eps2
+            np.sqrt(inv_r, out=inv_r)
+
+            # no self interaction: 1 / inf = 0, even when eps2 = 0
+            if i0 == j0:
+                np.fill_diagonal(inv_r, np.inf)
+
+            np.reciprocal(inv_r, out=inv_r)
+
+            phi = inv_r * mass[None, j0:j1]
+            pot_i -= phi.sum(axis=1)
+
+            phi *= inv_r
+            phi *= inv_r
+
+            acc += phi @ pj
+            phi_sum += phi.sum(axis=1)
+
+        acc -= phi_sum[:, None] * pi
+
+        ax[i0:i1] += acc[:, 0]
+        ay[i0:i1] += acc[:, 1]
+        az[i0:i1] += acc[:, 2]
+
+        pot[i0:i1] += pot_i
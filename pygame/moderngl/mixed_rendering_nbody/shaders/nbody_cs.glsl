@@ -3,15 +3,18 @@
 #define XGROUPSIZE  XGROUPSIZE_VAL
 #define YGROUPSIZE  YGROUPSIZE_VAL
 #define ZGROUPSIZE  ZGROUPSIZE_VAL
-#define NB_BODY     NB_BODY_VAL
 
-// TODO set as uniform
-const float EPS     = 0.3;
-const float DT      = 1.0/256.0;
-const float EPS2    = EPS * EPS;
-const float HALF_DT = 0.5 * DT;
+// one leapfrog step in two dispatches, IN = state at the start of the step, OUT = state at the end,
+// the app swaps the buffers after the step: no invocation reads a body another one is moving
+#define PASS_INTEGRATE  0 // IN -> OUT: vel += acc * dt / 2 (acc of the last step), pos += vel * dt
+#define PASS_FORCE      1 // OUT: acc at the new positions, vel += acc * dt / 2
 
-//uniform int nb_body;
+// set at dispatch time: one compiled shader for any body count and timestep
+uniform int   nb_body;
+uniform float dt;
+uniform float eps2;
+
+uniform int   pass_id;
 
 layout(local_size_x=XGROUPSIZE, local_size_y=YGROUPSIZE, local_size_z=ZGROUPSIZE) in;
 
@@ -33,40 +36,53 @@ layout(std430, binding=1) buffer bodies_out
     Body bodies[];
 } OUT;
 
-void main()
+void integrate(int i)
 {
-    int current_index = int(gl_GlobalInvocationID);
-
-    // if went past number of particles, skip
-    //if (current_index >= NB_BODY_VAL + XGROUPSIZE) return;
+    Body body = IN.bodies[i];
 
     // leap 1/2
-    IN.bodies[current_index].vel.xyz += IN.bodies[current_index].acc.xyz * HALF_DT;
-    IN.bodies[current_index].pos.xyz += IN.bodies[current_index].vel.xyz * DT;
+    body.vel.xyz += body.acc.xyz * (0.5 * dt);
+    body.pos.xyz += body.vel.xyz * dt;
+
+    OUT.bodies[i] = body;
+}
+
+void force(int i)
+{
+    // only the positions of OUT are read, only acc and vel are written
+    vec3 pos = OUT.bodies[i].pos.xyz;
+    vec3 acc = vec3(0.0);
 
-    // acc
-    for (int j=0; j < IN.bodies.length(); j++) {
-        if(IN.bodies[current_index].acc.w != IN.bodies[j].acc.w) { // body ID
+    for (int j=0; j < nb_body; j++) {
+        // not the body itself: 0 / 0 when eps2 = 0
+        if (j == i) continue;
 
-            vec3 dr = IN.bodies[j].pos.xyz - IN.bodies[current_index].pos.xyz;
+        vec3 dr = OUT.bodies[j].pos.xyz - pos;
 
-            float dr2 = dot(dr, dr);
-            dr2 += EPS2;
+        float dr2 = dot(dr, dr);
+        dr2 += eps2;
 
-            float phi = IN.bodies[j].pos.w / (sqrt(dr2) * dr2);
+        float phi = OUT.bodies[j].pos.w / (sqrt(dr2) * dr2);
 
-            IN.bodies[current_index].acc.xyz += dr.xyz * phi;
-       }
+        acc += dr * phi;
     }
 
     // leap 1/2
-    IN.bodies[current_index].vel.xyz += IN.bodies[current_index].acc.xyz * HALF_DT;
-    IN.bodies[current_index].acc = vec4(0, 0, 0, IN.bodies[current_index].acc.w);
+    OUT.bodies[i].acc.xyz = acc;
+    OUT.bodies[i].vel.xyz += acc * (0.5 * dt);
+}
 
-    //IN.bodies[current_index].pos.z += 0.001;
-    //OUT.bodies[current_index] = IN.bodies[current_index];
+void main()
+{
+    int current_index = int(gl_GlobalInvocationID);
 
-    // ensure that all threads are done reading particle data before continuing
-    barrier();
-    memoryBarrier();
-}
\ No newline at end of file
+    // if went past number of particles, skip
+    if (current_index >= nb_body) return;
+
+    if (pass_id == PASS_INTEGRATE) {
+        integrate(current_index);
+    }
+    else if (pass_id == PASS_FORCE) {
+        force(current_index);
+    }
+}
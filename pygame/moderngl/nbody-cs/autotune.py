@@ -0,0 +1,110 @@
+from config import *
+import os, json, time
+import moderngl as mgl
+from gpu_sim import GPUSimulation
+
+# -----------------------------------------------------------------------------------------------------------
+# Workgroup size autotuner for the n-body shaders
+#
+# every local size of AUTOTUNE_SIZES the driver allows, with and without the shared memory tiles (tile size =
+# local size), is compiled and steps a copy of the bodies AUTOTUNE_STEPS times, the collision and SPH passes
+# included: they run with the same local size. The fastest is saved in
+# AUTOTUNE_CACHE (json) under GL_RENDERER | GL_VERSION | N | the compiled options, the next launches on the
+# same driver and body count read it back without timing anything.
+#
+# GPU time from a GL_TIME_ELAPSED query around the steps, wall time up to ctx.finish() (a fence on the last
+# dispatch) where the timer is not usable: llvmpipe answers ~0 ns
+
+def get_key(ctx, nb_body, **options):
+    fields = [ctx.info["GL_RENDERER"], ctx.info["GL_VERSION"], f"N={nb_body}"]
+    # True / 1 from the command line or config.py: same key
+    fields += [f"{name}={int(value) if isinstance(value, bool) else value}" for name, value in sorted(options.items())]
+
+    return " | ".join(fields)
+
+def get_candidates(ctx, sizes=AUTOTUNE_SIZES):
+    # (local size, tiled), YGROUPSIZE = ZGROUPSIZE = 1
+    max_size = ctx.info["GL_MAX_COMPUTE_WORK_GROUP_INVOCATIONS"]
+
+    return [(size, tiled) for size in sizes if size <= max_size for tiled in (0, 1)]
+
+def load_cache(path=AUTOTUNE_CACHE):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_cache(cache, path=AUTOTUNE_CACHE):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(cache, f, indent=2)
+
+    os.replace(tmp, path)
+
+def time_candidate(ctx, ssbo, nb_body, group_size, tiled, steps=AUTOTUNE_STEPS, **options):
+    # seconds per step, the bodies of ssbo are not touched
+    scratch = ctx.buffer(reserve=ssbo.size)
+    ctx.copy_buffer(scratch, ssbo)
+
+    sim = None
+    query = ctx.query(time=True)
+    try:
+        # the passes of a step, collisions and SPH included (options), no removal
+        sim = GPUSimulation(ctx, scratch, nb_body, remove_radius=0.0, tiled=tiled, group_size=group_size, **options)
+
+        # first acc (jerk, levels) and shader warm up, not timed
+        sim.step()
+        ctx.finish()
+
+        t0 = time.perf_counter()
+        with query:
+            for _ in range(steps):
+                sim.step()
+        ctx.finish()
+        wall_time = time.perf_counter() - t0
+
+        gpu_time = query.elapsed * 1e-9
+    finally:
+        if sim is not None:
+            sim.release()
+        scratch.release()
+
+    return (gpu_time if gpu_time > 0.01 * wall_time else wall_time) / steps
+
+def tune(ctx, ssbo, nb_body, sizes=AUTOTUNE_SIZES, steps=AUTOTUNE_STEPS, log=print, **options):
+    timings = {}
+
+    for group_size, tiled in get_candidates(ctx, sizes):
+        try:
+            step_time = time_candidate(ctx, ssbo, nb_body, group_size, tiled, steps, **options)
+        except mgl.Error as e:
+            # over the shared memory / register budget of the driver
+            log(f"autotune: XGROUPSIZE={group_size} CS_TILED={tiled} failed: {e}")
+            continue
+
+        timings[f"{group_size}/{tiled}"] = step_time
+        log(f"autotune: XGROUPSIZE={group_size} CS_TILED={tiled} {step_time * 1e3:.2f} ms/step")
+
+    if not timings:
+        raise RuntimeError("autotune: no workgroup size compiled")
+
+    best = min(timings, key=timings.get)
+    group_size, tiled = map(int, best.split("/"))
+
+    return {"group_size": group_size, "tiled": tiled, "step_time": timings[best], "timings": timings}
+
+def get_best(ctx, ssbo, nb_body, path=AUTOTUNE_CACHE, log=print, **options):
+    # (group_size, tiled) for GPUSimulation: cached for this driver and body count, tuned and saved on a miss
+    # options: the GPUSimulation arguments that change the compiled shader or the passes per step
+    key = get_key(ctx, nb_body, **options)
+    cache = load_cache(path)
+
+    if key not in cache:
+        cache[key] = tune(ctx, ssbo, nb_body, log=log, **options)
+        save_cache(cache, path)
+
+    best = cache[key]
+    log(f"autotune: {key}: XGROUPSIZE={best['group_size']} CS_TILED={best['tiled']}")
+
+    return best["group_size"], best["tiled"]
@@ -0,0 +1,252 @@
+import numpy as np
+import math
+from jit import numba
+
+# -----------------------------------------------------------------------------------------------------------
+# Barnes-Hut octree
+#
+# bodies are sorted along a 63 bits Morton key (21 bits per axis), so every octree cell owns a contiguous
+# range of the sorted arrays. Cells are stored in pre-order: the first child of a cell is the next cell and
+# skip[cell] jumps over the whole sub tree, so the force walk needs no stack.
+
+MAX_LEVEL = 21
+
+@numba.njit(nogil=True)
+def spread_bits(v):
+    v &= 0x1fffff
+    v = (v | (v << 32)) & 0x1f00000000ffff
+    v = (v | (v << 16)) & 0x1f0000ff0000ff
+    v = (v | (v << 8))  & 0x100f00f00f00f00f
+    v = (v | (v << 4))  & 0x10c30c30c30c30c3
+    v = (v | (v << 2))  & 0x1249249249249249
+    return v
+
+@numba.njit(fastmath=True, nogil=True)
+def morton_keys(x, y, z):
+    n = x.shape[0]
+
+    xmin, ymin, zmin = x[0], y[0], z[0]
+    xmax, ymax, zmax = x[0], y[0], z[0]
+
+    for i in range(n):
+        xmin = min(xmin, x[i]); xmax = max(xmax, x[i])
+        ymin = min(ymin, y[i]); ymax = max(ymax, y[i])
+        zmin = min(zmin, z[i]); zmax = max(zmax, z[i])
+
+    size = max(xmax - xmin, max(ymax - ymin, zmax - zmin))
+    size = max(size * 1.0001, 1e-6)
+
+    cells = 1 << MAX_LEVEL
+    scale = cells / size
+
+    keys = np.empty(n, dtype=np.int64)
+    for i in range(n):
+        ix = min(int((x[i] - xmin) * scale), cells - 1)
+        iy = min(int((y[i] - ymin) * scale), cells - 1)
+        iz = min(int((z[i] - zmin) * scale), cells - 1)
+        keys[i] = (spread_bits(ix) << 2) | (spread_bits(iy) << 1) | spread_bits(iz)
+
+    return keys, xmin, ymin, zmin, size
+
+@numba.njit(nogil=True)
+def build_tree(keys, leaf_size):
+    # returns cell arrays in pre-order: body range [first, last), level, parent, integer corner
+    n = keys.shape[0]
+    max_cells = 2 * n + 8 * MAX_LEVEL + 8
+
+    first  = np.empty(max_cells, dtype=np.int64)
+    last   = np.empty(max_cells, dtype=np.int64)
+    level  = np.empty(max_cells, dtype=np.int64)
+    parent = np.empty(max_cells, dtype=np.int64)
+    corner = np.empty((max_cells, 3), dtype=np.int64)
+
+    stack = np.zeros((8 * (MAX_LEVEL + 1) + 1, 7), dtype=np.int64)
+    stack[0, 0], stack[0, 1], stack[0, 2], stack[0, 3] = 0, n, 0, -1
+    sp = 1
+    nb_cells = 0
+
+    while sp > 0:
+        sp -= 1
+        s, e, lvl, par = stack[sp, 0], stack[sp, 1], stack[sp, 2], stack[sp, 3]
+        cix, ciy, ciz = stack[sp, 4], stack[sp, 5], stack[sp, 6]
+
+        if nb_cells == max_cells:
+            # degenerate distribution, grow storage
+            max_cells *= 2
+            first  = np.concatenate((first, np.empty_like(first)))
+            last   = np.concatenate((last, np.empty_like(last)))
+            level  = np.concatenate((level, np.empty_like(level)))
+            parent = np.concatenate((parent, np.empty_like(parent)))
+            corner = np.concatenate((corner, np.empty_like(corner)))
+
+        cell = nb_cells
+        nb_cells += 1
+
+        first[cell], last[cell], level[cell], parent[cell] = s, e, lvl, par
+        corner[cell, 0], corner[cell, 1], corner[cell, 2] = cix, ciy, ciz
+
+        if e - s <= leaf_size or lvl == MAX_LEVEL:
+            continue
+
+        # split on the 3 bits of this level, children pushed in reverse to be popped in key order
+        shift = 3 * (MAX_LEVEL - 1 - lvl)
+        half = 1 << (MAX_LEVEL - 1 - lvl)
+        j = e
+        while j > s:
+            octant = (keys[j - 1] >> shift) & 7
+            k = j - 1
+            while k > s and ((keys[k - 1] >> shift) & 7) == octant:
+                k -= 1
+
+            stack[sp, 0], stack[sp, 1], stack[sp, 2], stack[sp, 3] = k, j, lvl + 1, cell
+            stack[sp, 4] = cix + ((octant >> 2) & 1) * half
+            stack[sp, 5] = ciy + ((octant >> 1) & 1) * half
+            stack[sp, 6] = ciz + (octant & 1) * half
+            sp += 1
+            j = k
+
+    return first[:nb_cells], last[:nb_cells], level[:nb_cells], parent[:nb_cells], corner[:nb_cells]
+
+@numba.njit(fastmath=True, nogil=True)
+def cell_moments(x, y, z, m, first, last, parent, leaf):
+    nb_cells = first.shape[0]
+
+    cmass = np.zeros(nb_cells, dtype=np.float64)
+    cx    = np.zeros(nb_cells, dtype=np.float64)
+    cy    = np.zeros(nb_cells, dtype=np.float64)
+    cz    = np.zeros(nb_cells, dtype=np.float64)
+    skip  = np.ones(nb_cells, dtype=np.int64)
+
+    # children always come after their parent in pre-order: walk backward to go bottom-up
+    for c in range(nb_cells - 1, -1, -1):
+        if leaf[c]:
+            for k in range(first[c], last[c]):
+                cmass[c] += m[k]
+                cx[c] += m[k] * x[k]
+                cy[c] += m[k] * y[k]
+                cz[c] += m[k] * z[k]
+
+        p = parent[c]
+        if p >= 0:
+            cmass[p] += cmass[c]
+            cx[p] += cx[c]
+            cy[p] += cy[c]
+            cz[p] += cz[c]
+            skip[p] += skip[c]
+
+        if cmass[c] > 0.0:
+            cx[c] /= cmass[c]
+            cy[c] /= cmass[c]
+            cz[c] /= cmass[c]
+
+    # skip[c] was the sub tree size, turn it into the index of the next cell outside the sub tree
+    for c in range(nb_cells):
+        skip[c] += c
+
+    return cmass, cx, cy, cz, skip
+
+@numba.njit(fastmath=True, parallel=True, nogil=True)
+def walk_tree(x, y, z, m, cmass, cx, cy, cz, copen2, first, last, leaf, skip, eps2, ax, ay, az, pot):
+    n = x.shape[0]
+    nb_cells = cmass.shape[0]
+
+    for i in numba.prange(n):
+        xi, yi, zi = x[i], y[i], z[i]
+        axi = ayi = azi = poti = 0.0
+
+        c = 0
+        while c < nb_cells:
+            if leaf[c]:
+                # the body itself is skipped: with eps2 = 0 its term is 0 / 0
+                for k in range(first[c], last[c]):
+                    if k == i:
+                        continue
+
+                    DRX = x[k] - xi
+                    DRY = y[k] - yi
+                    DRZ = z[k] - zi
+
+                    DR2 = DRX * DRX + DRY * DRY + DRZ * DRZ + eps2
+                    PHI = m[k] / (math.sqrt(DR2) * DR2)
+
+                    axi += DRX * PHI
+                    ayi += DRY * PHI
+                    azi += DRZ * PHI
+
+                    poti -= PHI * DR2
+
+                c = skip[c]
+                continue
+
+            DRX = cx[c] - xi
+            DRY = cy[c] - yi
+            DRZ = cz[c] - zi
+            DR2 = DRX * DRX + DRY * DRY + DRZ * DRZ
+
+            # opening criterion: size / theta + offset of the center of mass < distance
+            if copen2[c] < DR2:
+                DR2 += eps2
+                PHI = cmass[c] / (math.sqrt(DR2) * DR2)
+
+                axi += DRX * PHI
+                ayi += DRY * PHI
+                azi += DRZ * PHI
+
+                poti -= PHI * DR2
+
+                c = skip[c]
+            else:
+                c += 1
+
+        ax[i] = axi
+        ay[i] = ayi
+        az[i] = azi
+
+        pot[i] = poti
+
+@numba.njit(fastmath=True, nogil=True)
+def accel(x, y, z, m, ax, ay, az, pot, eps2, theta, leaf_size):
+    # ax, ay, az += acceleration of every body, pot += potential, O(N log N)
+    keys, xmin, ymin, zmin, size = morton_keys(x, y, z)
+    order = np.argsort(keys, kind='mergesort')
+    keys = keys[order]
+
+    xs = np.ascontiguousarray(x[order])
+    ys = np.ascontiguousarray(y[order])
+    zs = np.ascontiguousarray(z[order])
+    ms = np.ascontiguousarray(m[order])
+
+    first, last, level, parent, corner = build_tree(keys, leaf_size)
+
+    nb_cells = first.shape[0]
+    leaf = np.empty(nb_cells, dtype=np.bool_)
+    for c in range(nb_cells):
+        leaf[c] = (c + 1 == nb_cells) or (parent[c + 1] != c)
+
+    cmass, cx, cy, cz, skip = cell_moments(xs, ys, zs, ms, first, last, parent, leaf)
+
+    # Barnes (1994): open the cell when the body is closer than size / theta + |com - cell center|
+    unit = size / (1 << MAX_LEVEL)
+    copen2 = np.empty(nb_cells, dtype=np.float64)
+    for c in range(nb_cells):
+        csize = size / (1 << level[c])
+        dx = xmin + corner[c, 0] * unit + 0.5 * csize - cx[c]
+        dy = ymin + corner[c, 1] * unit + 0.5 * csize - cy[c]
+        dz = zmin + corner[c, 2] * unit + 0.5 * csize - cz[c]
+        dopen = csize / theta + math.sqrt(dx * dx + dy * dy + dz * dz) if theta > 0.0 else np.inf
+        copen2[c] = dopen * dopen
+
+    axs = np.empty(xs.shape[0], dtype=np.float64)
+    ays = np.empty(xs.shape[0], dtype=np.float64)
+    azs = np.empty(xs.shape[0], dtype=np.float64)
+    pots = np.empty(xs.shape[0], dtype=np.float64)
+
+    walk_tree(xs, ys, zs, ms, cmass, cx, cy, cz, copen2, first, last, leaf, skip, eps2, axs, ays, azs, pots)
+
+    # back to the caller order
+    for k in range(order.shape[0]):
+        i = order[k]
+        ax[i] += axs[k]
+        ay[i] += ays[k]
+        az[i] += azs[k]
+        pot[i] += pots[k]
@@ -0,0 +1,198 @@
+from config import *
+import numpy as np
+import math
+from jit import numba
+
+# -----------------------------------------------------------------------------------------------------------
+# Hierarchical (power of two) block timesteps
+#
+# a body on level L steps with DT / 2^L, L from BLOCK_MIN_LEVEL (<= 0: steps up to DT * 2^-BLOCK_MIN_LEVEL)
+# to BLOCK_MAX_LEVEL. One call advances the whole system by the largest step, get_block_dt(), in
+# 2^(max_level - min_level) substeps: forces are only evaluated for the bodies whose step ends on a substep and
+# everybody drifts straight from one such substep to the next. The level comes from the softening length and
+# the acceleration, dt_i = eta sqrt(eps / |a_i|) (Power et al. 2003), no jerk sum, and a body can only move to
+# a bigger step on a substep aligned with it, so the hierarchy stays synchronized.
+#
+# block_step() works on levels counted from the largest step (0 = get_block_dt()), BodyStore.level too
+
+@numba.njit(fastmath=True, parallel=True, nogil=True)
+def accel_jerk_active(x, y, z, vx, vy, vz, m, active, ax, ay, az, pot, jx, jy, jz, eps2):
+    n = x.shape[0]
+    eps2 = np.float32(eps2)
+    THREE = np.float32(3.0)
+    ZERO = np.float32(0.0)
+
+    for k in numba.prange(active.shape[0]):
+        i = active[k]
+        PIX, PIY, PIZ = x[i], y[i], z[i]
+        VIX, VIY, VIZ = vx[i], vy[i], vz[i]
+        AX = AY = AZ = np.float32(0.0)
+        JX = JY = JZ = POT = np.float32(0.0)
+
+        for j in range(n):
+            DRX = x[j] - PIX
+            DRY = y[j] - PIY
+            DRZ = z[j] - PIZ
+
+            DVX = vx[j] - VIX
+            DVY = vy[j] - VIY
+            DVZ = vz[j] - VIZ
+
+            # j = i with eps2 = 0 is 0 / 0: skipped by a select like gravity.accel_parallel
+            DR2 = DRX * DRX + DRY * DRY + DRZ * DRZ + eps2
+            PHI = m[j] / (math.sqrt(DR2) * DR2) if DR2 > ZERO else ZERO
+            RV  = THREE * (DRX * DVX + DRY * DVY + DRZ * DVZ) / DR2 if DR2 > ZERO else ZERO
+
+            AX += DRX * PHI
+            AY += DRY * PHI
+            AZ += DRZ * PHI
+
+            JX += (DVX - RV * DRX) * PHI
+            JY += (DVY - RV * DRY) * PHI
+            JZ += (DVZ - RV * DRZ) * PHI
+
+            POT += PHI * DR2
+
+        # the self term is in the sums when eps2 > 0: zero force and jerk (dr = dv = 0), softened potential m_i / eps
+        ax[i], ay[i], az[i] = AX, AY, AZ
+        pot[i] = (m[i] / math.sqrt(eps2) if eps2 > ZERO else ZERO) - POT
+        jx[k], jy[k], jz[k] = JX, JY, JZ
+
+@numba.njit(fastmath=True, parallel=True, nogil=True)
+def accel_active(x, y, z, m, active, ax, ay, az, pot, eps2):
+    n = x.shape[0]
+    eps2 = np.float32(eps2)
+    ZERO = np.float32(0.0)
+
+    for k in numba.prange(active.shape[0]):
+        i = active[k]
+        PIX, PIY, PIZ = x[i], y[i], z[i]
+        AX = AY = AZ = POT = np.float32(0.0)
+
+        for j in range(n):
+            DRX = x[j] - PIX
+            DRY = y[j] - PIY
+            DRZ = z[j] - PIZ
+
+            # j = i with eps2 = 0 is 0 / 0: skipped by a select like gravity.accel_parallel
+            DR2 = DRX * DRX + DRY * DRY + DRZ * DRZ + eps2
+            PHI = m[j] / (math.sqrt(DR2) * DR2) if DR2 > ZERO else ZERO
+
+            AX += DRX * PHI
+            AY += DRY * PHI
+            AZ += DRZ * PHI
+
+            POT += PHI * DR2
+
+        ax[i], ay[i], az[i] = AX, AY, AZ
+        pot[i] = (m[i] / math.sqrt(eps2) if eps2 > ZERO else ZERO) - POT
+
+@numba.njit(nogil=True)
+def wanted_level(a2, dt, eta, eps, max_level):
+    # dt_i = eta sqrt(eps / |a|)
+    if a2 <= 0.0:
+        return 0
+
+    dt_wanted = eta * math.sqrt(eps / math.sqrt(a2))
+    if dt_wanted >= dt:
+        return 0
+
+    return min(int(math.ceil(math.log2(dt / dt_wanted))), max_level)
+
+@numba.njit(nogil=True)
+def assign_levels(active, ax, ay, az, level, next_substep, dt, eta, eps, max_level):
+    for k in range(active.shape[0]):
+        i = active[k]
+
+        a2 = ax[i] * ax[i] + ay[i] * ay[i] + az[i] * az[i]
+        new_level = wanted_level(a2, dt, eta, eps, max_level)
+
+        # a bigger step only on a substep aligned with it
+        if level[i] >= 0:
+            while new_level < level[i] and next_substep % (1 << (max_level - new_level)) != 0:
+                new_level += 1
+
+        level[i] = new_level
+
+@numba.njit(fastmath=True, nogil=True)
+def block_step(x, y, z, vx, vy, vz, m, ax, ay, az, pot, level, dt, eta, max_level, eps2):
+    n = x.shape[0]
+    nb_substep = 1 << max_level
+    dt_min = dt / nb_substep
+    eps = math.sqrt(eps2)
+
+    active = np.empty(n, dtype=np.int64)
+
+    # first call: forces and levels for everybody
+    if n > 0 and level[0] < 0:
+        for i in range(n):
+            active[i] = i
+
+        accel_active(x, y, z, m, active, ax, ay, az, pot, eps2)
+        assign_levels(active, ax, ay, az, level, 0, dt, eta, eps, max_level)
+
+    nb_force = 0
+    s = 0
+
+    while s < nb_substep:
+        # leap 1/2 for the bodies starting a step, next substep a step ends on
+        e = nb_substep
+        for i in range(n):
+            stride = 1 << (max_level - level[i])
+
+            if s % stride == 0:
+                half_dt = 0.5 * dt_min * stride
+                vx[i] += ax[i] * half_dt
+                vy[i] += ay[i] * half_dt
+                vz[i] += az[i] * half_dt
+
+            e = min(e, (s // stride + 1) * stride)
+
+        # nobody kicks in between: drift everybody in one go (fewer f32 roundings too), bodies ending their step
+        drift_dt = dt_min * (e - s)
+        nb_active = 0
+        for i in range(n):
+            x[i] += vx[i] * drift_dt
+            y[i] += vy[i] * drift_dt
+            z[i] += vz[i] * drift_dt
+
+            if e % (1 << (max_level - level[i])) == 0:
+                active[nb_active] = i
+                nb_active += 1
+
+        accel_active(x, y, z, m, active[:nb_active], ax, ay, az, pot, eps2)
+        nb_force += nb_active
+
+        # leap 1/2
+        for k in range(nb_active):
+            i = active[k]
+            half_dt = 0.5 * dt_min * (1 << (max_level - level[i]))
+            vx[i] += ax[i] * half_dt
+            vy[i] += ay[i] * half_dt
+            vz[i] += az[i] * half_dt
+
+        assign_levels(active[:nb_active], ax, ay, az, level, e, dt, eta, eps, max_level)
+        s = e
+
+    # number of force evaluations, n per step with a global timestep
+    # every level ends on the last substep: pot is up to date for all bodies
+    return nb_force
+
+def get_block_dt(dt=DT, min_level=BLOCK_MIN_LEVEL):
+    # simulated time of one block step: the largest step
+    return dt * 2.0 ** -min_level
+
+def get_depth(min_level=BLOCK_MIN_LEVEL, max_level=BLOCK_MAX_LEVEL):
+    # levels below the largest step, 2^depth substeps per block step
+    return max_level - min_level
+
+def calc_bodies(store, dt=DT, eta=BLOCK_ETA, max_level=BLOCK_MAX_LEVEL, eps2=EPS2, min_level=BLOCK_MIN_LEVEL):
+    # advances get_block_dt(dt, min_level), not dt
+    if eps2 <= 0.0:
+        raise ValueError("BLOCK_TIMESTEPS needs a softening length, EPS > 0")
+
+    s = store
+    s.pot_source = "direct"
+
+    return block_step(s.x, s.y, s.z, s.vx, s.vy, s.vz, s.mass, s.ax, s.ay, s.az, s.pot, s.level,
+                      get_block_dt(dt, min_level), eta, get_depth(min_level, max_level), eps2)
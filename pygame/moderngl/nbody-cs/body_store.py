@@ -0,0 +1,116 @@
+from config import *
+import numpy as np
+
+# -----------------------------------------------------------------------------------------------------------
+
+class BodyStore:
+    # structure of arrays: the CPU kernels only stream the fields they use, the interleaved
+    # std430 Body record is built by pack() when the SSBO has to be (re)uploaded
+
+    FIELDS = ('x', 'y', 'z', 'mass', 'vx', 'vy', 'vz', 'ax', 'ay', 'az')
+
+    def __init__(self, nb_body):
+        self.nb_body = nb_body
+
+        for name in self.FIELDS:
+            setattr(self, name, np.zeros(nb_body, dtype='f4'))
+
+        # render / bookkeeping only, never touched by the kernels
+        self.color   = np.ones((nb_body, 4), dtype='f4')
+        self.radius  = np.ones(nb_body, dtype='f4')
+        self.body_id = np.arange(nb_body, dtype='f4')
+
+        # potential of every body, filled by the force kernels for the diagnostics; pot_source names the
+        # estimator that filled it ("direct" for the exact sums), None when pot is not at the current positions
+        self.pot = np.zeros(nb_body, dtype='f4')
+        self.pot_source = None
+
+        # ax, ay, az (and the jerk) are at the current positions, set by the integrators
+        self.acc_valid = False
+
+        # jerk, Hermite integrator only
+        self.jx = np.zeros(nb_body, dtype='f4')
+        self.jy = np.zeros(nb_body, dtype='f4')
+        self.jz = np.zeros(nb_body, dtype='f4')
+        self.jerk_valid = False
+
+        # block timestep level, -1 until the first block step
+        self.level = np.full(nb_body, -1, dtype=np.int32)
+
+    @classmethod
+    def from_bodies(cls, bodies):
+        bodies = np.asarray(bodies, dtype='f4').reshape(-1, 16)
+        store = cls(bodies.shape[0])
+
+        store.x[:]    = bodies[:, POSX]
+        store.y[:]    = bodies[:, POSY]
+        store.z[:]    = bodies[:, POSZ]
+        store.mass[:] = bodies[:, MASS]
+
+        store.color[:] = bodies[:, COLR:COLA + 1]
+
+        store.vx[:]     = bodies[:, VELX]
+        store.vy[:]     = bodies[:, VELY]
+        store.vz[:]     = bodies[:, VELZ]
+        store.radius[:] = bodies[:, RADIUS]
+
+        store.ax[:]      = bodies[:, ACCX]
+        store.ay[:]      = bodies[:, ACCY]
+        store.az[:]      = bodies[:, ACCZ]
+        store.body_id[:] = bodies[:, BODY_ID]
+
+        return store
+
+    def compact(self, keep):
+        # drop the bodies where keep is False (collisions), every per body array shrinks
+        for name in self.FIELDS + ('color', 'radius', 'body_id', 'pot', 'jx', 'jy', 'jz', 'level'):
+            setattr(self, name, np.ascontiguousarray(getattr(self, name)[keep]))
+
+        self.nb_body = self.x.shape[0]
+
+    def pack(self, out=None):
+        # Body
+        # {
+        #    vec4 pos; // x, y, z, w = mass
+        #    vec4 col; // r, g, b, a
+        #    vec4 vel; // vx, vy, vz, w = radius
+        #    vec4 acc; // ax, ay, az, w = bodyID
+        # };
+        if out is None:
+            out = np.empty((self.nb_body, 16), dtype='f4')
+
+        out[:, POSX] = self.x
+        out[:, POSY] = self.y
+        out[:, POSZ] = self.z
+        out[:, MASS] = self.mass
+
+        out[:, COLR:COLA + 1] = self.color
+
+        out[:, VELX]   = self.vx
+        out[:, VELY]   = self.vy
+        out[:, VELZ]   = self.vz
+        out[:, RADIUS] = self.radius
+
+        out[:, ACCX]    = self.ax
+        out[:, ACCY]    = self.ay
+        out[:, ACCZ]    = self.az
+        out[:, BODY_ID] = self.body_id
+
+        return out
+
+    def pack_render(self, out=None):
+        # render only vertex: vec4 pos (x, y, z, mass), vec4 col
+        # out may be bigger once bodies merged: the tail gets mass 0, which the vertex shader skips
+        if out is None:
+            out = np.empty((self.nb_body, 8), dtype='f4')
+
+        n = self.nb_body
+        out[:n, POSX] = self.x
+        out[:n, POSY] = self.y
+        out[:n, POSZ] = self.z
+        out[:n, MASS] = self.mass
+
+        out[:n, COLR:COLA + 1] = self.color
+        out[n:] = 0.0
+
+        return out
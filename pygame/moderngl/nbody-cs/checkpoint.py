@@ -0,0 +1,121 @@
+from config import *
+import os, json, struct, threading, zlib
+import numpy as np
+
+# -----------------------------------------------------------------------------------------------------------
+# Checkpoint / restart
+#
+#   header   HEADER: magic, version, nb_body, step, meta size, crc32 of the bodies
+#   meta     json: config (DT, EPS, backend, ...) and the RNG bit generator state
+#   bodies   nb_body * 16 float32, the Body buffer as is: loaded straight into the SSBO
+#
+# written to <path>.tmp, fsync'ed and renamed over <path>: a crash while saving leaves the previous
+# checkpoint intact
+
+MAGIC = b"NBCKPT01"
+VERSION = 1
+
+HEADER = struct.Struct("<8sIIQII")
+
+class Checkpoint:
+
+    def __init__(self, bodies, step=0, rng=None, config=None):
+        self.bodies = bodies
+        self.step = step
+        self.rng = rng
+        self.config = config or {}
+
+    @property
+    def nb_body(self):
+        return self.bodies.shape[0]
+
+def get_config(backend=NBODY_KERNEL, **extra):
+    config = {
+        "DT"                 : DT,
+        "EPS"                : EPS,
+        "backend"            : backend,
+        "USE_COMPUTE_SHADER" : USE_COMPUTE_SHADER,
+        "INTEGRATOR"         : INTEGRATOR,
+        "BLOCK_TIMESTEPS"    : BLOCK_TIMESTEPS,
+        "COLLISIONS"         : COLLISIONS,
+        "PRECISION"          : PRECISION,
+        "SPH"                : SPH,
+        "IC_PRESET"          : IC_PRESET,
+    }
+    config.update(extra)
+
+    return config
+
+def save(path, bodies, step, rng=None, config=None):
+    bodies = np.ascontiguousarray(bodies, dtype='f4').reshape(-1, 16)
+    data = bodies.tobytes()
+
+    meta = {"config": config if config is not None else get_config()}
+    if rng is not None:
+        meta["rng"] = rng.bit_generator.state
+    meta = json.dumps(meta).encode()
+
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, bodies.shape[0], step, len(meta), zlib.crc32(data)))
+        f.write(meta)
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(tmp, path)
+
+def load(path, dt=DT, eps=EPS):
+    with open(path, "rb") as f:
+        magic, version, nb_body, step, meta_size, crc = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path}: not a checkpoint file")
+
+        meta = json.loads(f.read(meta_size))
+        data = f.read(nb_body * 16 * 4)
+
+    if len(data) != nb_body * 16 * 4 or zlib.crc32(data) != crc:
+        raise ValueError(f"{path}: truncated or corrupted checkpoint")
+
+    rng = None
+    if "rng" in meta:
+        state = meta["rng"]
+        rng = np.random.Generator(getattr(np.random, state["bit_generator"])())
+        rng.bit_generator.state = state
+
+    config = meta["config"]
+    for name, value in (("DT", dt), ("EPS", eps)):
+        if config.get(name) != value:
+            print(f"{path}: checkpoint {name} = {config.get(name)}, running with {name} = {value}")
+
+    bodies = np.frombuffer(data, dtype='f4').reshape(nb_body, 16).copy()
+
+    return Checkpoint(bodies, step, rng, config)
+
+# -----------------------------------------------------------------------------------------------------------
+
+class Checkpointer:
+    # periodic checkpoints, the file is written on a worker thread from a copy of the bodies
+
+    def __init__(self, path=CHECKPOINT_PATH, every=CHECKPOINT_EVERY, rng=None, config=None):
+        self.path = path
+        self.every = max(1, every)
+        self.rng = rng
+        self.config = config
+        self.thread = None
+
+    def due(self, step):
+        return step % self.every == 0
+
+    def save(self, bodies, step):
+        # bodies must be a copy the caller will not touch again
+        self.wait()
+
+        self.thread = threading.Thread(target=save, args=(self.path, bodies, step, self.rng, self.config),
+                                       name="nbody-checkpoint", daemon=True)
+        self.thread.start()
+
+    def wait(self):
+        if self.thread:
+            self.thread.join()
+            self.thread = None
@@ -0,0 +1,152 @@
+from config import *
+import numpy as np
+import math
+from jit import numba
+
+# -----------------------------------------------------------------------------------------------------------
+# Collisions: bodies overlapping by their radius (vel.w) merge, O(N) with a uniform spatial hash
+#
+#   1. cells of 2 * max radius, every body hashed on its cell (Teschner et al. 2003 primes) into a power
+#      of two table, counting sort of the bodies by hash: cell_start = prefix sum of the counts
+#   2. every body looks for an overlapping body in the 27 cells around it, the partner is the overlapping
+#      body with the smallest index
+#   3. mutual partners merge into the smaller index: mass, momentum and the centre of mass are conserved,
+#      the radius keeps the volume. A cluster of overlapping bodies always has one mutual pair (the
+#      smallest index of the cluster and its partner), the rest merges on the next steps
+#   4. the merged bodies are removed from the store
+#
+# the compute shader version (collide_cs.glsl, gpu_collision.GPUCollision) applies the same rules
+
+P1, P2, P3 = 73856093, 19349663, 83492791
+
+@numba.njit(nogil=True)
+def hash_cell(ix, iy, iz, mask):
+    return ((ix * P1) ^ (iy * P2) ^ (iz * P3)) & mask
+
+@numba.njit(fastmath=True, nogil=True)
+def build_grid(x, y, z, inv_cell, mask, cell_start, sorted_index):
+    # counting sort by cell hash, bodies of hash h: sorted_index[cell_start[h]:cell_start[h + 1]]
+    n = x.shape[0]
+    body_hash = np.empty(n, dtype=np.int64)
+
+    cell_start[:] = 0
+    for i in range(n):
+        h = hash_cell(int(math.floor(x[i] * inv_cell)), int(math.floor(y[i] * inv_cell)),
+                      int(math.floor(z[i] * inv_cell)), mask)
+        body_hash[i] = h
+        cell_start[h + 1] += 1
+
+    for h in range(mask + 1):
+        cell_start[h + 1] += cell_start[h]
+
+    cursor = cell_start[:-1].copy()
+    for i in range(n):
+        h = body_hash[i]
+        sorted_index[cursor[h]] = i
+        cursor[h] += 1
+
+@numba.njit(fastmath=True, parallel=True, nogil=True)
+def detect(x, y, z, radius, inv_cell, mask, cell_start, sorted_index, partner):
+    # bodies in hash order: the bodies of a cell and their neighbours are close in memory
+    n = x.shape[0]
+    xs, ys, zs, rs = x[sorted_index], y[sorted_index], z[sorted_index], radius[sorted_index]
+
+    for k in numba.prange(n):
+        i = sorted_index[k]
+        PIX, PIY, PIZ, RI = xs[k], ys[k], zs[k], rs[k]
+
+        ix = int(math.floor(PIX * inv_cell))
+        iy = int(math.floor(PIY * inv_cell))
+        iz = int(math.floor(PIZ * inv_cell))
+        best = -1
+
+        for dx in range(-1, 2):
+            for dy in range(-1, 2):
+                for dz in range(-1, 2):
+                    h = hash_cell(ix + dx, iy + dy, iz + dz, mask)
+
+                    # other cells on the same hash only cost a distance test
+                    for l in range(cell_start[h], cell_start[h + 1]):
+                        j = sorted_index[l]
+                        if j == i or (best >= 0 and j >= best):
+                            continue
+
+                        DRX = xs[l] - PIX
+                        DRY = ys[l] - PIY
+                        DRZ = zs[l] - PIZ
+                        RR = RI + rs[l]
+
+                        if DRX * DRX + DRY * DRY + DRZ * DRZ < RR * RR:
+                            best = j
+
+        partner[i] = best
+
+@numba.njit(fastmath=True, nogil=True)
+def merge(x, y, z, m, vx, vy, vz, ax, ay, az, radius, color, partner, alive):
+    nb_merge = 0
+
+    for i in range(x.shape[0]):
+        j = partner[i]
+        if j <= i or partner[j] != i:
+            continue
+
+        M = m[i] + m[j]
+        WI = m[i] / M
+        WJ = m[j] / M
+
+        x[i]  = x[i]  * WI + x[j]  * WJ
+        y[i]  = y[i]  * WI + y[j]  * WJ
+        z[i]  = z[i]  * WI + z[j]  * WJ
+        vx[i] = vx[i] * WI + vx[j] * WJ
+        vy[i] = vy[i] * WI + vy[j] * WJ
+        vz[i] = vz[i] * WI + vz[j] * WJ
+
+        # close enough to the acceleration of the merged body until the next force evaluation
+        ax[i] = ax[i] * WI + ax[j] * WJ
+        ay[i] = ay[i] * WI + ay[j] * WJ
+        az[i] = az[i] * WI + az[j] * WJ
+
+        for c in range(4):
+            color[i, c] = color[i, c] * WI + color[j, c] * WJ
+
+        radius[i] = (radius[i] ** 3 + radius[j] ** 3) ** (1.0 / 3.0)
+        m[i] = M
+
+        alive[j] = False
+        nb_merge += 1
+
+    return nb_merge
+
+# -----------------------------------------------------------------------------------------------------------
+
+def get_table_size(nb_body):
+    # power of two, at least 2 slots per body
+    return 1 << max(1, int(2 * nb_body - 1).bit_length())
+
+def collide(store):
+    # merges the overlapping bodies and compacts the store, returns the number of merges
+    s = store
+
+    max_radius = float(s.radius.max()) if s.nb_body else 0.0
+    if max_radius <= 0.0:
+        return 0
+
+    inv_cell = 1.0 / (2.0 * max_radius)
+    table_size = get_table_size(s.nb_body)
+
+    cell_start = np.empty(table_size + 1, dtype=np.int64)
+    sorted_index = np.empty(s.nb_body, dtype=np.int64)
+    partner = np.empty(s.nb_body, dtype=np.int64)
+
+    build_grid(s.x, s.y, s.z, inv_cell, table_size - 1, cell_start, sorted_index)
+    detect(s.x, s.y, s.z, s.radius, inv_cell, table_size - 1, cell_start, sorted_index, partner)
+
+    alive = np.ones(s.nb_body, dtype=np.bool_)
+    nb_merge = merge(s.x, s.y, s.z, s.mass, s.vx, s.vy, s.vz, s.ax, s.ay, s.az, s.radius, s.color, partner, alive)
+
+    if nb_merge:
+        s.compact(alive)
+        s.pot_source = None
+        s.jerk_valid = False
+
+    return nb_merge
@@ -1,4 +1,4 @@
-import time, collections
+import time, collections, importlib.util
 import moderngl as mgl
 
 # ----------------------------------------------------------------------------------------------------------------------
@@ -36,8 +36,119 @@ XGROUPSIZE = 32 # compute shader nb threads
 YGROUPSIZE = 1
 ZGROUPSIZE = 1
 
+# compute shader direct sum: the workgroup loads the bodies into shared memory one tile of
+# XGROUPSIZE * YGROUPSIZE * ZGROUPSIZE bodies at a time, 0 = every invocation reads the SSBO.
+# Same sums bit for bit, pays off where the SSBO reads are not cached (llvmpipe: 1.3x slower)
+CS_TILED = 0
+
+# pick XGROUPSIZE and CS_TILED per GPU for the n-body shaders: every local size of AUTOTUNE_SIZES, tiled and
+# not, is timed once per driver and body count, the fastest is kept in AUTOTUNE_CACHE for the next launches
+AUTOTUNE       = 0
+AUTOTUNE_SIZES = (32, 64, 128, 256, 512)
+AUTOTUNE_STEPS = 4 # timed steps per candidate
+AUTOTUNE_CACHE = "autotune.json"
+
 NB_BODY = 1024 *10
 
+# compute shader: the body count lives on the GPU, dispatches and draws are indirect. The buffers hold MAX_BODY
+# bodies (0 = the initial count): room for the bodies spawned at run time (key B: SPAWN_COUNT bodies in front of
+# the camera). Bodies farther than REMOVE_RADIUS from the origin are removed every step (0 = off)
+MAX_BODY      = 0
+SPAWN_COUNT   = 256
+REMOVE_RADIUS = 0.0
+
+# compute shader steps per rendered frame, dispatched back to back, only the state after the last one is drawn.
+# TARGET_SIM_RATE > 0: simulated seconds per wall second instead, the steps per frame follow the frame time
+SUBSTEPS        = 1
+TARGET_SIM_RATE = 0.0
+MAX_SUBSTEPS    = 64
+
+# initial conditions: ball, plummer, hernquist, disk, collision, dam (SPH)
+IC_PRESET = "ball"
+IC_SEED   = None # int for reproducible runs
+
+# CPU kernel when USE_COMPUTE_SHADER = 0
+#   direct     : all pairs O(N^2)
+#   parallel   : all pairs O(N^2), force loop split over NB_THREADS threads
+#   symmetric  : every pair once O(N^2 / 2), equal and opposite forces, tiled by TILE_SIZE bodies
+#   barnes_hut : octree O(N log N), force error grows with BH_THETA (~0.4% at 0.5, ~1% at 0.8)
+#   particle_mesh : FFT Poisson solve on a PM_GRID^3 mesh O(N + M log M), smoothed on the cell size
+#   fmm        : fast multipole O(N), order FMM_ORDER expansions, error falls with the order and FMM_THETA
+#   numpy_blocked : all pairs O(N^2) in NumPy, NUMPY_TILE x NUMPY_TILE blocks of float64 matrix products,
+#                   no numba (PRECISION is not used)
+NBODY_KERNEL = "direct"
+
+# no numba / llvmlite wheel for this Python: the NumPy kernel, see jit.py
+if importlib.util.find_spec("numba") is None:
+    NBODY_KERNEL = "numpy_blocked"
+
+NB_THREADS   = 0   # numba threads for the parallel kernels, 0 = all cores
+TILE_SIZE    = 256 # bodies per tile for the symmetric kernel
+NUMPY_TILE   = 256 # bodies per tile for the numpy_blocked kernel, 2 float64 tiles^2 should fit in L2
+
+SIM_THREAD   = 1   # CPU kernels: integrate on a worker thread, decoupled from the render loop
+
+UPLOAD_RING_SIZE = 3 # CPU kernels: pos + col buffers streamed round robin, 1 = orphan a single buffer
+
+BH_THETA     = 0.5 # opening angle, 0 = exact
+BH_LEAF_SIZE = 8   # max bodies per octree leaf
+
+PM_GRID      = 64  # particle mesh cells per axis, the FFT runs on a zero padded 2 * PM_GRID mesh
+
+FMM_ORDER     = 4   # expansion order p
+FMM_THETA     = 0.5 # well separated when r_A + r_B < FMM_THETA * distance
+FMM_LEAF_SIZE = 64  # max bodies per octree leaf, bigger leaves trade M2L for P2P
+
+# global timestep integrator, CPU and compute shader (ignored with BLOCK_TIMESTEPS)
+#   leapfrog  : kick drift kick, 2nd order, 1 force evaluation per step
+#   yoshida4  : 4th order symplectic, 3 force evaluations per step
+#   yoshida6  : 6th order symplectic, 7 force evaluations per step
+#   hermite4  : 4th order predictor corrector on acc + jerk, direct sum (NBODY_KERNEL is not used)
+INTEGRATOR = "leapfrog"
+
+# force accumulation of the direct sums (direct, parallel, nbody_cs.glsl), pair math is float32:
+#   f32   : float32 sums, fastest, the error of the sum grows with N
+#   f64   : float64 sums (dvec3 in the compute shader, slow on consumer GPUs)
+#   kahan : compensated float32 sums
+PRECISION = "f32"
+
+# collisions: bodies overlapping by their radius (vel.w) merge, mass and momentum are conserved and the
+# body count shrinks, CPU (numba) and compute shader, global timestep only
+COLLISIONS  = 0
+BODY_RADIUS = 0.02 # radius of a unit mass body, BODY_RADIUS * cbrt(mass) for the initial conditions
+
+# SPH fluid instead of gravity (IC_PRESET = "dam"): density, pressure and viscosity from the neighbours within
+# the smoothing length h = SPH_H_FACTOR * cbrt(mass / SPH_REST_DENSITY), cell list rebuilt every step,
+# CPU (numba) and compute shader, symplectic integrators only. Stable for DT < ~0.4 h / sqrt(SPH_STIFFNESS)
+SPH              = 0
+SPH_BOX          = 16.0   # fluid box [-SPH_BOX / 2, SPH_BOX / 2]^3
+SPH_H_FACTOR     = 2.0    # smoothing length / particle spacing
+SPH_REST_DENSITY = 1.0
+SPH_STIFFNESS    = 2000.0 # pressure k (rho - rho0), sound speed ~ sqrt(k)
+SPH_VISCOSITY    = 0.1
+SPH_GRAVITY      = 1.0    # along -y
+
+# hierarchical block timesteps: DT / 2^level per body, level from eta sqrt(EPS / |acc|), CPU and compute shader
+# (the CPU block step has its own direct sum over the active bodies, NBODY_KERNEL is not used, EPS > 0).
+# One block step advances the largest step DT * 2^-BLOCK_MIN_LEVEL: the slow bodies step less often than DT.
+# Pays off with a spread of accelerations (galaxy collision), a Plummer sphere is as fast with a global DT
+BLOCK_TIMESTEPS = 0
+BLOCK_MIN_LEVEL = -3   # largest step DT * 2^-BLOCK_MIN_LEVEL, 0 = DT
+BLOCK_MAX_LEVEL = 6    # smallest step DT / 2^BLOCK_MAX_LEVEL
+BLOCK_ETA       = 0.05 # accuracy parameter, median level ~ DT on the galaxy collision
+
+DIAG_EVERY = 0 # log energy / momentum / angular momentum drift every DIAG_EVERY steps, 0 = off
+
+# memory mapped snapshots, see snapshot.open_snapshots() for playback
+SNAPSHOT_EVERY      = 0    # append a frame every SNAPSHOT_EVERY steps, 0 = off
+SNAPSHOT_PATH       = "snapshots.nbs"
+SNAPSHOT_VELOCITIES = 0    # positions only, 1 = positions + velocities
+SNAPSHOT_MAX_FRAMES = 1024 # preallocated, later frames are dropped
+
+# checkpoint / restart: python main.py --resume checkpoint.nbc
+CHECKPOINT_EVERY = 0 # save the whole state every CHECKPOINT_EVERY steps (and on exit), 0 = off
+CHECKPOINT_PATH  = "checkpoint.nbc"
+
 EPS     = 0.3      # soft
 DT      = 1.0/256.0 # time step
 EPS2    = EPS * EPS
@@ -0,0 +1,127 @@
+from config import *
+import numpy as np
+import math
+from jit import numba
+
+# -----------------------------------------------------------------------------------------------------------
+# Conservation diagnostics: kinetic / potential energy, linear and angular momentum, G = 1
+#
+# most CPU force kernels leave the potential of every body in BodyStore.pot, so a sample is O(N);
+# a full O(N^2) potential pass is only done when pot_source is not set (symmetric kernel, Hermite,
+# GPU snapshots) or differs from the estimator of step 0: the approximate kernels (Barnes-Hut, FMM)
+# have their own potential error, step 0 and the samples must come from the same one. Give reset() a
+# store the kernel of the run already went through (gravity.calc_acc) to keep the samples O(N).
+# Drift is logged relative to step 0: dE / |E0|, |P - P0|, |L - L0| / |L0| (|L - L0| when L0 = 0)
+
+@numba.njit(fastmath=True, parallel=True, nogil=True)
+def potential(x, y, z, m, pot, eps2):
+    n = x.shape[0]
+    eps2 = np.float32(eps2)
+    ZERO = np.float32(0.0)
+
+    for i in numba.prange(n):
+        PIX, PIY, PIZ = x[i], y[i], z[i]
+        POT = np.float32(0.0)
+
+        for j in range(n):
+            DRX = x[j] - PIX
+            DRY = y[j] - PIY
+            DRZ = z[j] - PIZ
+
+            # j = i with eps2 = 0 is 1 / 0: skipped by a select like gravity.accel_parallel
+            DR2 = DRX * DRX + DRY * DRY + DRZ * DRZ + eps2
+            POT += m[j] / math.sqrt(DR2) if DR2 > ZERO else ZERO
+
+        # remove the softened self term
+        pot[i] = (m[i] / math.sqrt(eps2) if eps2 > ZERO else ZERO) - POT
+
+def measure(store, eps2=EPS2, pot_source=None):
+    # float64 sums, the per body terms are float32; pot_source: potential estimator wanted, None = any
+    s = store
+
+    if s.pot_source is None or (pot_source is not None and s.pot_source != pot_source):
+        potential(s.x, s.y, s.z, s.mass, s.pot, eps2)
+        s.pot_source = "direct"
+
+    m = s.mass.astype(np.float64)
+
+    pos = np.stack((s.x, s.y, s.z), axis=1).astype(np.float64)
+    vel = np.stack((s.vx, s.vy, s.vz), axis=1).astype(np.float64)
+
+    mv = vel * m[:, None]
+
+    kinetic = 0.5 * np.sum(mv * vel)
+    binding = 0.5 * np.dot(m, s.pot.astype(np.float64))
+
+    return {
+        "kinetic"          : kinetic,
+        "potential"        : binding,
+        "energy"           : kinetic + binding,
+        "momentum"         : mv.sum(axis=0),
+        "angular_momentum" : np.cross(pos, mv).sum(axis=0),
+    }
+
+# -----------------------------------------------------------------------------------------------------------
+
+class Diagnostics:
+
+    def __init__(self, every=DIAG_EVERY, dt=DT, log=print, eps2=EPS2):
+        self.every = max(1, every)
+        self.dt = dt
+        self.eps2 = eps2
+        self.log = log
+
+        self.step = 0
+        self.initial = None
+        self.pot_source = None
+        self.last = None
+
+    def due(self):
+        # True when the next update() takes a sample
+        return (self.step + 1) % self.every == 0
+
+    def reset(self, store):
+        self.step = 0
+        self.initial = measure(store, self.eps2)
+        self.pot_source = store.pot_source
+        self.last = self.get_drift(self.initial)
+
+        self.write(self.last)
+
+    def update(self, store):
+        # call once per step, store is only read when a sample is due
+        self.step += 1
+
+        if self.step % self.every:
+            return None
+
+        if self.initial is None:
+            raise RuntimeError("Diagnostics.reset() was not called")
+
+        self.last = self.get_drift(measure(store, self.eps2, self.pot_source))
+        self.write(self.last)
+
+        return self.last
+
+    def get_drift(self, sample):
+        e0 = self.initial["energy"]
+        dp = np.linalg.norm(sample["momentum"] - self.initial["momentum"])
+        dl = np.linalg.norm(sample["angular_momentum"] - self.initial["angular_momentum"])
+        l0 = np.linalg.norm(self.initial["angular_momentum"])
+
+        return {
+            "step"                   : self.step,
+            "time"                   : self.step * self.dt,
+            "kinetic"                : sample["kinetic"],
+            "potential"              : sample["potential"],
+            "energy"                 : sample["energy"],
+            "energy_drift"           : (sample["energy"] - e0) / abs(e0) if e0 else sample["energy"] - e0,
+            "momentum_drift"         : dp,
+            "angular_momentum_drift" : dl / l0 if l0 else dl,
+        }
+
+    def write(self, d):
+        if self.log:
+            self.log(f"step {d['step']:6d}  t {d['time']:8.3f}  E {d['energy']: .6e}  "
+                     f"dE/E0 {d['energy_drift']: .3e}  |dP| {d['momentum_drift']:.3e}  "
+                     f"dL {d['angular_momentum_drift']:.3e}  2K/|W| {-2.0 * d['kinetic'] / d['potential']:.3f}")
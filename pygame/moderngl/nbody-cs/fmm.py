@@ -0,0 +1,445 @@
+from config import *
+import numpy as np
+import math
+from jit import numba
+import barnes_hut
+
+# -----------------------------------------------------------------------------------------------------------
+# Fast multipole method, O(N)
+#
+# cartesian Taylor expansions of the softened kernel f(r) = 1 / sqrt(r^2 + eps^2) up to order p
+# (Dehnen 2000, 2002), multi-indices n = (nx, ny, nz) with |n| <= p:
+#    multipole M_n = sum_j m_j d_j^n / n!            d_j = x_j - cell center of mass
+#    local     L_m = d^m phi / dx^m at the cell center
+#    M2L       L_m += -sum_n (-1)^|n| M_n D_{n+m}(R)    D_n = d^n f / dx^n, |n| + |m| <= p
+#
+# the adaptive octree is the Barnes-Hut Morton tree, interaction lists come from a dual tree walk with
+# the opening criterion r_A + r_B < theta |z_A - z_B|. Upward (P2M, M2M) and downward (L2L, L2P)
+# passes run level by level with the cells of a level in parallel, M2L and P2P in parallel over the
+# target cells.
+
+# -----------------------------------------------------------------------------------------------------------
+# multi-index tables for order p
+
+class Expansion:
+
+    def __init__(self, order=FMM_ORDER):
+        self.order = p = order
+
+        # graded: every index comes after all its lower orders
+        mi = [(nx, ny, n - nx - ny) for n in range(p + 1) for nx in range(n, -1, -1) for ny in range(n - nx, -1, -1)]
+        index = {n: k for k, n in enumerate(mi)}
+        self.nb_coef = len(mi)
+
+        self.mi = np.array(mi, dtype=np.int64)
+        self.inv_fact = np.array([1.0 / (math.factorial(a) * math.factorial(b) * math.factorial(c)) for a, b, c in mi])
+        self.sign = np.array([(-1.0) ** sum(n) for n in mi])
+
+        def shifted(n, axis, d):
+            t = list(n)
+            t[axis] += d
+            return index.get(tuple(t), -1)
+
+        self.minus1 = np.array([[shifted(n, a, -1) for a in range(3)] for n in mi], dtype=np.int64)
+        self.minus2 = np.array([[shifted(n, a, -2) for a in range(3)] for n in mi], dtype=np.int64)
+        self.plus1  = np.array([[shifted(n, a, +1) for a in range(3)] for n in mi], dtype=np.int64)
+
+        # M2L: (n, m, n + m) with |n| + |m| <= p
+        m2l = [(index[n], index[m], index[(n[0] + m[0], n[1] + m[1], n[2] + m[2])])
+               for n in mi for m in mi if sum(n) + sum(m) <= p]
+        self.m2l = np.array(m2l, dtype=np.int64)
+
+        # M2M / L2L: (n, k, n - k) with k <= n
+        shift = [(index[n], index[k], index[(n[0] - k[0], n[1] - k[1], n[2] - k[2])])
+                 for n in mi for k in mi if k[0] <= n[0] and k[1] <= n[1] and k[2] <= n[2]]
+        self.shift = np.array(shift, dtype=np.int64)
+
+# -----------------------------------------------------------------------------------------------------------
+# expansion kernels
+
+@numba.njit(fastmath=True, nogil=True)
+def monomials(dx, dy, dz, mi, inv_fact, out):
+    # out[n] = d^n / n!
+    for k in range(mi.shape[0]):
+        out[k] = dx ** mi[k, 0] * dy ** mi[k, 1] * dz ** mi[k, 2] * inv_fact[k]
+
+@numba.njit(fastmath=True, nogil=True)
+def derivatives(rx, ry, rz, eps2, mi, minus1, minus2, out):
+    # out[n] = d^n f / dx^n at R, from (r^2 + eps^2) d_i f = -x_i f differentiated by Leibniz:
+    # D_n = -(R_i D_{n-e_i} + m_i D_{n-2e_i} + sum_k 2 m_k R_k D_{n-e_k} + m_k (m_k - 1) D_{n-2e_k}) / (r^2 + eps^2)
+    # with m = n - e_i
+    r = (rx, ry, rz)
+    inv_s2 = 1.0 / (rx * rx + ry * ry + rz * rz + eps2)
+    out[0] = math.sqrt(inv_s2)
+
+    for k in range(1, mi.shape[0]):
+        i = 0
+        while mi[k, i] == 0:
+            i += 1
+
+        acc = r[i] * out[minus1[k, i]]
+        if mi[k, i] >= 2:
+            acc += (mi[k, i] - 1) * out[minus2[k, i]]
+
+        for a in range(3):
+            ma = mi[k, a] - (1 if a == i else 0)
+            if ma >= 1:
+                acc += 2.0 * ma * r[a] * out[minus1[k, a]]
+            if ma >= 2:
+                acc += ma * (ma - 1) * out[minus2[k, a]]
+
+        out[k] = -acc * inv_s2
+
+@numba.njit(fastmath=True, nogil=True)
+def p2m(x, y, z, m, s, e, cx, cy, cz, mi, inv_fact, M, mono):
+    for j in range(s, e):
+        monomials(x[j] - cx, y[j] - cy, z[j] - cz, mi, inv_fact, mono)
+        for k in range(M.shape[0]):
+            M[k] += m[j] * mono[k]
+
+@numba.njit(fastmath=True, nogil=True)
+def shift_up(M_child, M_parent, shift, mono):
+    # M2M: M_P[n] += M_c[k] s^(n-k) / (n-k)!
+    for t in range(shift.shape[0]):
+        M_parent[shift[t, 0]] += M_child[shift[t, 1]] * mono[shift[t, 2]]
+
+@numba.njit(fastmath=True, nogil=True)
+def shift_down(L_parent, L_child, shift, mono):
+    # L2L: L_c[k] += L_P[n] s^(n-k) / (n-k)!
+    for t in range(shift.shape[0]):
+        L_child[shift[t, 1]] += L_parent[shift[t, 0]] * mono[shift[t, 2]]
+
+# -----------------------------------------------------------------------------------------------------------
+# tree
+
+@numba.njit(nogil=True)
+def children_of(parent):
+    # CSR children lists, in pre-order
+    nb_cells = parent.shape[0]
+    count = np.zeros(nb_cells + 1, dtype=np.int64)
+
+    for c in range(1, nb_cells):
+        count[parent[c] + 1] += 1
+
+    child_start = np.cumsum(count)
+    child = np.empty(max(nb_cells - 1, 1), dtype=np.int64)
+    fill = child_start[:-1].copy()
+
+    for c in range(1, nb_cells):
+        p = parent[c]
+        child[fill[p]] = c
+        fill[p] += 1
+
+    return child_start, child
+
+@numba.njit(nogil=True)
+def levels_of(level):
+    # CSR cells per level
+    max_level = level.max()
+    count = np.zeros(max_level + 2, dtype=np.int64)
+
+    for c in range(level.shape[0]):
+        count[level[c] + 1] += 1
+
+    level_start = np.cumsum(count)
+    cells = np.empty(level.shape[0], dtype=np.int64)
+    fill = level_start[:-1].copy()
+
+    for c in range(level.shape[0]):
+        cells[fill[level[c]]] = c
+        fill[level[c]] += 1
+
+    return level_start, cells
+
+@numba.njit(fastmath=True, nogil=True)
+def cell_radius(x, y, z, first, last, parent, leaf, cx, cy, cz):
+    # max distance of a body to the expansion center, bottom-up bound for the inner cells
+    nb_cells = first.shape[0]
+    radius = np.zeros(nb_cells, dtype=np.float64)
+
+    for c in range(nb_cells - 1, -1, -1):
+        if leaf[c]:
+            for k in range(first[c], last[c]):
+                dx, dy, dz = x[k] - cx[c], y[k] - cy[c], z[k] - cz[c]
+                radius[c] = max(radius[c], math.sqrt(dx * dx + dy * dy + dz * dz))
+
+        p = parent[c]
+        if p >= 0:
+            dx, dy, dz = cx[c] - cx[p], cy[c] - cy[p], cz[c] - cz[p]
+            radius[p] = max(radius[p], radius[c] + math.sqrt(dx * dx + dy * dy + dz * dz))
+
+    return radius
+
+@numba.njit(nogil=True)
+def push_pair(pairs, nb, a, b):
+    if nb == pairs.shape[0]:
+        pairs = np.concatenate((pairs, np.empty_like(pairs)))
+
+    pairs[nb, 0], pairs[nb, 1] = a, b
+
+    return pairs, nb + 1
+
+@numba.njit(fastmath=True, nogil=True)
+def dual_walk(leaf, child_start, child, cx, cy, cz, radius, theta):
+    # (target, source) pairs: far field (M2L) and near field (P2P), both directions of every mutual pair
+    far  = np.empty((1024, 2), dtype=np.int64)
+    near = np.empty((1024, 2), dtype=np.int64)
+    nb_far = nb_near = 0
+
+    stack = np.empty((1024, 2), dtype=np.int64)
+    stack[0, 0], stack[0, 1] = 0, 0
+    sp = 1
+
+    while sp > 0:
+        sp -= 1
+        a, b = stack[sp, 0], stack[sp, 1]
+
+        if a == b:
+            if leaf[a]:
+                near, nb_near = push_pair(near, nb_near, a, a)
+                continue
+
+            # every unordered pair of children once
+            for i in range(child_start[a], child_start[a + 1]):
+                for j in range(i, child_start[a + 1]):
+                    stack, sp = push_pair(stack, sp, child[i], child[j])
+            continue
+
+        dx, dy, dz = cx[a] - cx[b], cy[a] - cy[b], cz[a] - cz[b]
+        d = math.sqrt(dx * dx + dy * dy + dz * dz)
+
+        if radius[a] + radius[b] < theta * d:
+            far, nb_far = push_pair(far, nb_far, a, b)
+            far, nb_far = push_pair(far, nb_far, b, a)
+        elif leaf[a] and leaf[b]:
+            near, nb_near = push_pair(near, nb_near, a, b)
+            near, nb_near = push_pair(near, nb_near, b, a)
+        elif leaf[b] or (not leaf[a] and radius[a] >= radius[b]):
+            # split the bigger cell
+            for i in range(child_start[a], child_start[a + 1]):
+                stack, sp = push_pair(stack, sp, child[i], b)
+        else:
+            for i in range(child_start[b], child_start[b + 1]):
+                stack, sp = push_pair(stack, sp, a, child[i])
+
+    return far[:nb_far], near[:nb_near]
+
+@numba.njit(nogil=True)
+def by_target(pairs, nb_cells):
+    # CSR source lists per target cell
+    count = np.zeros(nb_cells + 1, dtype=np.int64)
+
+    for k in range(pairs.shape[0]):
+        count[pairs[k, 0] + 1] += 1
+
+    start = np.cumsum(count)
+    source = np.empty(pairs.shape[0], dtype=np.int64)
+    fill = start[:-1].copy()
+
+    for k in range(pairs.shape[0]):
+        t = pairs[k, 0]
+        source[fill[t]] = pairs[k, 1]
+        fill[t] += 1
+
+    return start, source
+
+# -----------------------------------------------------------------------------------------------------------
+# passes
+
+@numba.njit(fastmath=True, parallel=True, nogil=True)
+def upward(x, y, z, m, first, last, leaf, child_start, child, level_start, level_cells,
+           cx, cy, cz, mi, inv_fact, shift, M):
+    nb_coef = mi.shape[0]
+    nb_levels = level_start.shape[0] - 1
+
+    # deepest level first, the children of a level are complete before their parents
+    for l in range(nb_levels - 1, -1, -1):
+        s, e = level_start[l], level_start[l + 1]
+
+        for t in numba.prange(e - s):
+            c = level_cells[s + t]
+            mono = np.empty(nb_coef, dtype=np.float64)
+
+            if leaf[c]:
+                p2m(x, y, z, m, first[c], last[c], cx[c], cy[c], cz[c], mi, inv_fact, M[c], mono)
+                continue
+
+            for k in range(child_start[c], child_start[c + 1]):
+                ch = child[k]
+                monomials(cx[ch] - cx[c], cy[ch] - cy[c], cz[ch] - cz[c], mi, inv_fact, mono)
+                shift_up(M[ch], M[c], shift, mono)
+
+@numba.njit(fastmath=True, parallel=True, nogil=True)
+def m2l(far_start, far_source, cx, cy, cz, eps2, mi, minus1, minus2, sign, pairs, M, L):
+    nb_cells = far_start.shape[0] - 1
+    nb_coef = mi.shape[0]
+
+    # (-1)^|n| M_n once per cell instead of once per pair
+    Ms = np.empty_like(M)
+    for c in numba.prange(nb_cells):
+        for k in range(nb_coef):
+            Ms[c, k] = sign[k] * M[c, k]
+
+    for c in numba.prange(nb_cells):
+        D = np.empty(nb_coef, dtype=np.float64)
+        Lc = np.zeros(nb_coef, dtype=np.float64)
+
+        for k in range(far_start[c], far_start[c + 1]):
+            b = far_source[k]
+            derivatives(cx[c] - cx[b], cy[c] - cy[b], cz[c] - cz[b], eps2, mi, minus1, minus2, D)
+
+            for t in range(pairs.shape[0]):
+                Lc[pairs[t, 1]] -= Ms[b, pairs[t, 0]] * D[pairs[t, 2]]
+
+        for k in range(nb_coef):
+            L[c, k] += Lc[k]
+
+@numba.njit(fastmath=True, parallel=True, nogil=True)
+def downward(x, y, z, first, last, leaf, parent, level_start, level_cells, cx, cy, cz,
+             mi, inv_fact, plus1, shift, L, ax, ay, az, pot):
+    nb_coef = mi.shape[0]
+    nb_levels = level_start.shape[0] - 1
+
+    for l in range(nb_levels):
+        s, e = level_start[l], level_start[l + 1]
+
+        for t in numba.prange(e - s):
+            c = level_cells[s + t]
+            mono = np.empty(nb_coef, dtype=np.float64)
+
+            # L2L
+            p = parent[c]
+            if p >= 0:
+                monomials(cx[c] - cx[p], cy[c] - cy[p], cz[c] - cz[p], mi, inv_fact, mono)
+                shift_down(L[p], L[c], shift, mono)
+
+            if not leaf[c]:
+                continue
+
+            # L2P: phi = sum L_m d^m / m!, acc = -grad(phi)
+            for j in range(first[c], last[c]):
+                monomials(x[j] - cx[c], y[j] - cy[c], z[j] - cz[c], mi, inv_fact, mono)
+                phi = gx = gy = gz = 0.0
+
+                for k in range(nb_coef):
+                    phi += L[c, k] * mono[k]
+                    if plus1[k, 0] >= 0:
+                        gx += L[c, plus1[k, 0]] * mono[k]
+                        gy += L[c, plus1[k, 1]] * mono[k]
+                        gz += L[c, plus1[k, 2]] * mono[k]
+
+                ax[j] -= gx
+                ay[j] -= gy
+                az[j] -= gz
+                pot[j] += phi
+
+@numba.njit(fastmath=True, parallel=True, nogil=True)
+def p2p(x, y, z, m, first, last, near_start, near_source, eps2, ax, ay, az, pot):
+    nb_cells = near_start.shape[0] - 1
+
+    for c in numba.prange(nb_cells):
+        for k in range(near_start[c], near_start[c + 1]):
+            b = near_source[k]
+
+            for i in range(first[c], last[c]):
+                PIX, PIY, PIZ = x[i], y[i], z[i]
+                AX = AY = AZ = POT = 0.0
+
+                # the body itself is skipped (its own cell is in the near list): with eps2 = 0 its term is 0 / 0
+                for j in range(first[b], last[b]):
+                    if j == i:
+                        continue
+
+                    DRX = x[j] - PIX
+                    DRY = y[j] - PIY
+                    DRZ = z[j] - PIZ
+
+                    DR2 = DRX * DRX + DRY * DRY + DRZ * DRZ + eps2
+                    INV_DR = 1.0 / math.sqrt(DR2)
+                    PHI = m[j] * INV_DR / DR2
+
+                    AX += DRX * PHI
+                    AY += DRY * PHI
+                    AZ += DRZ * PHI
+                    POT -= m[j] * INV_DR
+
+                ax[i] += AX
+                ay[i] += AY
+                az[i] += AZ
+                pot[i] += POT
+
+@numba.njit(fastmath=True, nogil=True)
+def fmm_accel(x, y, z, m, ax, ay, az, pot, eps2, theta, leaf_size, mi, inv_fact, sign, minus1, minus2, plus1,
+              m2l_pairs, shift):
+    n = x.shape[0]
+    keys, xmin, ymin, zmin, size = barnes_hut.morton_keys(x, y, z)
+    order = np.argsort(keys, kind='mergesort')
+    keys = keys[order]
+
+    xs = np.ascontiguousarray(x[order]).astype(np.float64)
+    ys = np.ascontiguousarray(y[order]).astype(np.float64)
+    zs = np.ascontiguousarray(z[order]).astype(np.float64)
+    ms = np.ascontiguousarray(m[order]).astype(np.float64)
+
+    first, last, level, parent, corner = barnes_hut.build_tree(keys, leaf_size)
+
+    nb_cells = first.shape[0]
+    leaf = np.empty(nb_cells, dtype=np.bool_)
+    for c in range(nb_cells):
+        leaf[c] = (c + 1 == nb_cells) or (parent[c + 1] != c)
+
+    cmass, cx, cy, cz, skip = barnes_hut.cell_moments(xs, ys, zs, ms, first, last, parent, leaf)
+    radius = cell_radius(xs, ys, zs, first, last, parent, leaf, cx, cy, cz)
+
+    child_start, child = children_of(parent)
+    level_start, level_cells = levels_of(level)
+
+    far, near = dual_walk(leaf, child_start, child, cx, cy, cz, radius, theta)
+    far_start, far_source = by_target(far, nb_cells)
+    near_start, near_source = by_target(near, nb_cells)
+
+    nb_coef = mi.shape[0]
+    M = np.zeros((nb_cells, nb_coef), dtype=np.float64)
+    L = np.zeros((nb_cells, nb_coef), dtype=np.float64)
+
+    axs = np.zeros(n, dtype=np.float64)
+    ays = np.zeros(n, dtype=np.float64)
+    azs = np.zeros(n, dtype=np.float64)
+    pots = np.zeros(n, dtype=np.float64)
+
+    upward(xs, ys, zs, ms, first, last, leaf, child_start, child, level_start, level_cells,
+           cx, cy, cz, mi, inv_fact, shift, M)
+    m2l(far_start, far_source, cx, cy, cz, eps2, mi, minus1, minus2, sign, m2l_pairs, M, L)
+    downward(xs, ys, zs, first, last, leaf, parent, level_start, level_cells, cx, cy, cz,
+             mi, inv_fact, plus1, shift, L, axs, ays, azs, pots)
+    p2p(xs, ys, zs, ms, first, last, near_start, near_source, eps2, axs, ays, azs, pots)
+
+    # back to the caller order
+    for k in range(n):
+        i = order[k]
+        ax[i] += axs[k]
+        ay[i] += ays[k]
+        az[i] += azs[k]
+        pot[i] += pots[k]
+
+    return far.shape[0], near.shape[0]
+
+# -----------------------------------------------------------------------------------------------------------
+
+_expansion = None
+
+def get_expansion(order=FMM_ORDER):
+    # tables are built once per order
+    global _expansion
+
+    if _expansion is None or _expansion.order != order:
+        _expansion = Expansion(order)
+
+    return _expansion
+
+def accel(x, y, z, m, ax, ay, az, pot, eps2, theta=FMM_THETA, order=FMM_ORDER, leaf_size=FMM_LEAF_SIZE):
+    # ax, ay, az += acceleration of every body, pot += potential, returns the M2L and P2P list sizes
+    e = get_expansion(order)
+
+    return fmm_accel(x, y, z, m, ax, ay, az, pot, eps2, theta, leaf_size, e.mi, e.inv_fact, e.sign,
+                     e.minus1, e.minus2, e.plus1, e.m2l, e.shift)
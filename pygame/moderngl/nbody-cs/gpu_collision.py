@@ -0,0 +1,108 @@
+from config import *
+import numpy as np
+from collision import get_table_size
+from shader_program import get_compute_shader
+
+# -----------------------------------------------------------------------------------------------------------
+
+class GPUCollision:
+    # collision.py on the Body SSBO: spatial hash, merge and compaction without reading anything back,
+    # the body count stays in ssbo_count (binding 4) which nbody_cs.glsl loops over
+
+    # collide_cs.glsl
+    PASS_BOUNDS  = 0
+    PASS_HASH    = 1
+    PASS_SCATTER = 2
+    PASS_DETECT  = 3
+    PASS_MERGE   = 4
+    PASS_FLAG    = 5
+    PASS_COMPACT = 6
+
+    def __init__(self, ctx, ssbo, ssbo_count, capacity, group_size=XGROUPSIZE):
+        self.ctx = ctx
+        self.ssbo = ssbo
+        self.ssbo_count = ssbo_count
+        self.group_size = group_size
+
+        # local size x of the n-body shaders (autotune.py)
+        values = {"XGROUPSIZE" : group_size,
+                  "YGROUPSIZE" : YGROUPSIZE,
+                  "ZGROUPSIZE" : ZGROUPSIZE}
+
+        self.compute_shader = get_compute_shader(ctx, "collide", values)
+        self.scan_shader = get_compute_shader(ctx, "prefix_sum", {})
+
+        self.buffers = []
+        self.set_capacity(capacity)
+
+    def set_capacity(self, capacity):
+        # the body count only shrinks, the buffers are sized for the bodies the ssbo holds
+        self.release_buffers()
+
+        self.capacity = capacity
+        self.table_size = get_table_size(capacity)
+        self.group_x = max(1, (capacity + self.group_size - 1) // self.group_size)
+
+        self.ssbo_out = self.ctx.buffer(reserve=capacity * 64)
+        self.ssbo_flag = self.ctx.buffer(reserve=(capacity + 1) * 4)
+        self.ssbo_cells = self.ctx.buffer(reserve=(self.table_size + 1) * 4)
+        self.ssbo_cursor = self.ctx.buffer(reserve=self.table_size * 4)
+        self.ssbo_grid = self.ctx.buffer(reserve=capacity * 16)
+        self.buffers = [self.ssbo_out, self.ssbo_flag, self.ssbo_cells, self.ssbo_cursor, self.ssbo_grid]
+
+        self.compute_shader['capacity'] = capacity
+        self.compute_shader['mask'] = self.table_size - 1
+
+    def dispatch(self, pass_id):
+        self.compute_shader['pass_id'] = pass_id
+        self.compute_shader.run(group_x=self.group_x, group_y=1, group_z=1)
+        self.ctx.memory_barrier()
+
+    def scan(self, buffer, n):
+        # exclusive prefix sum of buffer[0, n), total in buffer[n]
+        buffer.bind_to_storage_buffer(3)
+        self.scan_shader['n'] = n
+        self.scan_shader.run(group_x=1, group_y=1, group_z=1)
+        self.ctx.memory_barrier()
+
+    def collide(self):
+        self.ssbo.bind_to_storage_buffer(0)
+        self.ssbo_out.bind_to_storage_buffer(1)
+        self.ssbo_count.bind_to_storage_buffer(4)
+        self.ssbo_cells.bind_to_storage_buffer(5)
+        self.ssbo_cursor.bind_to_storage_buffer(6)
+        self.ssbo_grid.bind_to_storage_buffer(7)
+
+        # max radius is recomputed, the count is left alone
+        self.ssbo_count.write(np.zeros(1, dtype='u4'), offset=4)
+        self.ssbo_cells.clear()
+
+        self.dispatch(self.PASS_BOUNDS)
+        self.dispatch(self.PASS_HASH)
+
+        self.scan(self.ssbo_cells, self.table_size)
+        self.ctx.copy_buffer(self.ssbo_cursor, self.ssbo_cells, size=self.table_size * 4)
+        self.ctx.memory_barrier()
+
+        self.dispatch(self.PASS_SCATTER)
+        self.dispatch(self.PASS_DETECT)
+        self.dispatch(self.PASS_MERGE)
+
+        self.ssbo_flag.bind_to_storage_buffer(3)
+        self.dispatch(self.PASS_FLAG)
+        self.scan(self.ssbo_flag, self.capacity)
+        self.dispatch(self.PASS_COMPACT)
+
+        self.ctx.copy_buffer(self.ssbo, self.ssbo_out, size=self.capacity * 64)
+        self.ctx.memory_barrier()
+
+    def release_buffers(self):
+        for buffer in self.buffers:
+            buffer.release()
+
+        self.buffers = []
+
+    def release(self):
+        self.compute_shader.release()
+        self.scan_shader.release()
+        self.release_buffers()
@@ -0,0 +1,138 @@
+from config import *
+import numpy as np
+from shader_program import get_compute_shader
+
+# -----------------------------------------------------------------------------------------------------------
+
+def get_capacity(nb_body, max_body=MAX_BODY):
+    # bodies the compute shader buffers hold, room for the spawned ones
+    return max(nb_body, max_body)
+
+def make_buffer(ctx, bodies, capacity):
+    # Body SSBO of capacity bodies, the first ones from bodies, zeros behind
+    ssbo = ctx.buffer(reserve=capacity * 64)
+    ssbo.clear()
+    ssbo.write(np.ascontiguousarray(bodies, dtype='f4'))
+
+    return ssbo
+
+class GPUCount:
+    # body count of the Body SSBO on the GPU (binding 4), the dispatch and draw arguments that follow it and
+    # the passes that change it without reading it back: append (spawn) and atomic compaction (remove)
+
+    # count_cs.glsl
+    PASS_ARGS    = 0
+    PASS_SPAWN   = 1
+    PASS_COMPACT = 2
+    PASS_KEEP    = 3
+
+    # int nb_body, uint max_radius, uint dispatch[3], uint draw[4], int nb_keep, int next_id
+    SIZE            = 44
+    DISPATCH_OFFSET = 8
+    DRAW_FIRST      = 1 # render_indirect(first=) counts 20 byte commands: the draw arguments are at 20
+    KEEP_OFFSET     = 36
+
+    def __init__(self, ctx, ssbo, capacity, group_size=XGROUPSIZE):
+        self.ctx = ctx
+        self.ssbo = ssbo
+        self.capacity = capacity
+        self.group_size = group_size
+
+        # same local size as the n-body shaders: COMPACT runs on their dispatch arguments
+        values = {"XGROUPSIZE" : group_size,
+                  "YGROUPSIZE" : 1,
+                  "ZGROUPSIZE" : 1}
+
+        self.compute_shader = get_compute_shader(ctx, "count", values)
+        self.compute_shader['capacity'] = capacity
+        self.compute_shader['group_size'] = group_size
+
+        self.buffer = ctx.buffer(reserve=self.SIZE)
+
+        # allocated on the first remove() / spawn()
+        self.ssbo_out = None
+        self.ssbo_spawn = None
+
+    def set_count(self, nb_body, next_id):
+        # a new set of bodies from the CPU
+        count = np.zeros(self.SIZE // 4, dtype='i4')
+        count[0] = nb_body
+        count[-1] = next_id
+        self.buffer.write(count)
+
+        self.update_args()
+
+    def dispatch(self, pass_id, group_x=1):
+        self.compute_shader['pass_id'] = pass_id
+        self.compute_shader.run(group_x=group_x, group_y=1, group_z=1)
+        self.ctx.memory_barrier()
+
+    def run_indirect(self, compute_shader):
+        # one invocation per body of the GPU count
+        compute_shader.run_indirect(self.buffer, offset=self.DISPATCH_OFFSET)
+
+    def render(self, vao, mode):
+        vao.render_indirect(self.buffer, mode, count=1, first=self.DRAW_FIRST)
+
+    def update_args(self):
+        # after a pass that changed the count (collide_cs.glsl)
+        self.buffer.bind_to_storage_buffer(4)
+        self.dispatch(self.PASS_ARGS)
+
+    def spawn(self, bodies):
+        # append bodies behind the last one, new body IDs, the ones past the capacity are dropped
+        bodies = np.ascontiguousarray(bodies, dtype='f4').reshape(-1, 16)
+        nb_spawn = bodies.shape[0]
+
+        if nb_spawn == 0:
+            return
+
+        if self.ssbo_spawn is None or self.ssbo_spawn.size < bodies.nbytes:
+            if self.ssbo_spawn is not None:
+                self.ssbo_spawn.release()
+            self.ssbo_spawn = self.ctx.buffer(reserve=bodies.nbytes)
+
+        self.ssbo_spawn.write(bodies)
+
+        self.ssbo.bind_to_storage_buffer(0)
+        self.ssbo_spawn.bind_to_storage_buffer(2)
+        self.buffer.bind_to_storage_buffer(4)
+
+        self.compute_shader['nb_spawn'] = nb_spawn
+        self.dispatch(self.PASS_SPAWN, (nb_spawn + self.group_size - 1) // self.group_size)
+        self.dispatch(self.PASS_ARGS)
+
+    def remove(self, remove_radius=0.0):
+        # keep the bodies with mass within remove_radius of the origin (0 = any distance), order not kept
+        if self.ssbo_out is None:
+            self.ssbo_out = self.ctx.buffer(reserve=self.capacity * 64)
+
+        self.ssbo.bind_to_storage_buffer(0)
+        self.ssbo_out.bind_to_storage_buffer(1)
+        self.buffer.bind_to_storage_buffer(4)
+
+        self.ssbo_out.clear()
+        self.buffer.write(np.zeros(1, dtype='i4'), offset=self.KEEP_OFFSET)
+
+        self.compute_shader['remove_radius'] = remove_radius
+        self.compute_shader['pass_id'] = self.PASS_COMPACT
+        self.run_indirect(self.compute_shader)
+        self.ctx.memory_barrier()
+
+        self.dispatch(self.PASS_KEEP)
+
+        # zeros behind the bodies left
+        self.ctx.copy_buffer(self.ssbo, self.ssbo_out, size=self.capacity * 64)
+        self.ctx.memory_barrier()
+
+    def get_count(self):
+        # reads the GPU: reports and checkpoints only
+        return int(np.frombuffer(self.buffer.read(size=4), dtype='i4')[0])
+
+    def release(self):
+        self.compute_shader.release()
+        self.buffer.release()
+
+        for buffer in (self.ssbo_out, self.ssbo_spawn):
+            if buffer is not None:
+                buffer.release()
@@ -0,0 +1,272 @@
+from config import *
+import numpy as np
+import integrators
+import gravity
+import block_timestep
+from gpu_collision import GPUCollision
+from gpu_count import GPUCount
+from gpu_sph import GPUSPH
+from shader_program import get_compute_shader
+
+# -----------------------------------------------------------------------------------------------------------
+
+class GPUSimulation:
+    # compute shader integrator on the Body SSBO, shared by the pygame app and the headless runner
+
+    # nbody_block_cs.glsl
+    PASS_INIT  = 0
+    PASS_OPEN  = 1
+    PASS_FORCE = 2
+    PASS_CLOSE = 3
+
+    # nbody_cs.glsl
+    PASS_ACC        = 0
+    PASS_KICK_DRIFT = 1
+    PASS_KICK       = 2
+    PASS_ACC_JERK   = 3
+    PASS_PREDICT    = 4
+    PASS_CORRECT    = 5
+
+    def __init__(self, ctx, ssbo, nb_body, block_timesteps=BLOCK_TIMESTEPS, dt=DT, eps2=EPS2, integrator=INTEGRATOR,
+                 collisions=COLLISIONS, precision=PRECISION, fluid=SPH, tiled=CS_TILED, group_size=XGROUPSIZE,
+                 remove_radius=REMOVE_RADIUS):
+        self.ctx = ctx
+        self.ssbo = ssbo
+        self.group_size = group_size
+        self.remove_radius = remove_radius
+
+        # bodies the ssbo holds, the count on the GPU grows up to it
+        self.capacity = ssbo.size // 64
+        self.block_timesteps = block_timesteps
+        self.integrator = integrator
+
+        if not block_timesteps and integrator not in integrators.INTEGRATORS:
+            raise ValueError(f"unknown INTEGRATOR: {integrator}")
+
+        if block_timesteps and collisions:
+            raise ValueError("COLLISIONS needs a global timestep, BLOCK_TIMESTEPS = 0")
+
+        if block_timesteps and remove_radius:
+            raise ValueError("REMOVE_RADIUS needs a global timestep, BLOCK_TIMESTEPS = 0")
+
+        if fluid and (block_timesteps or collisions or integrator not in integrators.WEIGHTS):
+            raise ValueError("SPH needs a symplectic INTEGRATOR, BLOCK_TIMESTEPS = 0 and COLLISIONS = 0")
+
+        if precision not in gravity.PRECISIONS:
+            raise ValueError(f"unknown PRECISION: {precision}")
+
+        # only the workgroup size, the precision and the tiling are compiled in, body count / dt / eps2 are uniforms
+        # (group_size: local size x of the n-body shaders, see autotune.py)
+        values = {"XGROUPSIZE" : group_size,
+                  "YGROUPSIZE" : YGROUPSIZE,
+                  "ZGROUPSIZE" : ZGROUPSIZE,
+                  "PRECISION"  : gravity.PRECISIONS.index(precision),
+                  "TILED"      : int(bool(tiled))}
+
+        # vec4 jerk (w = level with block timesteps), Hermite also keeps the state at the start of the step
+        self.ssbo_step = None
+        self.ssbo_start = None
+        self.use_jerk = block_timesteps or integrator == "hermite4"
+
+        if block_timesteps:
+            self.compute_shader = get_compute_shader(ctx, "nbody_block", values)
+            # levels counted from the largest step, dt is set to it
+            self.compute_shader['max_level'] = block_timestep.get_depth()
+            self.compute_shader['eta'] = BLOCK_ETA
+        else:
+            self.compute_shader = get_compute_shader(ctx, "nbody", values)
+
+        # nbody_cs.glsl reads the body count from the GPU and is dispatched on it, see gpu_count.py
+        self.count = None if block_timesteps else GPUCount(ctx, ssbo, self.capacity, group_size)
+        self.ssbo_count = None if block_timesteps else self.count.buffer
+        self.collision = None
+        self.sph = None
+
+        self.set_params(nb_body, dt, eps2)
+
+        # sized for the capacity, dispatched on it: the invocations past the GPU count return at once
+        if collisions:
+            self.collision = GPUCollision(ctx, ssbo, self.ssbo_count, self.capacity, group_size=group_size)
+
+        # SPH forces instead of the direct sum
+        if fluid:
+            self.sph = GPUSPH(ctx, ssbo, self.ssbo_count, self.capacity, group_size=group_size)
+
+    def set_params(self, nb_body=None, dt=None, eps2=None):
+        # the ssbo must hold at least nb_body bodies, nothing is recompiled
+        if nb_body is not None:
+            self.nb_body = nb_body
+
+            # every invocation checks the body count, round up (block timesteps, the others are indirect)
+            self.group_x = max(1, (nb_body + self.group_size - 1) // self.group_size)
+
+            if self.block_timesteps:
+                self.compute_shader['nb_body'] = nb_body
+            else:
+                # spawned bodies get the IDs after the last one of the set
+                ids = np.frombuffer(self.ssbo.read(size=nb_body * 64), dtype='f4').reshape(-1, 16)[:, BODY_ID]
+                self.count.set_count(nb_body, int(ids.max()) + 1 if nb_body else 0)
+
+            if self.sph is not None:
+                self.sph.set_capacity(self.capacity)
+
+            if self.use_jerk and self.ssbo_step is None:
+                self.ssbo_step = self.ctx.buffer(reserve=self.capacity * 16)
+                self.ssbo_step.clear()
+
+                if not self.block_timesteps:
+                    self.ssbo_start = self.ctx.buffer(reserve=self.capacity * 64)
+
+            # acc (jerk, levels) of the new set of bodies
+            self.initialized = False
+
+        if dt is not None:
+            self.dt = dt
+            self.compute_shader['dt'] = block_timestep.get_block_dt(dt) if self.block_timesteps else dt
+
+        if eps2 is not None:
+            if self.block_timesteps and eps2 <= 0.0:
+                raise ValueError("BLOCK_TIMESTEPS needs a softening length, EPS > 0")
+
+            self.eps2 = eps2
+            self.compute_shader['eps2'] = eps2
+
+    def dispatch(self, pass_id, **uniforms):
+        self.compute_shader['pass_id'] = pass_id
+        for name, value in uniforms.items():
+            self.compute_shader[name] = value
+
+        if self.count is not None:
+            self.count.run_indirect(self.compute_shader)
+        else:
+            self.compute_shader.run(group_x=self.group_x, group_y=1, group_z=1)
+
+        # next pass reads what this one wrote
+        self.ctx.memory_barrier()
+
+    def accel(self):
+        if self.sph is not None:
+            self.sph.accel()
+        else:
+            self.dispatch(self.PASS_ACC)
+
+    def step(self):
+        self.ssbo.bind_to_storage_buffer(0)
+
+        if self.ssbo_step is not None:
+            self.ssbo_step.bind_to_storage_buffer(2)
+
+        if self.block_timesteps:
+            self.block_step()
+            return
+
+        self.ssbo_count.bind_to_storage_buffer(4)
+
+        if self.integrator == "hermite4":
+            self.hermite_step()
+        else:
+            self.symplectic_step(integrators.WEIGHTS[self.integrator])
+
+        if self.collision is not None:
+            self.collision.collide()
+            self.count.update_args()
+
+            # jerk of the merged bodies
+            if self.integrator == "hermite4":
+                self.initialized = False
+
+        if self.remove_radius:
+            self.count.remove(self.remove_radius)
+
+            # jerk of the moved bodies
+            if self.integrator == "hermite4":
+                self.initialized = False
+
+    def spawn(self, bodies):
+        # (k, 16) bodies appended on the GPU, dropped past the capacity
+        if self.count is None:
+            raise ValueError("spawning needs a global timestep, BLOCK_TIMESTEPS = 0")
+
+        self.count.spawn(bodies)
+
+        # acc (jerk) of the new bodies
+        self.initialized = False
+
+    def render(self, vao, mode):
+        # one vertex per body of the GPU count, no read back
+        if self.count is not None:
+            self.count.render(vao, mode)
+        else:
+            vao.render(mode, vertices=self.nb_body)
+
+    def symplectic_step(self, weights):
+        # same substeps as integrators.symplectic_step, the acc is kept in the SSBO between steps
+        if not self.initialized:
+            self.accel()
+            self.initialized = True
+
+        w_prev = 0.0
+        for w in weights:
+            self.dispatch(self.PASS_KICK_DRIFT, kick=0.5 * (w_prev + w) * self.dt, drift=w * self.dt)
+            self.accel()
+            w_prev = w
+
+        self.dispatch(self.PASS_KICK, kick=0.5 * w_prev * self.dt)
+
+    def hermite_step(self):
+        self.ssbo_start.bind_to_storage_buffer(3)
+
+        if not self.initialized:
+            self.dispatch(self.PASS_ACC_JERK)
+            self.initialized = True
+
+        self.dispatch(self.PASS_PREDICT)
+        self.dispatch(self.PASS_ACC_JERK)
+        self.dispatch(self.PASS_CORRECT)
+
+    def block_step(self):
+        if not self.initialized:
+            self.dispatch(self.PASS_INIT)
+            self.initialized = True
+
+        # advances block_timestep.get_block_dt(dt)
+        for s in range(1 << block_timestep.get_depth()):
+            self.dispatch(self.PASS_OPEN, substep=s)
+            self.dispatch(self.PASS_FORCE, substep=s)
+            self.dispatch(self.PASS_CLOSE, substep=s)
+
+    def get_count(self):
+        # bodies left after the collisions, reads the GPU: reports and checkpoints only
+        if self.count is None:
+            return self.nb_body
+
+        return self.count.get_count()
+
+    def get_levels(self):
+        # block timestep level of every body (diagnostics)
+        if not self.block_timesteps:
+            return None
+
+        # DT / 2^level like BLOCK_MIN_LEVEL / BLOCK_MAX_LEVEL, the shader counts from the largest step
+        levels = np.frombuffer(self.ssbo_step.read(), dtype='f4').reshape(-1, 4)[:self.nb_body, 3].astype(np.int32)
+        return levels + BLOCK_MIN_LEVEL
+
+    def release_buffers(self):
+        for buffer in (self.ssbo_step, self.ssbo_start):
+            if buffer is not None:
+                buffer.release()
+
+        self.ssbo_step = self.ssbo_start = None
+
+    def release(self):
+        self.compute_shader.release()
+        self.release_buffers()
+
+        if self.count is not None:
+            self.count.release()
+
+        if self.collision is not None:
+            self.collision.release()
+
+        if self.sph is not None:
+            self.sph.release()
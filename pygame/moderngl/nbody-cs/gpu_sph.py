@@ -0,0 +1,108 @@
+from config import *
+import numpy as np
+import sph
+from shader_program import get_compute_shader
+
+# -----------------------------------------------------------------------------------------------------------
+
+class GPUSPH:
+    # sph.accel on the Body SSBO: cell list, density and forces, the body count comes from ssbo_count
+
+    # sph_cs.glsl
+    PASS_CELL    = 0
+    PASS_SCATTER = 1
+    PASS_DENSITY = 2
+    PASS_FORCE   = 3
+
+    def __init__(self, ctx, ssbo, ssbo_count, capacity, box=SPH_BOX, group_size=XGROUPSIZE):
+        self.ctx = ctx
+        self.ssbo = ssbo
+        self.ssbo_count = ssbo_count
+        self.group_size = group_size
+
+        # local size x of the n-body shaders (autotune.py)
+        values = {"XGROUPSIZE" : group_size,
+                  "YGROUPSIZE" : YGROUPSIZE,
+                  "ZGROUPSIZE" : ZGROUPSIZE}
+
+        self.compute_shader = get_compute_shader(ctx, "sph", values)
+        self.scan_shader = get_compute_shader(ctx, "prefix_sum", {})
+
+        self.box = box
+        self.buffers = []
+        self.set_capacity(capacity)
+
+    def set_capacity(self, capacity):
+        # the smoothing length follows the particle mass: read once for a new set of particles
+        self.release_buffers()
+
+        mass = np.frombuffer(self.ssbo.read(), dtype='f4').reshape(-1, 16)[:capacity, MASS]
+        h = sph.get_smoothing_length(mass)
+        wall_width, wall_stiffness, wall_damping = sph.get_wall(h)
+
+        self.capacity = capacity
+        self.grid_size = sph.get_grid_size(h, self.box)
+        self.nb_cell = self.grid_size ** 3
+        self.group_x = max(1, (capacity + self.group_size - 1) // self.group_size)
+
+        self.ssbo_fluid = self.ctx.buffer(reserve=capacity * 8)
+        self.ssbo_cells = self.ctx.buffer(reserve=(self.nb_cell + 1) * 4)
+        self.ssbo_cursor = self.ctx.buffer(reserve=self.nb_cell * 4)
+        self.ssbo_grid = self.ctx.buffer(reserve=capacity * 8)
+        self.buffers = [self.ssbo_fluid, self.ssbo_cells, self.ssbo_cursor, self.ssbo_grid]
+
+        uniforms = {
+            "h"              : h,
+            "half_box"       : 0.5 * self.box,
+            "inv_cell"       : self.grid_size / self.box,
+            "grid_size"      : self.grid_size,
+            "rest_density"   : SPH_REST_DENSITY,
+            "stiffness"      : SPH_STIFFNESS,
+            "viscosity"      : SPH_VISCOSITY,
+            "gravity"        : SPH_GRAVITY,
+            "wall_width"     : wall_width,
+            "wall_stiffness" : wall_stiffness,
+            "wall_damping"   : wall_damping,
+        }
+        for name, value in uniforms.items():
+            self.compute_shader[name] = value
+
+    def dispatch(self, pass_id):
+        self.compute_shader['pass_id'] = pass_id
+        self.compute_shader.run(group_x=self.group_x, group_y=1, group_z=1)
+        self.ctx.memory_barrier()
+
+    def accel(self):
+        self.ssbo.bind_to_storage_buffer(0)
+        self.ssbo_fluid.bind_to_storage_buffer(2)
+        self.ssbo_count.bind_to_storage_buffer(4)
+        self.ssbo_cells.bind_to_storage_buffer(5)
+        self.ssbo_cursor.bind_to_storage_buffer(6)
+        self.ssbo_grid.bind_to_storage_buffer(7)
+
+        self.ssbo_cells.clear()
+        self.dispatch(self.PASS_CELL)
+
+        # exclusive prefix sum of the counts, total in cell_start[nb_cell]
+        self.ssbo_cells.bind_to_storage_buffer(3)
+        self.scan_shader['n'] = self.nb_cell
+        self.scan_shader.run(group_x=1, group_y=1, group_z=1)
+        self.ctx.memory_barrier()
+
+        self.ctx.copy_buffer(self.ssbo_cursor, self.ssbo_cells, size=self.nb_cell * 4)
+        self.ctx.memory_barrier()
+
+        self.dispatch(self.PASS_SCATTER)
+        self.dispatch(self.PASS_DENSITY)
+        self.dispatch(self.PASS_FORCE)
+
+    def release_buffers(self):
+        for buffer in self.buffers:
+            buffer.release()
+
+        self.buffers = []
+
+    def release(self):
+        self.compute_shader.release()
+        self.scan_shader.release()
+        self.release_buffers()
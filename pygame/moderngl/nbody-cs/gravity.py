@@ -0,0 +1,360 @@
+from config import *
+import numpy as np
+import math
+from jit import numba
+import barnes_hut
+import block_timestep
+import particle_mesh
+import fmm
+import integrators
+import collision
+import sph
+import numpy_blocked
+from body_store import BodyStore
+
+# -----------------------------------------------------------------------------------------------------------
+# CPU kernels, all working on the BodyStore arrays
+#
+# pair math stays in float32 like in the compute shader: mixing in float64 literals keeps LLVM from
+# vectorizing the inner loops
+
+@numba.njit(fastmath=True, nogil=True)
+def accel_direct(x, y, z, m, ax, ay, az, pot, eps2):
+    n = x.shape[0]
+    eps2 = np.float32(eps2)
+
+    # O2
+    for i in range(n):
+        for j in range(n):
+            if i != j:
+                DRX = x[j] - x[i]
+                DRY = y[j] - y[i]
+                DRZ = z[j] - z[i]
+
+                DR2 = DRX * DRX + DRY * DRY + DRZ * DRZ
+                DR2 += eps2
+
+                PHI = m[j] / (math.sqrt(DR2) * DR2)
+
+                ax[i] += DRX * PHI
+                ay[i] += DRY * PHI
+                az[i] += DRZ * PHI
+
+                pot[i] -= PHI * DR2
+
+@numba.njit(fastmath=True, nogil=True)
+def self_pot(m, eps2):
+    # potential term of a body on itself in the sums over every j, none when unsoftened (j = i skipped)
+    return m / math.sqrt(eps2) if eps2 > 0.0 else np.float32(0.0)
+
+@numba.njit(fastmath=True, parallel=True, nogil=True)
+def accel_parallel(x, y, z, m, ax, ay, az, pot, eps2):
+    n = x.shape[0]
+    eps2 = np.float32(eps2)
+    ZERO = np.float32(0.0)
+
+    # O2, one body per iteration: every thread accumulates in registers and only writes its own body
+    for i in numba.prange(n):
+        PIX, PIY, PIZ = x[i], y[i], z[i]
+        AX = AY = AZ = POT = np.float32(0.0)
+
+        for j in range(n):
+            DRX = x[j] - PIX
+            DRY = y[j] - PIY
+            DRZ = z[j] - PIZ
+
+            DR2 = DRX * DRX + DRY * DRY + DRZ * DRZ
+            DR2 += eps2
+
+            # j = i with eps2 = 0 is 0 / 0: skipped by a select, a branch on j == i stops the vectorizer (2x)
+            PHI = m[j] / (math.sqrt(DR2) * DR2) if DR2 > ZERO else ZERO
+
+            AX += DRX * PHI
+            AY += DRY * PHI
+            AZ += DRZ * PHI
+
+            POT += PHI * DR2
+
+        # the self term is in the sums when eps2 > 0: zero force (dr = 0), softened potential m_i / eps
+        ax[i] += AX
+        ay[i] += AY
+        az[i] += AZ
+
+        pot[i] -= POT - self_pot(m[i], eps2)
+
+# -----------------------------------------------------------------------------------------------------------
+# Force accumulation precision (PRECISION), direct sum kernels: pair math in float32 in every mode
+#
+#   f32   : float32 sums, the rounding error of the N terms grows with N
+#   f64   : float64 sums of the float32 terms, still vectorized
+#   kahan : float32 sums with a compensation term (Kahan), no reassociation allowed in the inner loop
+#           so it does not vectorize
+#
+# the sum is the only error that grows with N, dr and 1 / r^3 are float32 in the compute shader too.
+# The vectorized float32 loop already sums in 8 / 16 lanes, direct and the compute shader sum serially.
+# direct runs its own single threaded f64 / kahan loops, parallel one body per thread.
+# The sum error is far below the timestep error, so f64 / kahan only help long runs at small dt
+
+PRECISIONS = ("f32", "f64", "kahan")
+
+# fastmath without reassoc: LLVM would simplify (t - sum) - y to 0
+KAHAN_FASTMATH = {"nnan", "ninf", "nsz", "arcp", "contract", "afn"}
+
+def accel_f64(x, y, z, m, ax, ay, az, pot, eps2):
+    n = x.shape[0]
+    eps2 = np.float32(eps2)
+    ZERO = np.float32(0.0)
+
+    for i in numba.prange(n):
+        PIX, PIY, PIZ = x[i], y[i], z[i]
+        AX = AY = AZ = POT = 0.0
+
+        for j in range(n):
+            DRX = x[j] - PIX
+            DRY = y[j] - PIY
+            DRZ = z[j] - PIZ
+
+            DR2 = DRX * DRX + DRY * DRY + DRZ * DRZ
+            DR2 += eps2
+
+            PHI = m[j] / (math.sqrt(DR2) * DR2) if DR2 > ZERO else ZERO
+
+            AX += np.float64(DRX * PHI)
+            AY += np.float64(DRY * PHI)
+            AZ += np.float64(DRZ * PHI)
+
+            POT += np.float64(PHI * DR2)
+
+        ax[i] += AX
+        ay[i] += AY
+        az[i] += AZ
+
+        pot[i] -= POT - self_pot(m[i], eps2)
+
+def accel_kahan(x, y, z, m, ax, ay, az, pot, eps2):
+    n = x.shape[0]
+    eps2 = np.float32(eps2)
+    ZERO = np.float32(0.0)
+
+    for i in numba.prange(n):
+        PIX, PIY, PIZ = x[i], y[i], z[i]
+        AX = AY = AZ = POT = np.float32(0.0)
+        CX = CY = CZ = CP = np.float32(0.0)
+
+        for j in range(n):
+            DRX = x[j] - PIX
+            DRY = y[j] - PIY
+            DRZ = z[j] - PIZ
+
+            DR2 = DRX * DRX + DRY * DRY + DRZ * DRZ
+            DR2 += eps2
+
+            PHI = m[j] / (math.sqrt(DR2) * DR2) if DR2 > ZERO else ZERO
+
+            # C: low order bits lost by the last addition, subtracted from the next term
+            YX = DRX * PHI - CX
+            TX = AX + YX
+            CX = (TX - AX) - YX
+            AX = TX
+
+            YY = DRY * PHI - CY
+            TY = AY + YY
+            CY = (TY - AY) - YY
+            AY = TY
+
+            YZ = DRZ * PHI - CZ
+            TZ = AZ + YZ
+            CZ = (TZ - AZ) - YZ
+            AZ = TZ
+
+            YP = PHI * DR2 - CP
+            TP = POT + YP
+            CP = (TP - POT) - YP
+            POT = TP
+
+        ax[i] += AX
+        ay[i] += AY
+        az[i] += AZ
+
+        pot[i] -= POT - self_pot(m[i], eps2)
+
+# parallel: one body per thread; direct: the same loops on the calling thread (prange runs as range)
+accel_parallel_f64   = numba.njit(fastmath=True, parallel=True, nogil=True)(accel_f64)
+accel_parallel_kahan = numba.njit(fastmath=KAHAN_FASTMATH, parallel=True, nogil=True)(accel_kahan)
+accel_direct_f64     = numba.njit(fastmath=True, nogil=True)(accel_f64)
+accel_direct_kahan   = numba.njit(fastmath=KAHAN_FASTMATH, nogil=True)(accel_kahan)
+
+@numba.njit(fastmath=True, nogil=True)
+def accel_symmetric(x, y, z, m, ax, ay, az, eps2, tile_size):
+    n = x.shape[0]
+    eps2 = np.float32(eps2)
+    ONE = np.float32(1.0)
+
+    # O2 / 2, every unordered pair once (Newton 3rd law), tile by tile so both tiles stay in cache
+    for ti in range(0, n, tile_size):
+        ti_end = min(ti + tile_size, n)
+
+        for tj in range(ti, n, tile_size):
+            tj_end = min(tj + tile_size, n)
+
+            for i in range(ti, ti_end):
+                PIX, PIY, PIZ, MI = x[i], y[i], z[i], m[i]
+                AX = AY = AZ = np.float32(0.0)
+
+                # unsigned index: no negative index wrap around in the inner loop
+                for j in range(np.uintp(i + 1 if tj == ti else tj), np.uintp(tj_end)):
+                    DRX = x[j] - PIX
+                    DRY = y[j] - PIY
+                    DRZ = z[j] - PIZ
+
+                    DR2 = DRX * DRX + DRY * DRY + DRZ * DRZ
+                    DR2 += eps2
+
+                    INV_DR3 = ONE / (math.sqrt(DR2) * DR2)
+                    PHI_I = m[j] * INV_DR3
+                    PHI_J = MI * INV_DR3
+
+                    AX += DRX * PHI_I
+                    AY += DRY * PHI_I
+                    AZ += DRZ * PHI_I
+
+                    ax[j] -= DRX * PHI_J
+                    ay[j] -= DRY * PHI_J
+                    az[j] -= DRZ * PHI_J
+
+                ax[i] += AX
+                ay[i] += AY
+                az[i] += AZ
+
+@numba.njit(fastmath=True, parallel=True, nogil=True)
+def accel_sample(x, y, z, m, sample, ax, ay, az, eps2):
+    # float64 direct sum for the sampled bodies only: reference for the approximate kernels
+    n = x.shape[0]
+
+    for k in numba.prange(sample.shape[0]):
+        i = sample[k]
+        AX = AY = AZ = 0.0
+
+        for j in range(n):
+            if i != j:
+                DRX = np.float64(x[j]) - x[i]
+                DRY = np.float64(y[j]) - y[i]
+                DRZ = np.float64(z[j]) - z[i]
+
+                DR2 = DRX * DRX + DRY * DRY + DRZ * DRZ + eps2
+                PHI = m[j] / (math.sqrt(DR2) * DR2)
+
+                AX += DRX * PHI
+                AY += DRY * PHI
+                AZ += DRZ * PHI
+
+        ax[k], ay[k], az[k] = AX, AY, AZ
+
+# -----------------------------------------------------------------------------------------------------------
+
+# estimator of the potential each kernel leaves in BodyStore.pot, see diagnostics.py. None: the
+# diagnostics do the exact pass, the particle mesh potential carries the CIC self term and the mesh
+# bias of the node sampled Green's function (~7% of W on a plummer sphere)
+POT_SOURCES = {
+    "direct"        : "direct",
+    "parallel"      : "direct",
+    "numpy_blocked" : "direct",
+    "barnes_hut"    : "barnes_hut",
+    "fmm"           : "fmm",
+}
+
+def calc_acc(store, kernel=NBODY_KERNEL, eps2=EPS2, precision=PRECISION):
+    s = store
+
+    if precision not in PRECISIONS:
+        raise ValueError(f"unknown PRECISION: {precision}")
+
+    # potential of every body at the new positions, picked up by the diagnostics;
+    # not in the symmetric kernel: the extra scatter costs ~30% there
+    s.pot.fill(0.0)
+    s.pot_source = POT_SOURCES.get(kernel)
+
+    # the kernels accumulate
+    s.ax.fill(0.0)
+    s.ay.fill(0.0)
+    s.az.fill(0.0)
+
+    if kernel == "direct" and precision == "f64":
+        accel_direct_f64(s.x, s.y, s.z, s.mass, s.ax, s.ay, s.az, s.pot, eps2)
+    elif kernel == "direct" and precision == "kahan":
+        accel_direct_kahan(s.x, s.y, s.z, s.mass, s.ax, s.ay, s.az, s.pot, eps2)
+    elif kernel == "parallel" and precision == "f64":
+        accel_parallel_f64(s.x, s.y, s.z, s.mass, s.ax, s.ay, s.az, s.pot, eps2)
+    elif kernel == "parallel" and precision == "kahan":
+        accel_parallel_kahan(s.x, s.y, s.z, s.mass, s.ax, s.ay, s.az, s.pot, eps2)
+    elif kernel == "direct":
+        accel_direct(s.x, s.y, s.z, s.mass, s.ax, s.ay, s.az, s.pot, eps2)
+    elif kernel == "parallel":
+        accel_parallel(s.x, s.y, s.z, s.mass, s.ax, s.ay, s.az, s.pot, eps2)
+    elif kernel == "symmetric":
+        accel_symmetric(s.x, s.y, s.z, s.mass, s.ax, s.ay, s.az, eps2, TILE_SIZE)
+    elif kernel == "barnes_hut":
+        barnes_hut.accel(s.x, s.y, s.z, s.mass, s.ax, s.ay, s.az, s.pot, eps2, BH_THETA, BH_LEAF_SIZE)
+    elif kernel == "particle_mesh":
+        particle_mesh.accel(s.x, s.y, s.z, s.mass, s.ax, s.ay, s.az, s.pot, eps2, PM_GRID)
+    elif kernel == "fmm":
+        fmm.accel(s.x, s.y, s.z, s.mass, s.ax, s.ay, s.az, s.pot, eps2, FMM_THETA, FMM_ORDER, FMM_LEAF_SIZE)
+    elif kernel == "numpy_blocked":
+        numpy_blocked.accel(s.x, s.y, s.z, s.mass, s.ax, s.ay, s.az, s.pot, eps2, NUMPY_TILE)
+    else:
+        raise ValueError(f"unknown NBODY_KERNEL: {kernel}")
+
+def calc_bodies(store, kernel=NBODY_KERNEL, block_timesteps=BLOCK_TIMESTEPS, dt=DT, eps2=EPS2, integrator=INTEGRATOR,
+                collisions=COLLISIONS, precision=PRECISION, fluid=SPH):
+    # dt and eps2 are plain kernel arguments: compiled once for any body count and timestep
+    s = store
+
+    if fluid:
+        # SPH forces instead of gravity, kernel / eps2 / precision are not used
+        if block_timesteps or collisions or integrator not in integrators.WEIGHTS:
+            raise ValueError("SPH needs a symplectic INTEGRATOR, BLOCK_TIMESTEPS = 0 and COLLISIONS = 0")
+
+        integrators.step(s, integrator, dt, sph.accel)
+        return s
+
+    if block_timesteps:
+        if collisions:
+            raise ValueError("COLLISIONS needs a global timestep, BLOCK_TIMESTEPS = 0")
+
+        block_timestep.calc_bodies(s, dt, eps2=eps2)
+        s.acc_valid = s.jerk_valid = False
+        return s
+
+    integrators.step(s, integrator, dt, lambda s: calc_acc(s, kernel, eps2, precision), eps2)
+
+    # merged bodies leave the store, s.nb_body shrinks
+    if collisions:
+        collision.collide(s)
+
+    return s
+
+def force_error(store, kernel=NBODY_KERNEL, nb_sample=1000, rng=None, eps2=EPS2, precision=PRECISION):
+    # relative acceleration error |a - a_direct| / |a_direct| of a kernel on nb_sample random bodies,
+    # the store is left untouched
+    s = BodyStore.from_bodies(store.pack())
+    calc_acc(s, kernel, eps2, precision)
+
+    sample = np.random.default_rng(rng).choice(s.nb_body, min(nb_sample, s.nb_body), replace=False)
+    ref = np.zeros((3, sample.shape[0]), dtype=np.float64)
+    accel_sample(s.x, s.y, s.z, s.mass, sample, ref[0], ref[1], ref[2], eps2)
+
+    acc = np.stack((s.ax[sample], s.ay[sample], s.az[sample])).astype(np.float64)
+    err = np.linalg.norm(acc - ref, axis=0) / np.maximum(np.linalg.norm(ref, axis=0), 1e-30)
+
+    return {
+        "force_error_sample" : int(sample.shape[0]),
+        "force_error_median" : float(np.median(err)),
+        "force_error_p99"    : float(np.percentile(err, 99)),
+        "force_error_max"    : float(err.max()),
+    }
+
+def set_num_threads(nb_threads=NB_THREADS):
+    if nb_threads:
+        numba.set_num_threads(min(nb_threads, numba.config.NUMBA_NUM_THREADS))
+
+    return numba.get_num_threads()
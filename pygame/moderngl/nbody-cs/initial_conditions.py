@@ -0,0 +1,221 @@
+from config import *
+import numpy as np
+
+# -----------------------------------------------------------------------------------------------------------
+# Vectorized initial conditions, G = 1
+#
+# every generator fills the final (N, 16) float32 Body buffer in place:
+#    vec4 pos; // x, y, z, w = mass
+#    vec4 col; // r, g, b, a
+#    vec4 vel; // vx, vy, vz, w = radius
+#    vec4 acc; // ax, ay, az, w = bodyID
+# total_mass = None keeps the historical mass of 1 per body
+
+def new_bodies(nb_body):
+    bodies = np.zeros((nb_body, 16), dtype='f4')
+
+    bodies[:, COLR:COLA + 1] = 1.0
+    bodies[:, RADIUS]        = 1.0
+    bodies[:, BODY_ID]       = np.arange(nb_body)
+
+    return bodies
+
+def get_rng(rng=None):
+    if isinstance(rng, np.random.Generator):
+        return rng
+
+    return np.random.default_rng(rng)
+
+def random_directions(rng, n):
+    cos_t = rng.uniform(-1.0, 1.0, n)
+    sin_t = np.sqrt(1.0 - cos_t * cos_t)
+    phi   = rng.uniform(0.0, 2.0 * np.pi, n)
+
+    return np.stack((sin_t * np.cos(phi), sin_t * np.sin(phi), cos_t), axis=1)
+
+def set_masses(out, total_mass, central_mass):
+    n = out.shape[0]
+    mass = 1.0 if total_mass is None else total_mass / n
+
+    out[:, MASS] = mass
+    if central_mass:
+        out[0, MASS] = central_mass
+
+def enclosed_mass(r, m):
+    # monopole approximation: mass inside the radius of every body
+    order = np.argsort(r)
+    menc = np.empty_like(r)
+    menc[order] = np.cumsum(m[order])
+
+    return menc
+
+# -----------------------------------------------------------------------------------------------------------
+
+def uniform_ball(out, radius=8.0, total_mass=None, central_mass=100.0, rng=None):
+    # bodies at rest, uniform in a ball (the historical pickball() setup)
+    rng = get_rng(rng)
+    n = out.shape[0]
+
+    r = radius * np.cbrt(rng.uniform(0.0, 1.0, n))
+    out[:, POSX:POSZ + 1] = random_directions(rng, n) * r[:, None]
+    out[:, VELX:VELZ + 1] = 0.0
+
+    set_masses(out, total_mass, central_mass)
+
+    return out
+
+def plummer(out, scale=2.0, total_mass=None, central_mass=0.0, rng=None, r_max=20.0):
+    # Aarseth, Henon & Wielen (1974): positions from the inverse cumulative mass, speeds by rejection
+    rng = get_rng(rng)
+    n = out.shape[0]
+    total = n * 1.0 if total_mass is None else total_mass
+
+    x_max = (r_max ** 2 / (r_max ** 2 + 1.0)) ** 1.5
+    x = rng.uniform(0.0, x_max, n)
+    r = 1.0 / np.sqrt(x ** (-2.0 / 3.0) - 1.0)
+
+    # g(q) = q^2 (1 - q^2)^3.5, max < 0.1
+    q = np.empty(n)
+    todo = np.arange(n)
+    while todo.size:
+        qt = rng.uniform(0.0, 1.0, todo.size)
+        keep = rng.uniform(0.0, 0.1, todo.size) < qt * qt * (1.0 - qt * qt) ** 3.5
+        q[todo[keep]] = qt[keep]
+        todo = todo[~keep]
+
+    v = q * np.sqrt(2.0) * (1.0 + r * r) ** -0.25
+
+    # to physical units: length scale, speed sqrt(G M / a)
+    out[:, POSX:POSZ + 1] = random_directions(rng, n) * (r * scale)[:, None]
+    out[:, VELX:VELZ + 1] = random_directions(rng, n) * (v * np.sqrt(total / scale))[:, None]
+
+    set_masses(out, total_mass, central_mass)
+
+    return out
+
+def hernquist(out, scale=2.0, total_mass=None, central_mass=0.0, rng=None, r_max=40.0):
+    # Hernquist (1990): M(r) = M r^2 / (r + a)^2, isotropic gaussian velocities from the jeans dispersion
+    rng = get_rng(rng)
+    n = out.shape[0]
+    total = n * 1.0 if total_mass is None else total_mass
+    a = scale
+
+    s_max = r_max / (r_max + a)
+    s = np.sqrt(rng.uniform(0.0, s_max * s_max, n))
+    r = a * s / (1.0 - s)
+
+    u = r / a
+    sigma2 = total / (12.0 * a) * (12.0 * u * (1.0 + u) ** 3 * np.log((1.0 + u) / np.maximum(u, 1e-9))
+                                   - u / (1.0 + u) * (25.0 + 52.0 * u + 42.0 * u * u + 12.0 * u ** 3))
+    sigma = np.sqrt(np.maximum(sigma2, 0.0))
+
+    vel = rng.normal(0.0, 1.0, (n, 3)) * sigma[:, None]
+
+    # bound bodies only
+    v_esc = np.sqrt(2.0 * total / (r + a))
+    speed = np.linalg.norm(vel, axis=1)
+    too_fast = speed > 0.95 * v_esc
+    vel[too_fast] *= (0.95 * v_esc[too_fast] / speed[too_fast])[:, None]
+
+    out[:, POSX:POSZ + 1] = random_directions(rng, n) * r[:, None]
+    out[:, VELX:VELZ + 1] = vel
+
+    set_masses(out, total_mass, central_mass)
+
+    return out
+
+def exponential_disk(out, scale_length=3.0, scale_height=0.3, total_mass=None, central_mass=100.0, rng=None,
+                     r_max=24.0, dispersion=0.05):
+    # sigma(R) ~ exp(-R / Rd) (gamma distribution of shape 2), sech^2 vertical profile,
+    # circular speed from the enclosed mass (rotation curve) plus a small random dispersion
+    rng = get_rng(rng)
+    n = out.shape[0]
+
+    R = rng.gamma(2.0, scale_length, n)
+    R = np.where(R > r_max, rng.uniform(0.0, r_max, n), R)
+    phi = rng.uniform(0.0, 2.0 * np.pi, n)
+    z = scale_height * np.arctanh(rng.uniform(-0.999, 0.999, n))
+
+    if central_mass:
+        R[0] = z[0] = 0.0
+
+    set_masses(out, total_mass, central_mass)
+
+    # softened monopole: v^2 = R F_R = M(<r) R^2 / (r^2 + eps^2)^1.5
+    r2 = R * R + z * z
+    v_circ = R * np.sqrt(enclosed_mass(np.sqrt(r2), out[:, MASS].astype(np.float64)) / (r2 + EPS2) ** 1.5)
+
+    out[:, POSX] = R * np.cos(phi)
+    out[:, POSY] = R * np.sin(phi)
+    out[:, POSZ] = z
+
+    out[:, VELX] = -v_circ * np.sin(phi)
+    out[:, VELY] =  v_circ * np.cos(phi)
+    out[:, VELZ] = 0.0
+    out[:, VELX:VELZ + 1] += rng.normal(0.0, dispersion, (n, 3)) * v_circ[:, None]
+
+    if central_mass:
+        out[0, VELX:VELZ + 1] = 0.0
+
+    return out
+
+def galaxy_collision(out, separation=30.0, approach_speed=4.0, inclination=60.0, rng=None, **disk):
+    # two exponential disks on a collision course, the second one tilted around the x axis
+    rng = get_rng(rng)
+    n = out.shape[0]
+    half = n // 2
+
+    for galaxy, offset, sign in ((out[:half], -0.5, 1.0), (out[half:], 0.5, -1.0)):
+        exponential_disk(galaxy, rng=rng, **disk)
+
+        if sign < 0.0:
+            t = np.radians(inclination)
+            c, s = np.cos(t), np.sin(t)
+            for lo in (POSX, VELX):
+                y, z = galaxy[:, lo + 1].copy(), galaxy[:, lo + 2].copy()
+                galaxy[:, lo + 1] = c * y - s * z
+                galaxy[:, lo + 2] = s * y + c * z
+
+        galaxy[:, POSX] += offset * separation
+        galaxy[:, POSY] += offset * separation * 0.25
+        galaxy[:, VELX] += sign * 0.5 * approach_speed
+
+    return out
+
+def dam(out, box=SPH_BOX, fill=(0.5, 0.75, 1.0), rest_density=SPH_REST_DENSITY, rng=None, **unused):
+    # SPH dam break: a block of fluid at rest in the -x, -y corner of the box, jittered lattice
+    rng = get_rng(rng)
+    n = out.shape[0]
+
+    size = box * np.array(fill)
+    spacing = np.cbrt(np.prod(size) / n)
+    counts = np.maximum(np.ceil(size / spacing).astype(int), 1)
+
+    idx = np.arange(n)
+    cell = np.stack((idx % counts[0], (idx // counts[0]) % counts[1], idx // (counts[0] * counts[1])), axis=1)
+
+    out[:, POSX:POSZ + 1] = -0.5 * box + (cell + 0.5 + rng.uniform(-0.02, 0.02, (n, 3))) * spacing
+    out[:, VELX:VELZ + 1] = 0.0
+    out[:, MASS] = rest_density * spacing ** 3
+
+    return out
+
+# -----------------------------------------------------------------------------------------------------------
+
+PRESETS = {
+    "ball"      : uniform_ball,
+    "plummer"   : plummer,
+    "hernquist" : hernquist,
+    "disk"      : exponential_disk,
+    "collision" : galaxy_collision,
+    "dam"       : dam,
+}
+
+def make_bodies(preset=IC_PRESET, nb_body=NB_BODY, rng=IC_SEED, **kwargs):
+    bodies = new_bodies(nb_body)
+    PRESETS[preset](bodies, rng=get_rng(rng), **kwargs)
+
+    # constant density: the collision radius grows with the cube root of the mass
+    bodies[:, RADIUS] = BODY_RADIUS * np.cbrt(bodies[:, MASS])
+
+    return bodies
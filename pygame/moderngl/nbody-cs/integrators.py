@@ -0,0 +1,148 @@
+from config import *
+import numpy as np
+import math
+from jit import numba
+import block_timestep
+
+# -----------------------------------------------------------------------------------------------------------
+# Global timestep integrators
+#
+#   leapfrog   kick drift kick, 2nd order symplectic, 1 force evaluation per step
+#   yoshida4   3 leapfrog substeps, 4th order symplectic, 3 force evaluations per step (Yoshida 1990)
+#   yoshida6   7 leapfrog substeps, 6th order symplectic, 7 force evaluations per step (solution A)
+#   hermite4   predictor corrector on acc + jerk, 4th order, 1 direct sum acc + jerk per step
+#              (Makino & Aarseth 1992), not symplectic: the energy error drifts slowly instead of
+#              oscillating, but it stays far below the leapfrog error at the same DT
+#
+# the acceleration at the current positions is kept between steps (acc_valid), so the closing kick of
+# a substep and the opening kick of the next one are a single kick
+
+def yoshida_weights(order):
+    # symmetric composition of leapfrog substeps, the weights sum to 1
+    if order == 4:
+        cbrt2 = 2.0 ** (1.0 / 3.0)
+        w1 = 1.0 / (2.0 - cbrt2)
+        w0 = -cbrt2 / (2.0 - cbrt2)
+        return (w1, w0, w1)
+
+    w1, w2, w3 = -1.17767998417887, 0.235573213359357, 0.784513610477560
+    w0 = 1.0 - 2.0 * (w1 + w2 + w3)
+    return (w3, w2, w1, w0, w1, w2, w3)
+
+WEIGHTS = {
+    "leapfrog" : (1.0,),
+    "yoshida4" : yoshida_weights(4),
+    "yoshida6" : yoshida_weights(6),
+}
+
+INTEGRATORS = tuple(WEIGHTS) + ("hermite4",)
+
+def get_force_evals(integrator):
+    # force evaluations per step
+    return len(WEIGHTS.get(integrator, (1.0,)))
+
+# -----------------------------------------------------------------------------------------------------------
+
+# array expressions: a fused loop with numba, still vectorized by NumPy without it (jit.py)
+@numba.njit(fastmath=True, nogil=True)
+def kick_drift(x, y, z, vx, vy, vz, ax, ay, az, kick_dt, drift_dt):
+    vx += ax * kick_dt
+    vy += ay * kick_dt
+    vz += az * kick_dt
+
+    x += vx * drift_dt
+    y += vy * drift_dt
+    z += vz * drift_dt
+
+@numba.njit(fastmath=True, nogil=True)
+def kick(vx, vy, vz, ax, ay, az, kick_dt):
+    vx += ax * kick_dt
+    vy += ay * kick_dt
+    vz += az * kick_dt
+
+@numba.njit(fastmath=True, nogil=True)
+def hermite_predict(x, y, z, vx, vy, vz, ax, ay, az, jx, jy, jz, dt, start):
+    # start: x, y, z, vx, vy, vz, ax, ay, az, jx, jy, jz at the beginning of the step
+    dt2 = dt * dt / 2.0
+    dt3 = dt * dt2 / 3.0
+
+    for i in range(x.shape[0]):
+        start[0, i], start[1, i], start[2, i] = x[i], y[i], z[i]
+        start[3, i], start[4, i], start[5, i] = vx[i], vy[i], vz[i]
+        start[6, i], start[7, i], start[8, i] = ax[i], ay[i], az[i]
+        start[9, i], start[10, i], start[11, i] = jx[i], jy[i], jz[i]
+
+        x[i] += vx[i] * dt + ax[i] * dt2 + jx[i] * dt3
+        y[i] += vy[i] * dt + ay[i] * dt2 + jy[i] * dt3
+        z[i] += vz[i] * dt + az[i] * dt2 + jz[i] * dt3
+
+        vx[i] += ax[i] * dt + jx[i] * dt2
+        vy[i] += ay[i] * dt + jy[i] * dt2
+        vz[i] += az[i] * dt + jz[i] * dt2
+
+@numba.njit(fastmath=True, nogil=True)
+def hermite_correct(x, y, z, vx, vy, vz, ax, ay, az, jx, jy, jz, dt, start):
+    # ax.. jx.. at the predicted state
+    half_dt = dt / 2.0
+    dt2 = dt * dt / 12.0
+
+    for i in range(x.shape[0]):
+        vx[i] = start[3, i] + (start[6, i] + ax[i]) * half_dt + (start[9, i] - jx[i]) * dt2
+        vy[i] = start[4, i] + (start[7, i] + ay[i]) * half_dt + (start[10, i] - jy[i]) * dt2
+        vz[i] = start[5, i] + (start[8, i] + az[i]) * half_dt + (start[11, i] - jz[i]) * dt2
+
+        x[i] = start[0, i] + (start[3, i] + vx[i]) * half_dt + (start[6, i] - ax[i]) * dt2
+        y[i] = start[1, i] + (start[4, i] + vy[i]) * half_dt + (start[7, i] - ay[i]) * dt2
+        z[i] = start[2, i] + (start[5, i] + vz[i]) * half_dt + (start[8, i] - az[i]) * dt2
+
+# -----------------------------------------------------------------------------------------------------------
+
+def symplectic_step(store, weights, dt, accel):
+    s = store
+
+    if not s.acc_valid:
+        accel(s)
+
+    # the opening kick of every substep is merged with the closing kick of the one before
+    w_prev = 0.0
+    for w in weights:
+        kick_drift(s.x, s.y, s.z, s.vx, s.vy, s.vz, s.ax, s.ay, s.az, 0.5 * (w_prev + w) * dt, w * dt)
+        accel(s)
+        w_prev = w
+
+    kick(s.vx, s.vy, s.vz, s.ax, s.ay, s.az, 0.5 * w_prev * dt)
+    s.acc_valid = True
+    s.jerk_valid = False
+
+def jerk(store, eps2):
+    # direct sum acc + jerk (+ potential) of every body
+    s = store
+    block_timestep.accel_jerk_active(s.x, s.y, s.z, s.vx, s.vy, s.vz, s.mass, np.arange(s.nb_body), s.ax, s.ay, s.az,
+                                     s.pot, s.jx, s.jy, s.jz, eps2)
+
+def hermite_step(store, dt, eps2):
+    s = store
+
+    # acc and jerk from the last step are at the predicted, not the corrected state: fine for
+    # Hermite, the potential is recomputed by the diagnostics
+    if not s.jerk_valid:
+        jerk(s, eps2)
+        s.jerk_valid = True
+
+    start = np.empty((12, s.nb_body), dtype='f4')
+
+    hermite_predict(s.x, s.y, s.z, s.vx, s.vy, s.vz, s.ax, s.ay, s.az, s.jx, s.jy, s.jz, dt, start)
+    jerk(s, eps2)
+    hermite_correct(s.x, s.y, s.z, s.vx, s.vy, s.vz, s.ax, s.ay, s.az, s.jx, s.jy, s.jz, dt, start)
+
+    s.acc_valid = True
+    s.pot_source = None
+
+def step(store, integrator=INTEGRATOR, dt=DT, accel=None, eps2=EPS2):
+    # accel(store): acceleration (and potential) at the current positions, for the symplectic integrators
+    if integrator == "hermite4":
+        hermite_step(store, dt, eps2)
+    elif integrator in WEIGHTS:
+        symplectic_step(store, WEIGHTS[integrator], dt, accel)
+    else:
+        raise ValueError(f"unknown INTEGRATOR: {integrator}")
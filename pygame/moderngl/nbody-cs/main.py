@@ -1,4 +1,4 @@
-import sys, random
+import sys, random, argparse
 
 import pygame as pg
 import numpy as np
@@ -11,13 +11,16 @@ from model import *
 from skybox import *
 from config import *
 from shader_program import ShaderProgram
+from gpu_sim import GPUSimulation
+import autotune
+import initial_conditions
 from light import Light
 
 # -----------------------------------------------------------------------------------------------------------
 
 class App:
 
-    def __init__(self, screen_width=SCREEN_WIDTH, screen_height=SCREEN_HEIGHT):
+    def __init__(self, screen_width=SCREEN_WIDTH, screen_height=SCREEN_HEIGHT, resume=None):
         self.screen_width = screen_width
         self.screen_height = screen_height
 
@@ -26,7 +29,19 @@ class App:
         print("XGROUPSIZE=", XGROUPSIZE)
         print("YGROUPSIZE=", YGROUPSIZE)
         print("ZGROUPSIZE=", ZGROUPSIZE)
+        print("CS_TILED=", CS_TILED)
+        print("AUTOTUNE=", AUTOTUNE)
         print("NB_BODY=", NB_BODY)
+        print("NBODY_KERNEL=", NBODY_KERNEL)
+        print("NB_THREADS=", gravity.set_num_threads(NB_THREADS))
+        print("BLOCK_TIMESTEPS=", BLOCK_TIMESTEPS)
+        print("INTEGRATOR=", INTEGRATOR)
+        print("COLLISIONS=", COLLISIONS)
+        print("SPH=", SPH)
+        print("MAX_BODY=", MAX_BODY)
+        print("REMOVE_RADIUS=", REMOVE_RADIUS)
+        print("SUBSTEPS=", SUBSTEPS)
+        print("TARGET_SIM_RATE=", TARGET_SIM_RATE)
 
         #
         self.lastTime = time.time()
@@ -86,20 +101,6 @@ class App:
         self.skybox_program = self.all_shaders.get_program("skybox")
         self.nbody_program = self.all_shaders.get_program("nbody")
 
-        # compute shader
-        if USE_COMPUTE_SHADER:
-            with open(f'shaders/nbody_cs.glsl') as file:
-                compute_shader_source = file.read()
-
-            compute_shader_source = compute_shader_source   .replace("XGROUPSIZE_VAL", str(XGROUPSIZE)) \
-                                                            .replace("YGROUPSIZE_VAL", str(YGROUPSIZE)) \
-                                                            .replace("ZGROUPSIZE_VAL", str(ZGROUPSIZE)) \
-                                                            .replace("NB_BODY_VAL", str(NB_BODY)) \
-
-            self.compute_shader = self.ctx.compute_shader(compute_shader_source)
-
-            #self.set_uniform(self.nbody_program, 'nb_body', NB_BODY)
-
         # camera
         self.camera = Camera(self, fov=FOV, near=NEAR, far=FAR, position=CAM_POS, speed=SPEED, sensivity=SENSITIVITY)
 
@@ -107,9 +108,20 @@ class App:
         self.scene = []
         #self.scene.append( Model(self, self.world_program, pos=(0, 0, 0), rot=(0, 0, 0), scale=(1, 1, 1), texture_color=(255, 0, 0)) )
 
-        self.bodies = Bodies(self, self.nbody_program)
+        self.bodies = Bodies(self, self.nbody_program, resume)
         self.scene.append(self.bodies)
 
+        # compute shader
+        if USE_COMPUTE_SHADER:
+            # workgroup size / tiling of this driver, the collision and SPH passes use the same local size
+            group_size, tiled = XGROUPSIZE, CS_TILED
+            if AUTOTUNE:
+                group_size, tiled = autotune.get_best(self.ctx, self.bodies.ssbo_in, self.bodies.nb_body,
+                                                      block_timesteps=BLOCK_TIMESTEPS, integrator=INTEGRATOR, precision=PRECISION,
+                                                      collisions=COLLISIONS, fluid=SPH)
+
+            self.gpu_sim = GPUSimulation(self.ctx, self.bodies.ssbo_in, self.bodies.nb_body, tiled=tiled, group_size=group_size)
+
         self.sky = SkyBox(self, self.skybox_program, pos=(0, 0, 0), rot=(0, 0, 0), scale=(1, 1, 1))
 
         # uniforms
@@ -124,6 +136,9 @@ class App:
         for obj in self.scene:
             obj.destroy()
 
+        if USE_COMPUTE_SHADER:
+            self.gpu_sim.release()
+
         self.sky.destroy()
 
     def set_uniform(self, program, u_name, u_value):
@@ -139,7 +154,9 @@ class App:
         if delta >= 1:
             fps = f"PyGame World FPS: {self.fps.get_fps():3.0f}"
             cam_pos = f"CamPos: {int(self.camera.position.x)}, {int(self.camera.position.y)}, {int(self.camera.position.z)}"
-            pg.display.set_caption(fps + " | " + cam_pos)
+            sim = f"Sim: {self.bodies.get_steps_per_sec():3.0f} steps/s, {self.bodies.get_sim_time_per_sec():.3f} sim s/s"
+            upload = f"Upload: {self.bodies.upload_bytes / 1024:.0f} KB/frame"
+            pg.display.set_caption(fps + " | " + sim + " | " + cam_pos + " | " + upload)
 
             self.lastTime = self.currentTime
 
@@ -171,6 +188,8 @@ class App:
                     self.up = True
                 if event.key == pg.K_LSHIFT:
                     self.down = True
+                if event.key == pg.K_b and USE_COMPUTE_SHADER:
+                    self.spawn()
                 
             if event.type == pg.KEYUP:
                 if event.key == pg.K_UP:
@@ -221,6 +240,13 @@ class App:
             self.mouse_y = 0
             self.mouse_dx, self.mouse_dy = 0, 0
 
+    def spawn(self):
+        # SPAWN_COUNT bodies 10 units in front of the camera, appended on the GPU
+        bodies = initial_conditions.make_bodies("ball", SPAWN_COUNT, self.bodies.rng)
+        bodies[:, POSX:POSZ + 1] += np.array(self.camera.position + 10.0 * self.camera.forward, dtype='f4')
+
+        self.gpu_sim.spawn(bodies)
+
     def mouse_pos(self, x, y, dx=0, dy=0):
         self.set_uniform(self.world_program, 'u_mouse', (x, y))
 
@@ -237,23 +263,7 @@ class App:
         if CLEAR_ON:
             self.ctx.clear(color = (0.0, 0.0, 0.0))
 
-        if USE_COMPUTE_SHADER:
-            self.bodies.ssbo_in.bind_to_storage_buffer(0)
-            #self.bodies.ssbo_out.bind_to_storage_buffer(1)
-
-            ##n_group = 1 + (len(inputs) - 1) // groupsize
-            ##compute_shader.run(group_x=n_group)
-
-            if NB_BODY > XGROUPSIZE:
-                self.compute_shader.run(group_x=NB_BODY // XGROUPSIZE, group_y=1, group_z=1)
-            else:
-                self.compute_shader.run(group_x=1, group_y=1, group_z=1)
-
-            #outputs = np.frombuffer(self.bodies.ssbo_out.read(), dtype=np.float32)
-            #print("outputs", outputs)
-
-            #self.bodies.ssbo_in = self.bodies.ssbo_out
-
+        # the compute shader steps run in Bodies.update(), before the draw
         for obj in self.scene:
             obj.update()
             obj.render()
@@ -296,6 +306,10 @@ class App:
 # -----------------------------------------------------------------------------------------------------------
 
 if __name__ == '__main__':
-    app = App()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--resume", default=None, metavar="CHECKPOINT", help="continue from a checkpoint file")
+    args = parser.parse_args()
+
+    app = App(resume=args.resume)
     app.run()
 
@@ -4,14 +4,21 @@ import numpy as np
 import moderngl as mgl
 import glm, math
 import pywavefront
-import random, copy
-import numba
+import gravity
+import block_timestep
+import initial_conditions
+from body_store import BodyStore
+from gpu_count import get_capacity, make_buffer
+from sim_thread import SimulationThread
+from diagnostics import Diagnostics
+from snapshot import SnapshotWriter
+import checkpoint
 
 # -----------------------------------------------------------------------------------------------------------
 
 class Bodies:
 
-    def __init__(self, app, program):
+    def __init__(self, app, program, resume=None):
         self.app = app
         self.ctx = app.ctx
 
@@ -32,54 +39,88 @@ class Bodies:
         #    vec4 acc; // ax, ay, az, w = bodyID
         # };
 
-        particles_array = self.get_particles()
-        self.ssbo_in    = self.ctx.buffer(data    = particles_array)
-        self.ssbo_out   = self.ctx.buffer(reserve = particles_array.nbytes)
+        self.rng   = initial_conditions.get_rng(IC_SEED)
+        self.steps = 0
+
+        # compute shader steps per frame, simulated time of one step
+        self.substeps = SUBSTEPS
+        self.step_dt = block_timestep.get_block_dt() if BLOCK_TIMESTEPS else DT
+
+        if resume:
+            # straight from the checkpoint Body buffer, no get_particles()
+            ckpt = checkpoint.load(resume)
+            particles_array = ckpt.bodies
+            self.steps = ckpt.step
+            if ckpt.rng is not None:
+                self.rng = ckpt.rng
+            print(f"resume {resume}: step {ckpt.step}, {ckpt.nb_body} bodies, {ckpt.config}")
+        else:
+            particles_array = self.get_particles()
+
+        self.nb_body = particles_array.shape[0]
+
+        # CPU side state, packed into the Body layout only when the SSBO is uploaded
+        self.store      = BodyStore.from_bodies(particles_array)
+
+        if USE_COMPUTE_SHADER:
+            # room for the spawned bodies, the GPU count says how many are in use
+            self.ssbo_in    = make_buffer(self.ctx, particles_array, get_capacity(self.nb_body))
+
+            self.vao        = self.ctx.vertex_array(self.program, [(self.ssbo_in, '4f 4f 8x4', 'in_position', 'in_color')])
+            self.vbos       = []
+            self.vaos       = [self.vao]
+        else:
+            # simulation state stays on the host, only pos + col are streamed each frame
+            # into a ring of UPLOAD_RING_SIZE buffers (1 = orphan a single buffer), nothing is read back
+            self.render_data = self.store.pack_render()
 
-        self.vao        = self.ctx.vertex_array(self.program, [(self.ssbo_in, '4f 4f 8x4', 'in_position', 'in_color')])
+            self.vbos       = [self.ctx.buffer(data=self.render_data, dynamic=True) for _ in range(UPLOAD_RING_SIZE)]
+            self.vaos       = [self.ctx.vertex_array(self.program, [(vbo, '4f 4f', 'in_position', 'in_color')]) for vbo in self.vbos]
+            self.vao        = self.vaos[0]
 
-    @staticmethod
-    @numba.njit(fastmath=True)
-    def calc_bodies(bodies):
+        self.upload_index   = 0
+        self.upload_bytes   = 0
+        self.upload_version = 0
 
-        bodies = bodies.reshape(NB_BODY, 16)
+        gravity.set_num_threads(NB_THREADS)
 
-        # leap 1/2
-        for body in bodies:
-            body[VELX] += body[ACCX] * HALF_DT
-            body[VELY] += body[ACCY] * HALF_DT
-            body[VELZ] += body[ACCZ] * HALF_DT
+        # conservation drift relative to the initial conditions
+        self.diagnostics = None
 
-            body[POSX] += body[VELX] * DT
-            body[POSY] += body[VELY] * DT
-            body[POSZ] += body[VELZ] * DT
+        if DIAG_EVERY:
+            self.diagnostics = Diagnostics(DIAG_EVERY, self.step_dt)
 
-        # O2
-        for pi in bodies:
-            for pj in bodies:
-                if pi[BODY_ID] != pj[BODY_ID]:
-                    DRX = pj[POSX] - pi[POSX]
-                    DRY = pj[POSY] - pi[POSY]
-                    DRZ = pj[POSZ] - pi[POSZ]
+            # step 0 from the potential estimator of the samples: the one of the CPU kernel where every step leaves it
+            if not (USE_COMPUTE_SHADER or SPH or BLOCK_TIMESTEPS or COLLISIONS or INTEGRATOR == "hermite4"):
+                gravity.calc_acc(self.store, NBODY_KERNEL)
 
-                    DR2 = DRX * DRX + DRY * DRY + DRZ * DRZ
-                    DR2 += EPS2
+            self.diagnostics.reset(self.store)
 
-                    PHI = pj[MASS] / (math.sqrt(DR2) * DR2)
+        # snapshot file, written on its own thread; the GPU state is copied into snapshot_buffer
+        # and only read back on the next frame, once the copy is done
+        self.snapshots = None
+        self.snapshot_buffer = None
+        self.snapshot_step = None
 
-                    pi[ACCX] += DRX * PHI
-                    pi[ACCY] += DRY * PHI
-                    pi[ACCZ] += DRZ * PHI
+        if SNAPSHOT_EVERY:
+            self.snapshots = SnapshotWriter(SNAPSHOT_PATH, self.nb_body, SNAPSHOT_EVERY, dt=self.step_dt)
 
-        # leap 1/2
-        for body in bodies:
-            body[VELX] += body[ACCX] * HALF_DT
-            body[VELY] += body[ACCY] * HALF_DT
-            body[VELZ] += body[ACCZ] * HALF_DT
+            if USE_COMPUTE_SHADER:
+                # frames of the initial body count
+                self.snapshot_buffer = self.ctx.buffer(reserve=self.nb_body * 64)
 
-            body[ACCX] = body[ACCY] = body[ACCZ] = 0.0
+        self.checkpoints = None
 
-        return bodies
+        if CHECKPOINT_EVERY:
+            self.checkpoints = checkpoint.Checkpointer(CHECKPOINT_PATH, CHECKPOINT_EVERY, self.rng)
+
+        # CPU integrator on its own thread, the render loop only picks up the latest snapshot
+        self.sim_thread = None
+
+        if not USE_COMPUTE_SHADER and SIM_THREAD:
+            self.sim_thread = SimulationThread(self.store, NBODY_KERNEL, self.diagnostics, self.snapshots,
+                                               self.checkpoints, self.steps)
+            self.sim_thread.start()
 
     def update(self):
         self.program['m_model'].write(self.m_model)
@@ -87,86 +128,140 @@ class Bodies:
         #self.program['cam_pos'].write(self.app.camera.position)
 
         if not USE_COMPUTE_SHADER:
-            a = self.ssbo_in.read_chunks(4, 0, 4, 16 * NB_BODY)
-            d = np.frombuffer(a, dtype='f4')
+            self.upload_bytes = 0
 
-            bodies = self.calc_bodies(copy.copy(d))
+            if self.sim_thread:
+                self.upload_version = self.sim_thread.upload_latest(self.upload, self.upload_version)
+            else:
+                gravity.calc_bodies(self.store, NBODY_KERNEL)
 
-            self.ssbo_in.write(bodies)
+                self.steps += 1
 
-    def render(self):
-        self.vao.render(mgl.POINTS)
+                if self.diagnostics:
+                    self.diagnostics.update(self.store)
 
-    def destroy(self):
-        self.ssbo_in.release()
-        self.vao.release()
+                if self.snapshots and self.snapshots.due(self.steps):
+                    self.snapshots.submit_store(self.steps, self.store)
 
-    def set_uniform(self, u_name, u_value):
-        try:
-            self.program[u_name] = u_value
-        except KeyError:
-            pass
+                if self.checkpoints and self.checkpoints.due(self.steps):
+                    self.checkpoints.save(self.store.pack(), self.steps)
 
-    def get_particles(self):
+                self.upload(self.store.pack_render(self.render_data))
 
-        # Body
-        # {
-        #    vec4 pos; // x, y, z, w = mass
-        #    vec4 col; // r, g, b, a
-        #    vec4 vel; // vx, vy, vz, w = radius
-        #    vec4 acc; // ax, ay, az, w = bodyID
-        # };
+            return
 
-        #bodies = [ -1, -1, 0, 1,  1, 1, 1, 1,  0, 0, 0, 1,  0, 0, 0, 0]
+        # compute shader: get_substeps() steps per frame, no read back in between unless a sample is due
+        for _ in range(self.get_substeps()):
+            self.app.gpu_sim.step()
+            self.steps += 1
 
-        bodies = []
-        for i in range(0, NB_BODY):
-            posx, posy, posz = self.pickball(8.0)
+            self.sample_gpu()
 
-            # pos =  x, y, z, w = mass
-            if i == 0:
-                mass = 100.0
-            else:
-                mass = 1.0
+    def get_substeps(self):
+        # SUBSTEPS, or as many as TARGET_SIM_RATE needs at the frame rate of the last frames
+        if TARGET_SIM_RATE > 0:
+            fps = self.app.fps.get_fps()
+            if fps > 0:
+                self.substeps = min(max(1, round(TARGET_SIM_RATE / (fps * self.step_dt))), MAX_SUBSTEPS)
+
+        return self.substeps
+
+    def sample_gpu(self):
+        # snapshots, checkpoints and diagnostics of the compute shader state after a step
+        if self.snapshots:
+            if self.snapshot_step is not None:
+                self.snapshots.submit_bodies(self.snapshot_step, np.frombuffer(self.snapshot_buffer.read(), dtype='f4'))
+                self.snapshot_step = None
+
+            if self.snapshots.due(self.steps):
+                self.ctx.copy_buffer(self.snapshot_buffer, self.ssbo_in, size=self.snapshot_buffer.size)
+                self.snapshot_step = self.steps
+
+        if self.checkpoints and self.checkpoints.due(self.steps):
+            self.checkpoints.save(self.get_bodies(), self.steps)
 
-            bodies.extend((posx, posy, posz, mass))
+        if self.diagnostics:
+            # the GPU owns the state: read it back on the sampled frames only
+            if self.diagnostics.due():
+                self.store = BodyStore.from_bodies(self.get_bodies())
 
-            # col = r, g, b, a
-            #bodies.extend((random.uniform(0.5, 1.0), random.uniform(0.5, 1.0), random.uniform(0.5, 1.0), 1.0))
-            bodies.extend((1.0, 1.0, 1.0, 1.0))
+            self.diagnostics.update(self.store)
 
-            # vel = vx, vy, vz, w = radius
-            bodies.extend((0.0, 0.0, 0.0, 1.0))
+    def upload(self, render_data):
+        self.upload_index = (self.upload_index + 1) % len(self.vbos)
+        vbo = self.vbos[self.upload_index]
 
-            # acc = ax, ay, az, w = bodyID
-            bodies.extend((0.0, 0.0, 0.0, i))
+        if len(self.vbos) == 1:
+            vbo.orphan()
 
+        vbo.write(render_data)
 
-        vertex_data = np.asarray(bodies, dtype='f4') #vertex_data = np.array(bodies, dtype='f4')
+        self.vao = self.vaos[self.upload_index]
+        self.upload_bytes = render_data.nbytes
 
-        #print("vertex_data=", vertex_data)
+    def get_bodies(self):
+        # copy of the Body buffer, the bodies left after the collisions are at the front
+        if USE_COMPUTE_SHADER:
+            return np.frombuffer(self.ssbo_in.read(), dtype='f4').reshape(-1, 16)[:self.app.gpu_sim.get_count()]
 
-        return vertex_data
+        return self.store.pack()
 
-    def pickball(self, radius):
+    def get_steps(self):
+        if self.sim_thread:
+            return self.sim_thread.steps
 
-        while True:
-            rsq = 0.0
+        return self.steps
 
-            posx = random.uniform(-1.0, 1.0)
-            posy = random.uniform(-1.0, 1.0)
-            posz = random.uniform(-1.0, 1.0)
+    def get_steps_per_sec(self):
+        if self.sim_thread:
+            return self.sim_thread.steps_per_sec
 
-            rsq = (posx * posx) + (posy * posy) + (posz * posz)
+        # substeps per frame, one on the CPU
+        return self.app.fps.get_fps() * (self.substeps if USE_COMPUTE_SHADER else 1)
+
+    def get_sim_time_per_sec(self):
+        # simulated seconds per wall second
+        return self.get_steps_per_sec() * self.step_dt
+
+    def render(self):
+        if USE_COMPUTE_SHADER:
+            self.app.gpu_sim.render(self.vao, mgl.POINTS)
+        else:
+            self.vao.render(mgl.POINTS)
+
+    def destroy(self):
+        if self.sim_thread:
+            self.sim_thread.stop()
 
-            if rsq <= 1.0:
-                break
+        # last checkpoint on exit
+        if self.checkpoints:
+            self.checkpoints.save(self.get_bodies(), self.get_steps())
+            self.checkpoints.wait()
 
-        posx = posx * radius
-        posy = posy * radius
-        posz = posz * radius
+        if self.snapshots:
+            self.snapshots.close()
 
-        return posx, posy, posz
+        if self.snapshot_buffer:
+            self.snapshot_buffer.release()
+
+        if USE_COMPUTE_SHADER:
+            self.ssbo_in.release()
+
+        for vao in self.vaos:
+            vao.release()
+
+        for vbo in self.vbos:
+            vbo.release()
+
+    def set_uniform(self, u_name, u_value):
+        try:
+            self.program[u_name] = u_value
+        except KeyError:
+            pass
+
+    def get_particles(self):
+        # (N, 16) Body buffer, see initial_conditions.PRESETS
+        return initial_conditions.make_bodies(IC_PRESET, NB_BODY, self.rng)
 
 # -----------------------------------------------------------------------------------------------------------
 
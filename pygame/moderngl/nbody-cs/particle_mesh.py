@@ -0,0 +1,149 @@
+from config import *
+import numpy as np
+import math
+from jit import numba
+
+# -----------------------------------------------------------------------------------------------------------
+# Particle mesh gravity, O(N + M log M) for M grid cells
+#
+#  1. cloud in cell deposit of the masses on a PM_GRID^3 mesh around the bodies
+#  2. potential = mass * G with G(r) = -1 / sqrt(r^2 + eps^2), an FFT convolution on a zero padded
+#     (2 PM_GRID)^3 mesh so the system is isolated, not periodic (Hockney & Eastwood 1988)
+#  3. acceleration = -grad(potential) by central differences, cloud in cell interpolated to the bodies
+#
+# forces are smoothed on the cell size: fine for large N, wrong for close encounters. The cell size is
+# rounded up to a power of two so the transformed Green's function can be reused while the system
+# does not grow.
+
+@numba.njit(fastmath=True, nogil=True)
+def deposit(x, y, z, m, x0, y0, z0, inv_h, rho):
+    # cloud in cell: every body spreads its mass over the 8 nodes around it
+    for i in range(x.shape[0]):
+        u = (x[i] - x0) * inv_h
+        v = (y[i] - y0) * inv_h
+        w = (z[i] - z0) * inv_h
+
+        iu, iv, iw = int(math.floor(u)), int(math.floor(v)), int(math.floor(w))
+        fu, fv, fw = u - iu, v - iv, w - iw
+        gu, gv, gw = 1.0 - fu, 1.0 - fv, 1.0 - fw
+
+        rho[iu,     iv,     iw    ] += m[i] * gu * gv * gw
+        rho[iu + 1, iv,     iw    ] += m[i] * fu * gv * gw
+        rho[iu,     iv + 1, iw    ] += m[i] * gu * fv * gw
+        rho[iu + 1, iv + 1, iw    ] += m[i] * fu * fv * gw
+        rho[iu,     iv,     iw + 1] += m[i] * gu * gv * fw
+        rho[iu + 1, iv,     iw + 1] += m[i] * fu * gv * fw
+        rho[iu,     iv + 1, iw + 1] += m[i] * gu * fv * fw
+        rho[iu + 1, iv + 1, iw + 1] += m[i] * fu * fv * fw
+
+@numba.njit(fastmath=True, nogil=True)
+def cic(grid, iu, iv, iw, fu, fv, fw):
+    gu, gv, gw = 1.0 - fu, 1.0 - fv, 1.0 - fw
+
+    return (grid[iu,     iv,     iw    ] * gu * gv * gw +
+            grid[iu + 1, iv,     iw    ] * fu * gv * gw +
+            grid[iu,     iv + 1, iw    ] * gu * fv * gw +
+            grid[iu + 1, iv + 1, iw    ] * fu * fv * gw +
+            grid[iu,     iv,     iw + 1] * gu * gv * fw +
+            grid[iu + 1, iv,     iw + 1] * fu * gv * fw +
+            grid[iu,     iv + 1, iw + 1] * gu * fv * fw +
+            grid[iu + 1, iv + 1, iw + 1] * fu * fv * fw)
+
+@numba.njit(fastmath=True, parallel=True, nogil=True)
+def interpolate(x, y, z, x0, y0, z0, inv_h, phi, gx, gy, gz, ax, ay, az, pot):
+    # same cloud in cell weights as the deposit: no self force
+    for i in numba.prange(x.shape[0]):
+        u = (x[i] - x0) * inv_h
+        v = (y[i] - y0) * inv_h
+        w = (z[i] - z0) * inv_h
+
+        iu, iv, iw = int(math.floor(u)), int(math.floor(v)), int(math.floor(w))
+        fu, fv, fw = u - iu, v - iv, w - iw
+
+        ax[i] += cic(gx, iu, iv, iw, fu, fv, fw)
+        ay[i] += cic(gy, iu, iv, iw, fu, fv, fw)
+        az[i] += cic(gz, iu, iv, iw, fu, fv, fw)
+        pot[i] += cic(phi, iu, iv, iw, fu, fv, fw)
+
+@numba.njit(fastmath=True, parallel=True, nogil=True)
+def gradient(phi, inv_2h, gx, gy, gz):
+    # g = -grad(phi), central differences on the interior nodes
+    n = gx.shape[0]
+
+    for i in numba.prange(1, n - 1):
+        for j in range(1, n - 1):
+            for k in range(1, n - 1):
+                gx[i, j, k] = (phi[i - 1, j, k] - phi[i + 1, j, k]) * inv_2h
+                gy[i, j, k] = (phi[i, j - 1, k] - phi[i, j + 1, k]) * inv_2h
+                gz[i, j, k] = (phi[i, j, k - 1] - phi[i, j, k + 1]) * inv_2h
+
+# -----------------------------------------------------------------------------------------------------------
+
+class ParticleMesh:
+
+    def __init__(self, grid_size=PM_GRID, eps2=EPS2):
+        self.grid_size = grid_size
+        self.eps2 = eps2
+
+        n = grid_size
+        self.rho = np.zeros((2 * n, 2 * n, 2 * n), dtype=np.float32)
+        self.gx  = np.zeros((n, n, n), dtype=np.float32)
+        self.gy  = np.zeros((n, n, n), dtype=np.float32)
+        self.gz  = np.zeros((n, n, n), dtype=np.float32)
+
+        self.h = None
+        self.green_hat = None
+
+    def get_green(self, h):
+        # transformed Green's function of the padded mesh, only rebuilt when the cell size changes
+        if h != self.h:
+            m = 2 * self.grid_size
+            d = np.minimum(np.arange(m), m - np.arange(m)) * h
+            r2 = d[:, None, None] ** 2 + d[None, :, None] ** 2 + d[None, None, :] ** 2
+
+            # the origin node at least half a cell away: 1 / 0 with eps2 = 0, the mesh does not resolve below a cell
+            self.green_hat = np.fft.rfftn((-1.0 / np.sqrt(np.maximum(r2 + self.eps2, 0.25 * h * h))).astype(np.float32))
+            self.h = h
+
+        return self.green_hat
+
+    def get_mesh(self, x, y, z):
+        # power of two cell size, bodies at least one cell away from the mesh border
+        n = self.grid_size
+        lo = np.array((x.min(), y.min(), z.min()), dtype=np.float64)
+        hi = np.array((x.max(), y.max(), z.max()), dtype=np.float64)
+
+        extent = max((hi - lo).max(), 1e-6)
+        h = 2.0 ** math.ceil(math.log2(extent / (n - 5)))
+
+        center = 0.5 * (lo + hi)
+        origin = center - 0.5 * n * h
+
+        return origin, h
+
+    def accel(self, x, y, z, m, ax, ay, az, pot):
+        # ax, ay, az += acceleration of every body, pot += potential
+        n = self.grid_size
+        (x0, y0, z0), h = self.get_mesh(x, y, z)
+        inv_h = 1.0 / h
+
+        rho = self.rho
+        rho.fill(0.0)
+        deposit(x, y, z, m, x0, y0, z0, inv_h, rho)
+
+        phi = np.fft.irfftn(np.fft.rfftn(rho) * self.get_green(h), s=rho.shape, axes=(0, 1, 2))
+        phi = np.ascontiguousarray(phi[:n, :n, :n], dtype=np.float32)
+
+        gradient(phi, 0.5 * inv_h, self.gx, self.gy, self.gz)
+        interpolate(x, y, z, x0, y0, z0, inv_h, phi, self.gx, self.gy, self.gz, ax, ay, az, pot)
+
+_solver = None
+
+def accel(x, y, z, m, ax, ay, az, pot, eps2, grid_size=PM_GRID):
+    # one solver (mesh buffers + Green's function cache) per grid size
+    global _solver
+
+    if _solver is None or _solver.grid_size != grid_size or _solver.eps2 != eps2:
+        _solver = ParticleMesh(grid_size, eps2)
+
+    _solver.accel(x, y, z, m, ax, ay, az, pot)
@@ -0,0 +1,341 @@
+import os, sys, json, time, argparse
+
+from config import *
+import numpy as np
+import gravity
+import initial_conditions
+import integrators
+import block_timestep
+from body_store import BodyStore
+from diagnostics import Diagnostics
+from snapshot import SnapshotWriter
+import checkpoint
+
+# -----------------------------------------------------------------------------------------------------------
+# Headless n-body runner: no window, no pygame
+#
+#   python run.py --backend parallel --bodies 16384 --steps 50
+#   python -m run --backend compute_shader --gl-backend egl
+#   python run.py --sph --preset dam --bodies 100000 --backend compute_shader
+#   python run.py --backend compute_shader --autotune
+#
+# prints one JSON record on stdout, interactions are direct-sum equivalent: N * (N - 1) per force evaluation
+
+CPU_BACKENDS = ("direct", "parallel", "symmetric", "barnes_hut", "particle_mesh", "fmm", "numpy_blocked")
+BACKENDS     = CPU_BACKENDS + ("compute_shader",)
+
+# -----------------------------------------------------------------------------------------------------------
+
+class CPURunner:
+
+    def __init__(self, bodies, backend, nb_threads=NB_THREADS, block_timesteps=BLOCK_TIMESTEPS, dt=DT, eps2=EPS2,
+                 integrator=INTEGRATOR, collisions=COLLISIONS, precision=PRECISION, fluid=SPH):
+        self.backend = backend
+        self.block_timesteps = block_timesteps
+        self.integrator = integrator
+        self.collisions = collisions
+        self.precision = precision
+        self.fluid = fluid
+        self.dt = dt
+        self.eps2 = eps2
+        self.store = BodyStore.from_bodies(bodies)
+        self.nb_threads = gravity.set_num_threads(nb_threads)
+
+    def step(self):
+        gravity.calc_bodies(self.store, self.backend, self.block_timesteps, self.dt, self.eps2, self.integrator,
+                            self.collisions, self.precision, self.fluid)
+
+    def get_store(self):
+        return self.store
+
+    def get_nb_body(self):
+        return self.store.nb_body
+
+    def get_bodies(self):
+        return self.store.pack()
+
+    def snapshot(self, writer, step):
+        writer.submit_store(step, self.store)
+
+    def flush_snapshot(self, writer):
+        pass
+
+    def finish(self):
+        pass
+
+    def info(self):
+        return {"threads": self.nb_threads}
+
+    def force_error(self, nb_sample):
+        return gravity.force_error(self.store, self.backend, nb_sample, eps2=self.eps2, precision=self.precision)
+
+    def release(self):
+        pass
+
+class ComputeShaderRunner:
+
+    def __init__(self, bodies, gl_backend=None, block_timesteps=BLOCK_TIMESTEPS, dt=DT, eps2=EPS2, integrator=INTEGRATOR,
+                 collisions=COLLISIONS, precision=PRECISION, fluid=SPH, tiled=CS_TILED, autotune=AUTOTUNE,
+                 remove_radius=REMOVE_RADIUS):
+        import moderngl as mgl
+        from gpu_sim import GPUSimulation
+        from gpu_count import get_capacity, make_buffer
+        from autotune import get_best
+
+        # EGL does not need a display (Mesa llvmpipe on CI boxes)
+        if gl_backend is None and sys.platform.startswith("linux") and not os.environ.get("DISPLAY"):
+            gl_backend = "egl"
+
+        kwargs = {"backend": gl_backend} if gl_backend else {}
+        self.ctx = mgl.create_standalone_context(require=430, **kwargs)
+
+        self.nb_body = bodies.shape[0]
+        self.ssbo_in = make_buffer(self.ctx, bodies, get_capacity(self.nb_body))
+
+        # workgroup size / tiling of this driver, the collision and SPH passes use the same local size
+        group_size = XGROUPSIZE
+        if autotune:
+            group_size, tiled = get_best(self.ctx, self.ssbo_in, self.nb_body, log=lambda line: print(line, file=sys.stderr),
+                                         block_timesteps=block_timesteps, integrator=integrator, precision=precision,
+                                         collisions=collisions, fluid=fluid)
+
+        self.gpu_sim = GPUSimulation(self.ctx, self.ssbo_in, self.nb_body, block_timesteps, dt, eps2, integrator,
+                                     collisions, precision, fluid, tiled, group_size, remove_radius)
+        self.tiled = tiled
+
+        self.snapshot_buffer = None
+        self.snapshot_step = None
+
+    def step(self):
+        self.gpu_sim.step()
+
+    def get_store(self):
+        return BodyStore.from_bodies(self.get_bodies())
+
+    def get_nb_body(self):
+        return self.gpu_sim.get_count()
+
+    def get_bodies(self):
+        # the bodies left after the collisions are at the front of the ssbo
+        return np.frombuffer(self.ssbo_in.read(), dtype='f4').reshape(-1, 16)[:self.get_nb_body()]
+
+    def snapshot(self, writer, step):
+        # copy on the GPU now, read back on the next snapshot once the copy is done
+        self.flush_snapshot(writer)
+
+        if self.snapshot_buffer is None:
+            # frames of the initial body count
+            self.snapshot_buffer = self.ctx.buffer(reserve=self.nb_body * 64)
+
+        self.ctx.copy_buffer(self.snapshot_buffer, self.ssbo_in, size=self.snapshot_buffer.size)
+        self.snapshot_step = step
+
+    def flush_snapshot(self, writer):
+        if self.snapshot_step is not None:
+            writer.submit_bodies(self.snapshot_step, np.frombuffer(self.snapshot_buffer.read(), dtype='f4'))
+            self.snapshot_step = None
+
+    def finish(self):
+        self.ctx.finish()
+
+    def info(self):
+        return {"renderer": self.ctx.info["GL_RENDERER"], "version": self.ctx.info["GL_VERSION"], "tiled": bool(self.tiled),
+                "group_size": self.gpu_sim.group_size}
+
+    def force_error(self, nb_sample):
+        # the shader is a direct sum
+        return {}
+
+    def release(self):
+        self.ssbo_in.release()
+        self.gpu_sim.release()
+
+        if self.snapshot_buffer:
+            self.snapshot_buffer.release()
+        self.ctx.release()
+
+# -----------------------------------------------------------------------------------------------------------
+
+def get_runner(args, bodies):
+    if args.backend == "compute_shader":
+        return ComputeShaderRunner(bodies, args.gl_backend, args.block_timesteps, args.dt, args.eps * args.eps,
+                                   args.integrator, args.collisions, args.precision, args.sph, args.tiled, args.autotune,
+                                   args.remove_radius)
+
+    return CPURunner(bodies, args.backend, args.threads, args.block_timesteps, args.dt, args.eps * args.eps,
+                     args.integrator, args.collisions, args.precision, args.sph)
+
+def sample(runner, diagnostics):
+    if not diagnostics:
+        return
+
+    store = runner.get_store() if diagnostics.due() else None
+    diagnostics.update(store)
+
+def run(args):
+    rng = initial_conditions.get_rng(args.seed)
+    first_step = 0
+
+    if args.resume:
+        ckpt = checkpoint.load(args.resume, args.dt, args.eps)
+        bodies, first_step, args.bodies = ckpt.bodies, ckpt.step, ckpt.nb_body
+        if ckpt.rng is not None:
+            rng = ckpt.rng
+    else:
+        bodies = initial_conditions.make_bodies(args.preset, args.bodies, rng)
+
+    runner = get_runner(args, bodies)
+
+    # accuracy on the initial conditions, against a direct sum on a sample of bodies
+    force_error = runner.force_error(args.force_error) if args.force_error else {}
+
+    # simulated time of one step: a block step advances the largest block step
+    step_dt = block_timestep.get_block_dt(args.dt) if args.block_timesteps else args.dt
+
+    diagnostics = None
+    if args.diag_every:
+        diagnostics = Diagnostics(args.diag_every, step_dt, lambda line: print(line, file=sys.stderr), args.eps * args.eps)
+
+        # step 0 from the potential estimator of the samples: the one of the CPU kernel where every step leaves it
+        reference = BodyStore.from_bodies(bodies)
+        if args.backend in CPU_BACKENDS and not (args.sph or args.block_timesteps or args.collisions
+                                                 or args.integrator == "hermite4"):
+            gravity.calc_acc(reference, args.backend, args.eps * args.eps, args.precision)
+
+        diagnostics.reset(reference)
+
+    # JIT / shader warm up, not timed
+    t0 = time.perf_counter()
+    runner.step()
+    runner.finish()
+    warmup_time = time.perf_counter() - t0
+
+    sample(runner, diagnostics)
+
+    snapshots = None
+    if args.snapshot_every:
+        snapshots = SnapshotWriter(args.snapshot, args.bodies, args.snapshot_every, args.snapshot_velocities,
+                                   max(1, args.steps // args.snapshot_every), step_dt)
+
+    checkpoints = None
+    if args.checkpoint_every:
+        config = checkpoint.get_config(args.backend, DT=args.dt, EPS=args.eps, INTEGRATOR=args.integrator,
+                                       BLOCK_TIMESTEPS=int(args.block_timesteps), COLLISIONS=int(args.collisions),
+                                       PRECISION=args.precision, SPH=int(args.sph), IC_PRESET=args.preset)
+        checkpoints = checkpoint.Checkpointer(args.checkpoint, args.checkpoint_every, rng, config)
+
+    # the warm up step counts
+    step = first_step + 1
+
+    # diagnostics samples, snapshots and checkpoints are timed too
+    t0 = time.perf_counter()
+    for step in range(step + 1, step + args.steps + 1):
+        runner.step()
+        sample(runner, diagnostics)
+
+        if snapshots and snapshots.due(step):
+            runner.snapshot(snapshots, step)
+
+        if checkpoints and checkpoints.due(step):
+            checkpoints.save(runner.get_bodies(), step)
+    runner.finish()
+    wall_time = time.perf_counter() - t0
+
+    if checkpoints:
+        if not checkpoints.due(step):
+            checkpoints.save(runner.get_bodies(), step)
+        checkpoints.wait()
+
+    if snapshots:
+        runner.flush_snapshot(snapshots)
+        snapshots.close()
+
+    # direct-sum equivalent interactions per force evaluation, block steps count as one
+    force_evals = 1 if args.block_timesteps else integrators.get_force_evals(args.integrator)
+
+    report = {
+        "backend"              : args.backend,
+        "nb_body"              : args.bodies,
+        "steps"                : args.steps,
+        "preset"               : args.preset,
+        "dt"                   : args.dt,
+        "step_dt"              : step_dt,
+        "eps"                  : args.eps,
+        "first_step"           : first_step,
+        "last_step"            : step,
+        "integrator"           : "block" if args.block_timesteps else args.integrator,
+        "block_timesteps"      : bool(args.block_timesteps),
+        "collisions"           : bool(args.collisions),
+        "precision"            : args.precision,
+        "sph"                  : bool(args.sph),
+        "nb_body_final"        : runner.get_nb_body(),
+        "warmup_time"          : warmup_time,
+        "wall_time"            : wall_time,
+        "steps_per_sec"        : args.steps / wall_time,
+        "sim_time_per_sec"     : args.steps * step_dt / wall_time,
+        "interactions_per_sec" : args.bodies * (args.bodies - 1) * force_evals * args.steps / wall_time,
+    }
+    report.update(runner.info())
+    report.update(force_error)
+
+    if diagnostics and diagnostics.last:
+        report.update({k: float(diagnostics.last[k]) for k in ("energy_drift", "momentum_drift", "angular_momentum_drift")})
+
+    runner.release()
+
+    return report
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="headless n-body benchmark")
+    parser.add_argument("--backend", choices=BACKENDS, default=NBODY_KERNEL)
+    parser.add_argument("--bodies", type=int, default=NB_BODY)
+    parser.add_argument("--steps", type=int, default=100)
+    parser.add_argument("--preset", choices=tuple(initial_conditions.PRESETS), default=IC_PRESET)
+    parser.add_argument("--seed", type=int, default=IC_SEED)
+    parser.add_argument("--dt", type=float, default=DT, help="time step, no recompilation")
+    parser.add_argument("--eps", type=float, default=EPS, help="softening length, no recompilation")
+    parser.add_argument("--integrator", choices=integrators.INTEGRATORS, default=INTEGRATOR)
+    parser.add_argument("--sph", action="store_true", default=bool(SPH),
+                        help="SPH fluid instead of gravity, use with --preset dam")
+    parser.add_argument("--precision", choices=gravity.PRECISIONS, default=PRECISION,
+                        help="force accumulation of the direct sums, pair math is float32")
+    parser.add_argument("--tiled", type=int, choices=(0, 1), default=CS_TILED,
+                        help="compute shader: stage the bodies through shared memory, 0 = read the SSBO")
+    parser.add_argument("--autotune", action="store_true", default=bool(AUTOTUNE),
+                        help=f"compute shader: time the workgroup sizes once per driver and N, cached in {AUTOTUNE_CACHE}")
+    parser.add_argument("--remove-radius", type=float, default=REMOVE_RADIUS,
+                        help="compute shader: remove the bodies farther than this from the origin every step, 0 = off")
+    parser.add_argument("--threads", type=int, default=NB_THREADS, help="numba threads, 0 = all cores")
+    parser.add_argument("--block-timesteps", action="store_true", default=bool(BLOCK_TIMESTEPS),
+                        help="hierarchical DT / 2^level steps, one step advances DT * 2^-BLOCK_MIN_LEVEL")
+    parser.add_argument("--collisions", action="store_true", default=bool(COLLISIONS),
+                        help="merge the bodies overlapping by their radius, global timestep only")
+    parser.add_argument("--force-error", type=int, default=0, metavar="SAMPLE",
+                        help="report the force error against a direct sum on SAMPLE bodies, 0 = off")
+    parser.add_argument("--diag-every", type=int, default=DIAG_EVERY,
+                        help="log conservation drift on stderr every K steps, 0 = off")
+    parser.add_argument("--snapshot", default=SNAPSHOT_PATH, help="snapshot file")
+    parser.add_argument("--snapshot-every", type=int, default=SNAPSHOT_EVERY, metavar="K",
+                        help="write positions every K steps, 0 = off")
+    parser.add_argument("--snapshot-velocities", action="store_true", default=bool(SNAPSHOT_VELOCITIES))
+    parser.add_argument("--checkpoint", default=CHECKPOINT_PATH, help="checkpoint file")
+    parser.add_argument("--checkpoint-every", type=int, default=CHECKPOINT_EVERY, metavar="K",
+                        help="save the whole state every K steps and at the end, 0 = off")
+    parser.add_argument("--resume", default=None, metavar="CHECKPOINT", help="start from a checkpoint file")
+    parser.add_argument("--gl-backend", default=None, help="moderngl standalone backend, egl when there is no display")
+    return parser
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+
+    report = run(args)
+    print(json.dumps(report, indent=2))
+
+    return report
+
+# -----------------------------------------------------------------------------------------------------------
+
+if __name__ == '__main__':
+    # shaders/ is relative to the app directory
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    main()
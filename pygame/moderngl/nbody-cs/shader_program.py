@@ -1,3 +1,15 @@
+def get_compute_shader(ctx, shader_name, values):
+    # values: {"XGROUPSIZE": 32, ...} replaces every XGROUPSIZE_VAL in the source
+    with open(f'shaders/{shader_name}_cs.glsl') as file:
+        compute_shader_source = file.read()
+
+    for name, value in values.items():
+        compute_shader_source = compute_shader_source.replace(f"{name}_VAL", str(value))
+
+    return ctx.compute_shader(compute_shader_source)
+
+# -----------------------------------------------------------------------------------------------------------
+
 class ShaderProgram:
 
     def __init__(self, ctx):
@@ -0,0 +1,174 @@
+#version 430
+
+#define XGROUPSIZE  XGROUPSIZE_VAL
+#define YGROUPSIZE  YGROUPSIZE_VAL
+#define ZGROUPSIZE  ZGROUPSIZE_VAL
+
+// collisions on the GPU, same rules as collision.py:
+//   BOUNDS, HASH, (prefix sum of the cell counts), SCATTER, DETECT, MERGE, FLAG, (prefix sum of the flags), COMPACT
+// the body count lives in COUNT and is only ever changed here, the CPU never reads it back
+#define PASS_BOUNDS   0 // max radius -> cell size
+#define PASS_HASH     1 // cell hash of every body, bodies per hash
+#define PASS_SCATTER  2 // counting sort by hash
+#define PASS_DETECT   3 // overlapping body with the smallest index
+#define PASS_MERGE    4 // mutual partners merge into the smaller index, the other one gets mass 0
+#define PASS_FLAG     5 // 1 for the bodies left
+#define PASS_COMPACT  6 // bodies left to the front of OUT, zeros behind, new count
+
+uniform int  pass_id;
+uniform int  capacity; // bodies the buffers hold
+uniform uint mask;     // hash table size - 1
+
+layout(local_size_x=XGROUPSIZE, local_size_y=YGROUPSIZE, local_size_z=ZGROUPSIZE) in;
+
+struct Body
+{
+    vec4 pos; // x, y, z, w=mass
+    vec4 col; // r, g, b, a
+    vec4 vel; // vx, vy, vz, w=radius
+    vec4 acc; // ax, ay, az, w=bodyID
+};
+
+layout(std430, binding=0) buffer bodies_in
+{
+    Body bodies[];
+} IN;
+
+layout(std430, binding=1) buffer bodies_out
+{
+    Body bodies[];
+} OUT;
+
+layout(std430, binding=3) buffer bodies_flag
+{
+    uint flag[];
+} FLAG;
+
+layout(std430, binding=4) buffer bodies_count
+{
+    int  nb_body;
+    uint max_radius; // float bits, positive floats order like uints
+} COUNT;
+
+layout(std430, binding=5) buffer grid_cells
+{
+    uint cell_start[];
+} CELLS;
+
+layout(std430, binding=6) buffer grid_cursor
+{
+    uint cursor[];
+} CURSOR;
+
+layout(std430, binding=7) buffer grid_bodies
+{
+    ivec4 body[]; // x = hash of body i, y = partner of body i, z = body in sorted slot i
+} GRID;
+
+float get_inv_cell()
+{
+    // no radius: one cell, nothing overlaps
+    float max_radius = uintBitsToFloat(COUNT.max_radius);
+    return max_radius > 0.0 ? 1.0 / (2.0 * max_radius) : 0.0;
+}
+
+uint hash_cell(ivec3 c)
+{
+    return ((uint(c.x) * 73856093u) ^ (uint(c.y) * 19349663u) ^ (uint(c.z) * 83492791u)) & mask;
+}
+
+void main()
+{
+    int i = int(gl_GlobalInvocationID.x);
+
+    if (pass_id == PASS_FLAG) {
+        if (i < capacity) {
+            FLAG.flag[i] = (i < COUNT.nb_body && IN.bodies[i].pos.w > 0.0) ? 1 : 0;
+        }
+        return;
+    }
+
+    if (pass_id == PASS_COMPACT) {
+        if (i >= capacity) return;
+
+        uint nb_left = FLAG.flag[capacity];
+        uint slot = FLAG.flag[i];
+
+        if (FLAG.flag[i + 1] != slot) {
+            OUT.bodies[slot] = IN.bodies[i];
+        }
+
+        if (i >= nb_left) {
+            OUT.bodies[i] = Body(vec4(0.0), vec4(0.0), vec4(0.0), vec4(0.0));
+        }
+
+        if (i == 0) {
+            COUNT.nb_body = int(nb_left);
+        }
+        return;
+    }
+
+    if (i >= COUNT.nb_body) return;
+
+    if (pass_id == PASS_BOUNDS) {
+        atomicMax(COUNT.max_radius, floatBitsToUint(IN.bodies[i].vel.w));
+    }
+    else if (pass_id == PASS_HASH) {
+        uint h = hash_cell(ivec3(floor(IN.bodies[i].pos.xyz * get_inv_cell())));
+
+        GRID.body[i].x = int(h);
+        atomicAdd(CELLS.cell_start[h], 1);
+    }
+    else if (pass_id == PASS_SCATTER) {
+        uint slot = atomicAdd(CURSOR.cursor[GRID.body[i].x], 1);
+        GRID.body[slot].z = i;
+    }
+    else if (pass_id == PASS_DETECT) {
+        vec3 pos = IN.bodies[i].pos.xyz;
+        float radius = IN.bodies[i].vel.w;
+        ivec3 c = ivec3(floor(pos * get_inv_cell()));
+        int best = -1;
+
+        for (int dx = -1; dx <= 1; dx++) {
+            for (int dy = -1; dy <= 1; dy++) {
+                for (int dz = -1; dz <= 1; dz++) {
+                    uint h = hash_cell(c + ivec3(dx, dy, dz));
+
+                    // other cells on the same hash only cost a distance test
+                    for (uint l = CELLS.cell_start[h]; l < CELLS.cell_start[h + 1]; l++) {
+                        int j = GRID.body[l].z;
+                        if (j == i || (best >= 0 && j >= best)) continue;
+
+                        vec3 dr = IN.bodies[j].pos.xyz - pos;
+                        float rr = radius + IN.bodies[j].vel.w;
+
+                        if (dot(dr, dr) < rr * rr) best = j;
+                    }
+                }
+            }
+        }
+
+        GRID.body[i].y = best;
+    }
+    else if (pass_id == PASS_MERGE) {
+        int j = GRID.body[i].y;
+        if (j <= i || GRID.body[j].y != i) return;
+
+        // nobody else touches i or j in this pass
+        Body bi = IN.bodies[i];
+        Body bj = IN.bodies[j];
+
+        float m = bi.pos.w + bj.pos.w;
+        float wi = bi.pos.w / m;
+        float wj = bj.pos.w / m;
+
+        IN.bodies[i].pos = vec4(bi.pos.xyz * wi + bj.pos.xyz * wj, m);
+        IN.bodies[i].col = bi.col * wi + bj.col * wj;
+        IN.bodies[i].vel = vec4(bi.vel.xyz * wi + bj.vel.xyz * wj, pow(pow(bi.vel.w, 3.0) + pow(bj.vel.w, 3.0), 1.0 / 3.0));
+
+        // close enough to the acceleration of the merged body until the next force evaluation
+        IN.bodies[i].acc.xyz = bi.acc.xyz * wi + bj.acc.xyz * wj;
+
+        IN.bodies[j].pos.w = 0.0;
+    }
+}
@@ -0,0 +1,107 @@
+#version 430
+
+#define XGROUPSIZE  XGROUPSIZE_VAL
+#define YGROUPSIZE  YGROUPSIZE_VAL
+#define ZGROUPSIZE  ZGROUPSIZE_VAL
+
+// the body count on the GPU, see gpu_count.py: the n-body dispatches and the draw of the bodies take their size
+// from COUNT, every pass that changes the count ends with the ARGS of the new one, the CPU never reads it back
+#define PASS_ARGS     0 // clamp the count to the capacity, dispatch + draw arguments (invocation 0)
+#define PASS_SPAWN    1 // append: SPAWN bodies behind the last one, dropped when the buffer is full
+#define PASS_COMPACT  2 // consume: the bodies left (mass > 0, within remove_radius) to OUT, in any order
+#define PASS_KEEP     3 // count = bodies left, then ARGS (invocation 0)
+
+uniform int   pass_id;
+uniform int   capacity;      // bodies the buffers hold
+uniform int   group_size;    // local size x of the n-body shaders, same as this one
+uniform int   nb_spawn;
+uniform float remove_radius; // 0 = the bodies without mass only
+
+layout(local_size_x=XGROUPSIZE, local_size_y=YGROUPSIZE, local_size_z=ZGROUPSIZE) in;
+
+struct Body
+{
+    vec4 pos; // x, y, z, w=mass
+    vec4 col; // r, g, b, a
+    vec4 vel; // vx, vy, vz, w=radius
+    vec4 acc; // ax, ay, az, w=bodyID
+};
+
+layout(std430, binding=0) buffer bodies_in
+{
+    Body bodies[];
+} IN;
+
+layout(std430, binding=1) buffer bodies_out
+{
+    Body bodies[];
+} OUT;
+
+layout(std430, binding=2) buffer bodies_spawn
+{
+    Body bodies[];
+} SPAWN;
+
+layout(std430, binding=4) buffer bodies_count
+{
+    int  nb_body;
+    uint max_radius;  // collide_cs.glsl
+    uint dispatch[3]; // glDispatchComputeIndirect: groups x, y, z
+    uint draw[4];     // glDrawArraysIndirect: vertices, instances, first vertex, base instance
+    int  nb_keep;     // bodies left by COMPACT
+    int  next_id;     // body ID of the next spawned body
+} COUNT;
+
+void set_args()
+{
+    int n = clamp(COUNT.nb_body, 0, capacity);
+
+    COUNT.nb_body = n;
+
+    // every invocation checks the body count, round up
+    COUNT.dispatch[0] = uint((n + group_size - 1) / group_size);
+    COUNT.dispatch[1] = 1;
+    COUNT.dispatch[2] = 1;
+
+    COUNT.draw[0] = uint(n);
+    COUNT.draw[1] = 1;
+    COUNT.draw[2] = 0;
+    COUNT.draw[3] = 0;
+}
+
+void main()
+{
+    int i = int(gl_GlobalInvocationID.x);
+
+    if (pass_id == PASS_ARGS) {
+        if (i == 0) set_args();
+    }
+    else if (pass_id == PASS_SPAWN) {
+        if (i >= nb_spawn) return;
+
+        int slot = atomicAdd(COUNT.nb_body, 1);
+        if (slot >= capacity) return;
+
+        // acc from the next force evaluation
+        Body body = SPAWN.bodies[i];
+        body.acc = vec4(0.0, 0.0, 0.0, float(atomicAdd(COUNT.next_id, 1)));
+
+        IN.bodies[slot] = body;
+    }
+    else if (pass_id == PASS_COMPACT) {
+        if (i >= COUNT.nb_body) return;
+
+        Body body = IN.bodies[i];
+
+        if (body.pos.w <= 0.0) return;
+        if (remove_radius > 0.0 && dot(body.pos.xyz, body.pos.xyz) > remove_radius * remove_radius) return;
+
+        OUT.bodies[atomicAdd(COUNT.nb_keep, 1)] = body;
+    }
+    else if (pass_id == PASS_KEEP) {
+        if (i == 0) {
+            COUNT.nb_body = COUNT.nb_keep;
+            set_args();
+        }
+    }
+}
@@ -0,0 +1,125 @@
+#version 430
+
+#define XGROUPSIZE  XGROUPSIZE_VAL
+#define YGROUPSIZE  YGROUPSIZE_VAL
+#define ZGROUPSIZE  ZGROUPSIZE_VAL
+
+// hierarchical block timesteps: a body on level L steps with dt / 2^L, dt = the largest step (block_timestep.py),
+// one block step = 2^max_level substeps, every substep runs OPEN, FORCE, CLOSE
+#define PASS_INIT   0 // acc + level for every body
+#define PASS_OPEN   1 // leap 1/2 for the bodies starting a step, drift for everybody
+#define PASS_FORCE  2 // acc for the bodies ending a step
+#define PASS_CLOSE  3 // leap 1/2 + new level for the bodies ending a step
+
+uniform int   nb_body;
+uniform int   pass_id;
+uniform int   substep;
+uniform int   max_level;
+uniform float dt;
+uniform float eta;
+uniform float eps2;
+
+layout(local_size_x=XGROUPSIZE, local_size_y=YGROUPSIZE, local_size_z=ZGROUPSIZE) in;
+
+struct Body
+{
+    vec4 pos; // x, y, z, w=mass
+    vec4 col; // r, g, b, a
+    vec4 vel; // vx, vy, vz, w=radius
+    vec4 acc; // ax, ay, az, w=bodyID
+};
+
+layout(std430, binding=0) buffer bodies_in
+{
+    Body bodies[];
+} IN;
+
+layout(std430, binding=2) buffer bodies_step
+{
+    vec4 jerk[]; // w=level (xyz is the Hermite jerk, unused here)
+} STEP;
+
+int stride(int level)
+{
+    return 1 << (max_level - level);
+}
+
+int wanted_level(vec3 acc)
+{
+    // dt_i = eta sqrt(eps / |a|)
+    float a = length(acc);
+
+    if (a <= 0.0) return 0;
+
+    float dt_wanted = eta * sqrt(sqrt(eps2) / a);
+    if (dt_wanted >= dt) return 0;
+
+    return min(int(ceil(log2(dt / dt_wanted))), max_level);
+}
+
+void accel(uint i)
+{
+    vec3 pos = IN.bodies[i].pos.xyz;
+    vec3 acc = vec3(0.0);
+
+    for (int j=0; j < nb_body; j++) {
+        // not the body itself: 0 / 0 when eps2 = 0
+        if (j == int(i)) continue;
+
+        vec3 dr = IN.bodies[j].pos.xyz - pos;
+
+        float dr2 = dot(dr, dr) + eps2;
+        float phi = IN.bodies[j].pos.w / (sqrt(dr2) * dr2);
+
+        acc += dr * phi;
+    }
+
+    IN.bodies[i].acc.xyz = acc;
+}
+
+void main()
+{
+    uint i = gl_GlobalInvocationID.x;
+
+    if (i >= nb_body) return;
+
+    float dt_min = dt / float(1 << max_level);
+
+    if (pass_id == PASS_INIT) {
+        accel(i);
+        STEP.jerk[i].w = float(wanted_level(IN.bodies[i].acc.xyz));
+        return;
+    }
+
+    int level = int(STEP.jerk[i].w);
+    int s = stride(level);
+
+    if (pass_id == PASS_OPEN) {
+        // leap 1/2
+        if (substep % s == 0) {
+            IN.bodies[i].vel.xyz += IN.bodies[i].acc.xyz * (0.5 * dt_min * float(s));
+        }
+
+        IN.bodies[i].pos.xyz += IN.bodies[i].vel.xyz * dt_min;
+        return;
+    }
+
+    // FORCE and CLOSE: bodies ending their step only
+    if ((substep + 1) % s != 0) return;
+
+    if (pass_id == PASS_FORCE) {
+        accel(i);
+    }
+    else if (pass_id == PASS_CLOSE) {
+        // leap 1/2
+        IN.bodies[i].vel.xyz += IN.bodies[i].acc.xyz * (0.5 * dt_min * float(s));
+
+        // a bigger step only on a substep aligned with it
+        int new_level = wanted_level(IN.bodies[i].acc.xyz);
+        while (new_level < level && (substep + 1) % stride(new_level) != 0) {
+            new_level++;
+        }
+
+        STEP.jerk[i].w = float(new_level);
+    }
+}
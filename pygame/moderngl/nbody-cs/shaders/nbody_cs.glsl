@@ -3,15 +3,32 @@
 #define XGROUPSIZE  XGROUPSIZE_VAL
 #define YGROUPSIZE  YGROUPSIZE_VAL
 #define ZGROUPSIZE  ZGROUPSIZE_VAL
-#define NB_BODY     NB_BODY_VAL
 
-// TODO set as uniform
-const float EPS     = 0.3;
-const float DT      = 1.0/256.0;
-const float EPS2    = EPS * EPS;
-const float HALF_DT = 0.5 * DT;
+// force accumulation: 0 = float32, 1 = float64, 2 = Kahan compensated float32 (PRECISION in config.py)
+#define PRECISION   PRECISION_VAL
 
-//uniform int nb_body;
+// direct sum: 0 = every invocation reads the bodies from the SSBO, 1 = the workgroup stages them through
+// shared memory one tile (one body per invocation) at a time (CS_TILED in config.py)
+#define TILED       TILED_VAL
+#define TILE_SIZE   (XGROUPSIZE * YGROUPSIZE * ZGROUPSIZE)
+
+// global timestep integrators, one pass per dispatch, see integrators.py
+//   leapfrog / yoshida : KICK_DRIFT + ACC per substep, one KICK at the end
+//   hermite4           : PREDICT + ACC_JERK + CORRECT
+#define PASS_ACC         0 // acc at the current positions
+#define PASS_KICK_DRIFT  1 // vel += acc * kick, pos += vel * drift
+#define PASS_KICK        2 // vel += acc * kick
+#define PASS_ACC_JERK    3 // acc + jerk at the current positions and velocities
+#define PASS_PREDICT     4 // save the state at the start of the step, predict pos + vel
+#define PASS_CORRECT     5 // Hermite corrector from the start state and the predicted acc + jerk
+
+// set at dispatch time: one compiled shader for any body count and timestep
+uniform float dt;
+uniform float eps2;
+
+uniform int   pass_id;
+uniform float kick;
+uniform float drift;
 
 layout(local_size_x=XGROUPSIZE, local_size_y=YGROUPSIZE, local_size_z=ZGROUPSIZE) in;
 
@@ -23,50 +40,208 @@ struct Body
     vec4 acc; // ax, ay, az, w=bodyID
 };
 
+struct Start
+{
+    vec4 pos;
+    vec4 vel;
+    vec4 acc;
+    vec4 jerk;
+};
+
 layout(std430, binding=0) buffer bodies_in
 {
     Body bodies[];
 } IN;
 
-layout(std430, binding=1) buffer bodies_out
+// Hermite only
+layout(std430, binding=2) buffer bodies_jerk
 {
-    Body bodies[];
-} OUT;
+    vec4 jerk[]; // jx, jy, jz, w unused
+} JERK;
 
-void main()
+layout(std430, binding=3) buffer bodies_start
 {
-    int current_index = int(gl_GlobalInvocationID);
+    Start bodies[];
+} START;
 
-    // if went past number of particles, skip
-    //if (current_index >= NB_BODY_VAL + XGROUPSIZE) return;
+// body count, written by the CPU on a new set of bodies and by collide_cs.glsl when bodies merge
+layout(std430, binding=4) buffer bodies_count
+{
+    int  nb_body;
+    uint max_radius;
+} COUNT;
+
+#if TILED
+shared vec4 tile_pos[TILE_SIZE]; // x, y, z, w=mass
+shared vec4 tile_vel[TILE_SIZE]; // ACC_JERK only
+#endif
+
+#if PRECISION == 1
+#define SUM dvec3
+#else
+#define SUM vec3
+#endif
+
+// sum += value, c keeps the low order bits the float32 sum lost (Kahan)
+void sum_add(inout SUM sum, inout vec3 c, vec3 value)
+{
+#if PRECISION == 2
+    // precise: no reassociation, (t - sum) - y would fold to 0
+    precise vec3 y = value - c;
+    precise vec3 t = sum + y;
+    precise vec3 lost = (t - sum) - y;
+    c = lost;
+    sum = t;
+#else
+    sum += SUM(value);
+#endif
+}
+
+void accel(int i)
+{
+    int n = COUNT.nb_body;
+    vec3 pos = i < n ? IN.bodies[i].pos.xyz : vec3(0.0);
+    SUM acc = SUM(0.0);
+    vec3 c = vec3(0.0);
+
+#if TILED
+    for (int t=0; t < n; t += TILE_SIZE) {
+        // one body per invocation, zero mass past the last body
+        int j = t + int(gl_LocalInvocationIndex);
+        tile_pos[gl_LocalInvocationIndex] = j < n ? IN.bodies[j].pos : vec4(0.0);
+        barrier();
+
+        for (int k=0; k < TILE_SIZE; k++) {
+            // not the body itself: 0 / 0 when eps2 = 0
+            if (t + k == i) continue;
+
+            vec3 dr = tile_pos[k].xyz - pos;
+
+            float dr2 = dot(dr, dr) + eps2;
+            float phi = tile_pos[k].w / (sqrt(dr2) * dr2);
 
-    // leap 1/2
-    IN.bodies[current_index].vel.xyz += IN.bodies[current_index].acc.xyz * HALF_DT;
-    IN.bodies[current_index].pos.xyz += IN.bodies[current_index].vel.xyz * DT;
+            sum_add(acc, c, dr * phi);
+        }
 
-    // acc
-    for (int j=0; j < IN.bodies.length(); j++) {
-        if(IN.bodies[current_index].acc.w != IN.bodies[j].acc.w) { // body ID
+        // the whole tile is consumed before the next one overwrites it
+        barrier();
+    }
+#else
+    for (int j=0; j < n; j++) {
+        // not the body itself: 0 / 0 when eps2 = 0
+        if (j == i) continue;
+
+        vec3 dr = IN.bodies[j].pos.xyz - pos;
 
-            vec3 dr = IN.bodies[j].pos.xyz - IN.bodies[current_index].pos.xyz;
+        float dr2 = dot(dr, dr) + eps2;
+        float phi = IN.bodies[j].pos.w / (sqrt(dr2) * dr2);
 
-            float dr2 = dot(dr, dr);
-            dr2 += EPS2;
+        sum_add(acc, c, dr * phi);
+    }
+#endif
 
-            float phi = IN.bodies[j].pos.w / (sqrt(dr2) * dr2);
+    if (i < n) IN.bodies[i].acc.xyz = vec3(acc);
+}
 
-            IN.bodies[current_index].acc.xyz += dr.xyz * phi;
-       }
+void accel_jerk(int i)
+{
+    int n = COUNT.nb_body;
+    vec3 pos = i < n ? IN.bodies[i].pos.xyz : vec3(0.0);
+    vec3 vel = i < n ? IN.bodies[i].vel.xyz : vec3(0.0);
+    SUM acc = SUM(0.0);
+    SUM jerk = SUM(0.0);
+    vec3 c_acc = vec3(0.0);
+    vec3 c_jerk = vec3(0.0);
+
+#if TILED
+    for (int t=0; t < n; t += TILE_SIZE) {
+        int j = t + int(gl_LocalInvocationIndex);
+        tile_pos[gl_LocalInvocationIndex] = j < n ? IN.bodies[j].pos : vec4(0.0);
+        tile_vel[gl_LocalInvocationIndex] = j < n ? IN.bodies[j].vel : vec4(0.0);
+        barrier();
+
+        for (int k=0; k < TILE_SIZE; k++) {
+            if (t + k == i) continue;
+
+            vec3 dr = tile_pos[k].xyz - pos;
+            vec3 dv = tile_vel[k].xyz - vel;
+
+            float dr2 = dot(dr, dr) + eps2;
+            float phi = tile_pos[k].w / (sqrt(dr2) * dr2);
+            float rv  = 3.0 * dot(dr, dv) / dr2;
+
+            sum_add(acc, c_acc, dr * phi);
+            sum_add(jerk, c_jerk, (dv - rv * dr) * phi);
+        }
+
+        barrier();
     }
+#else
+    for (int j=0; j < n; j++) {
+        if (j == i) continue;
 
-    // leap 1/2
-    IN.bodies[current_index].vel.xyz += IN.bodies[current_index].acc.xyz * HALF_DT;
-    IN.bodies[current_index].acc = vec4(0, 0, 0, IN.bodies[current_index].acc.w);
+        vec3 dr = IN.bodies[j].pos.xyz - pos;
+        vec3 dv = IN.bodies[j].vel.xyz - vel;
 
-    //IN.bodies[current_index].pos.z += 0.001;
-    //OUT.bodies[current_index] = IN.bodies[current_index];
+        float dr2 = dot(dr, dr) + eps2;
+        float phi = IN.bodies[j].pos.w / (sqrt(dr2) * dr2);
+        float rv  = 3.0 * dot(dr, dv) / dr2;
 
-    // ensure that all threads are done reading particle data before continuing
-    barrier();
-    memoryBarrier();
-}
\ No newline at end of file
+        sum_add(acc, c_acc, dr * phi);
+        sum_add(jerk, c_jerk, (dv - rv * dr) * phi);
+    }
+#endif
+
+    if (i < n) {
+        IN.bodies[i].acc.xyz = vec3(acc);
+        JERK.jerk[i].xyz = vec3(jerk);
+    }
+}
+
+void main()
+{
+    int i = int(gl_GlobalInvocationID.x);
+
+    // the force passes run on every invocation: the tiled sums need the whole workgroup at each barrier()
+    if (pass_id == PASS_ACC) {
+        accel(i);
+        return;
+    }
+
+    if (pass_id == PASS_ACC_JERK) {
+        accel_jerk(i);
+        return;
+    }
+
+    // if went past number of particles, skip
+    if (i >= COUNT.nb_body) return;
+
+    if (pass_id == PASS_KICK_DRIFT) {
+        IN.bodies[i].vel.xyz += IN.bodies[i].acc.xyz * kick;
+        IN.bodies[i].pos.xyz += IN.bodies[i].vel.xyz * drift;
+    }
+    else if (pass_id == PASS_KICK) {
+        IN.bodies[i].vel.xyz += IN.bodies[i].acc.xyz * kick;
+    }
+    else if (pass_id == PASS_PREDICT) {
+        vec3 pos  = IN.bodies[i].pos.xyz;
+        vec3 vel  = IN.bodies[i].vel.xyz;
+        vec3 acc  = IN.bodies[i].acc.xyz;
+        vec3 jerk = JERK.jerk[i].xyz;
+
+        START.bodies[i] = Start(vec4(pos, 0.0), vec4(vel, 0.0), vec4(acc, 0.0), vec4(jerk, 0.0));
+
+        IN.bodies[i].pos.xyz = pos + vel * dt + acc * (dt * dt / 2.0) + jerk * (dt * dt * dt / 6.0);
+        IN.bodies[i].vel.xyz = vel + acc * dt + jerk * (dt * dt / 2.0);
+    }
+    else if (pass_id == PASS_CORRECT) {
+        Start s = START.bodies[i];
+        vec3 acc  = IN.bodies[i].acc.xyz;
+        vec3 jerk = JERK.jerk[i].xyz;
+
+        vec3 vel = s.vel.xyz + (s.acc.xyz + acc) * (dt / 2.0) + (s.jerk.xyz - jerk) * (dt * dt / 12.0);
+
+        IN.bodies[i].vel.xyz = vel;
+        IN.bodies[i].pos.xyz = s.pos.xyz + (s.vel.xyz + vel) * (dt / 2.0) + (s.acc.xyz - acc) * (dt * dt / 12.0);
+    }
+}
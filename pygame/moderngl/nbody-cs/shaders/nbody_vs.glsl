@@ -11,6 +11,14 @@ uniform mat4 m_model;
 out float body_color_dist;
 
 void main() {
+    // merged bodies (mass 0) past the body count: outside the clip volume
+    if (in_position.w <= 0.0) {
+        gl_Position = vec4(2.0, 2.0, 2.0, 1.0);
+        gl_PointSize = 0.0;
+        body_color_dist = 0.0;
+        return;
+    }
+
     vec4 model_pos = m_model * vec4(in_position.xyz, 1.0);
 	vec4 view_model_pos = m_view * model_pos;
 	gl_Position = m_proj * view_model_pos;
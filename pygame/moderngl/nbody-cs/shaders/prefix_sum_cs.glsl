@@ -0,0 +1,52 @@
+#version 430
+
+// exclusive prefix sum of values[0, n) in place, values[n] = total
+// one workgroup: every invocation scans a contiguous chunk, the chunk totals are scanned in shared memory
+
+#define SCAN_SIZE 256
+
+uniform uint n;
+
+layout(local_size_x=SCAN_SIZE) in;
+
+layout(std430, binding=3) buffer scan_values
+{
+    uint values[];
+} DATA;
+
+shared uint partial[SCAN_SIZE];
+
+void main()
+{
+    uint t = gl_LocalInvocationID.x;
+    uint chunk = (n + SCAN_SIZE - 1) / SCAN_SIZE;
+    uint first = min(t * chunk, n);
+    uint last = min(first + chunk, n);
+
+    uint sum = 0;
+    for (uint k = first; k < last; k++) {
+        sum += DATA.values[k];
+    }
+
+    partial[t] = sum;
+    barrier();
+
+    // Hillis Steele inclusive scan of the chunk totals
+    for (uint offset = 1; offset < SCAN_SIZE; offset *= 2) {
+        uint value = t >= offset ? partial[t - offset] : 0;
+        barrier();
+        partial[t] += value;
+        barrier();
+    }
+
+    uint running = partial[t] - sum;
+    for (uint k = first; k < last; k++) {
+        uint value = DATA.values[k];
+        DATA.values[k] = running;
+        running += value;
+    }
+
+    if (t == SCAN_SIZE - 1) {
+        DATA.values[n] = partial[t];
+    }
+}
@@ -0,0 +1,196 @@
+#version 430
+
+#define XGROUPSIZE  XGROUPSIZE_VAL
+#define YGROUPSIZE  YGROUPSIZE_VAL
+#define ZGROUPSIZE  ZGROUPSIZE_VAL
+
+// SPH acceleration, same passes as sph.py:
+//   CELL, (prefix sum of the cell counts), SCATTER, DENSITY, FORCE
+// DENSITY and FORCE run over the particles in cell order: neighbouring invocations read the same cells
+#define PASS_CELL     0 // cell of every particle, particles per cell
+#define PASS_SCATTER  1 // counting sort by cell
+#define PASS_DENSITY  2 // density + pressure
+#define PASS_FORCE    3 // pressure + viscosity + gravity + walls -> acc
+
+uniform int   pass_id;
+uniform float h;
+uniform float half_box;
+uniform float inv_cell;
+uniform int   grid_size;
+uniform float rest_density;
+uniform float stiffness;
+uniform float viscosity;
+uniform float gravity;
+uniform float wall_width;
+uniform float wall_stiffness;
+uniform float wall_damping;
+
+layout(local_size_x=XGROUPSIZE, local_size_y=YGROUPSIZE, local_size_z=ZGROUPSIZE) in;
+
+struct Body
+{
+    vec4 pos; // x, y, z, w=mass
+    vec4 col; // r, g, b, a
+    vec4 vel; // vx, vy, vz, w=radius
+    vec4 acc; // ax, ay, az, w=bodyID
+};
+
+layout(std430, binding=0) buffer bodies_in
+{
+    Body bodies[];
+} IN;
+
+layout(std430, binding=2) buffer bodies_fluid
+{
+    vec2 fluid[]; // density, pressure
+} FLUID;
+
+layout(std430, binding=4) buffer bodies_count
+{
+    int  nb_body;
+    uint max_radius;
+} COUNT;
+
+layout(std430, binding=5) buffer grid_cells
+{
+    uint cell_start[];
+} CELLS;
+
+layout(std430, binding=6) buffer grid_cursor
+{
+    uint cursor[];
+} CURSOR;
+
+layout(std430, binding=7) buffer grid_bodies
+{
+    ivec2 body[]; // x = cell of particle i, y = particle in sorted slot i
+} GRID;
+
+const float PI = 3.14159265358979;
+
+ivec3 get_cell(vec3 p)
+{
+    return clamp(ivec3(floor((p + half_box) * inv_cell)), ivec3(0), ivec3(grid_size - 1));
+}
+
+int get_cell_index(ivec3 c)
+{
+    return (c.z * grid_size + c.y) * grid_size + c.x;
+}
+
+float wall(float p, float v)
+{
+    // spring on the part of the particle past wall_width from a face of the box, damped along the normal
+    float a = 0.0;
+
+    float d = p + half_box;
+    if (d < wall_width) a += wall_stiffness * (wall_width - d) - wall_damping * min(v, 0.0);
+
+    d = half_box - p;
+    if (d < wall_width) a -= wall_stiffness * (wall_width - d) + wall_damping * max(v, 0.0);
+
+    return a;
+}
+
+void density(int i)
+{
+    vec3 pos = IN.bodies[i].pos.xyz;
+    ivec3 c = get_cell(pos);
+    ivec3 lo = max(c - 1, ivec3(0));
+    ivec3 hi = min(c + 1, ivec3(grid_size - 1));
+    float h2 = h * h;
+    float rho = 0.0;
+
+    for (int kz = lo.z; kz <= hi.z; kz++) {
+        for (int ky = lo.y; ky <= hi.y; ky++) {
+            for (int kx = lo.x; kx <= hi.x; kx++) {
+                int cell = get_cell_index(ivec3(kx, ky, kz));
+
+                // the particle itself included: W(0)
+                for (uint l = CELLS.cell_start[cell]; l < CELLS.cell_start[cell + 1]; l++) {
+                    int j = GRID.body[l].y;
+                    vec3 dr = IN.bodies[j].pos.xyz - pos;
+                    float dr2 = dot(dr, dr);
+
+                    if (dr2 < h2) {
+                        float q = h2 - dr2;
+                        rho += IN.bodies[j].pos.w * q * q * q;
+                    }
+                }
+            }
+        }
+    }
+
+    rho *= 315.0 / (64.0 * PI * pow(h, 9.0));
+    FLUID.fluid[i] = vec2(rho, max(stiffness * (rho - rest_density), 0.0));
+}
+
+void force(int i)
+{
+    vec3 pos = IN.bodies[i].pos.xyz;
+    vec3 vel = IN.bodies[i].vel.xyz;
+    float p_i = FLUID.fluid[i].y;
+    ivec3 c = get_cell(pos);
+    ivec3 lo = max(c - 1, ivec3(0));
+    ivec3 hi = min(c + 1, ivec3(grid_size - 1));
+    float h2 = h * h;
+    vec3 acc = vec3(0.0);
+
+    for (int kz = lo.z; kz <= hi.z; kz++) {
+        for (int ky = lo.y; ky <= hi.y; ky++) {
+            for (int kx = lo.x; kx <= hi.x; kx++) {
+                int cell = get_cell_index(ivec3(kx, ky, kz));
+
+                for (uint l = CELLS.cell_start[cell]; l < CELLS.cell_start[cell + 1]; l++) {
+                    int j = GRID.body[l].y;
+                    vec3 dr = IN.bodies[j].pos.xyz - pos;
+                    float dr2 = dot(dr, dr);
+
+                    if (j == i || dr2 >= h2) continue;
+
+                    float r = max(sqrt(dr2), 1e-6);
+                    float q = h - r;
+                    vec2 fluid_j = FLUID.fluid[j];
+                    float m_j = IN.bodies[j].pos.w;
+
+                    // pressure pushes i away from j, viscosity pulls v_i towards v_j
+                    float press = -m_j * (p_i + fluid_j.y) / (2.0 * fluid_j.x) * q * q / r;
+                    float visc = viscosity * m_j / fluid_j.x * q;
+
+                    acc += press * dr + visc * (IN.bodies[j].vel.xyz - vel);
+                }
+            }
+        }
+    }
+
+    acc *= 45.0 / (PI * pow(h, 6.0)) / FLUID.fluid[i].x;
+    acc.y -= gravity;
+
+    acc += vec3(wall(pos.x, vel.x), wall(pos.y, vel.y), wall(pos.z, vel.z));
+
+    IN.bodies[i].acc.xyz = acc;
+}
+
+void main()
+{
+    int k = int(gl_GlobalInvocationID.x);
+
+    if (k >= COUNT.nb_body) return;
+
+    if (pass_id == PASS_CELL) {
+        int cell = get_cell_index(get_cell(IN.bodies[k].pos.xyz));
+
+        GRID.body[k].x = cell;
+        atomicAdd(CELLS.cell_start[cell], 1);
+    }
+    else if (pass_id == PASS_SCATTER) {
+        uint slot = atomicAdd(CURSOR.cursor[GRID.body[k].x], 1);
+        GRID.body[slot].y = k;
+    }
+    else if (pass_id == PASS_DENSITY) {
+        density(GRID.body[k].y);
+    }
+    else if (pass_id == PASS_FORCE) {
+        force(GRID.body[k].y);
+    }
+}
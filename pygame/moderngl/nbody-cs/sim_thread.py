@@ -0,0 +1,72 @@
+from config import *
+import threading
+import gravity
+
+# -----------------------------------------------------------------------------------------------------------
+
+class SimulationThread(threading.Thread):
+    # runs the CPU integrator on its own thread (the numba kernels release the GIL) and publishes
+    # double buffered pos + col snapshots: the worker packs into the back buffer and only the swap
+    # is done under the lock, so the render loop never waits for a simulation step
+
+    def __init__(self, store, kernel=NBODY_KERNEL, diagnostics=None, snapshots=None, checkpoints=None, steps=0,
+                 dt=DT, eps2=EPS2):
+        super().__init__(name="nbody-sim", daemon=True)
+
+        self.store = store
+        self.kernel = kernel
+        self.dt = dt
+        self.eps2 = eps2
+        self.diagnostics = diagnostics
+        self.snapshot_writer = snapshots
+        self.checkpoints = checkpoints
+
+        self.snapshots = [store.pack_render(), store.pack_render()]
+        self.front = 0
+        self.version = 0
+        self.lock = threading.Lock()
+
+        self.steps = steps
+        self.steps_per_sec = 0.0
+        self.sps = FPSCounter()
+
+        self.stop_event = threading.Event()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            gravity.calc_bodies(self.store, self.kernel, dt=self.dt, eps2=self.eps2)
+
+            if self.diagnostics:
+                self.diagnostics.update(self.store)
+
+            back = 1 - self.front
+            self.store.pack_render(self.snapshots[back])
+
+            # publish
+            with self.lock:
+                self.front = back
+                self.version += 1
+
+            self.steps += 1
+
+            if self.snapshot_writer and self.snapshot_writer.due(self.steps):
+                self.snapshot_writer.submit_store(self.steps, self.store)
+
+            if self.checkpoints and self.checkpoints.due(self.steps):
+                self.checkpoints.save(self.store.pack(), self.steps)
+
+            self.sps.tick()
+            self.steps_per_sec = self.sps.get_fps()
+
+    def upload_latest(self, upload, last_version):
+        # calls upload(snapshot) if a newer snapshot was published, returns the uploaded version
+        with self.lock:
+            if self.version == last_version:
+                return last_version
+
+            upload(self.snapshots[self.front])
+            return self.version
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
@@ -0,0 +1,164 @@
+from config import *
+import threading, queue
+import numpy as np
+
+# -----------------------------------------------------------------------------------------------------------
+# Memory mapped snapshot file
+#
+#   header  64 bytes       HEADER
+#   index   max_frames     INDEX (step, time) per frame
+#   frames  max_frames     nb_body * nb_fields float32: x, y, z [, vx, vy, vz], page aligned
+#
+# the file is preallocated (sparse) for max_frames, nb_frames in the header is only bumped once a
+# frame is complete, so a crashed run still leaves a readable file
+
+MAGIC = b"NBSNAP01"
+
+HEADER = np.dtype([("magic",        "S8"),
+                   ("version",      "<u4"),
+                   ("nb_body",      "<u4"),
+                   ("nb_fields",    "<u4"),
+                   ("max_frames",   "<u4"),
+                   ("nb_frames",    "<u4"),
+                   ("pad",          "<u4"),
+                   ("dt",           "<f8"),
+                   ("index_offset", "<u8"),
+                   ("data_offset",  "<u8"),
+                   ("reserved",     "<u8")])
+
+INDEX = np.dtype([("step", "<i8"), ("time", "<f8")])
+
+PAGE_SIZE = 4096
+
+def get_layout(nb_body, nb_fields, max_frames):
+    index_offset = HEADER.itemsize
+    data_offset = index_offset + max_frames * INDEX.itemsize
+    data_offset = (data_offset + PAGE_SIZE - 1) // PAGE_SIZE * PAGE_SIZE
+
+    return index_offset, data_offset, data_offset + max_frames * nb_body * nb_fields * 4
+
+def open_snapshots(path):
+    # read only views: header, index[:nb_frames], frames (nb_frames, nb_body, nb_fields)
+    header = np.fromfile(path, dtype=HEADER, count=1)[0]
+    if header["magic"] != MAGIC:
+        raise ValueError(f"{path}: not a snapshot file")
+
+    nb_frames = int(header["nb_frames"])
+    index = np.memmap(path, dtype=INDEX, mode='r', offset=int(header["index_offset"]), shape=(nb_frames,))
+    frames = np.memmap(path, dtype='f4', mode='r', offset=int(header["data_offset"]),
+                       shape=(nb_frames, int(header["nb_body"]), int(header["nb_fields"])))
+
+    return header, index, frames
+
+# -----------------------------------------------------------------------------------------------------------
+
+class SnapshotWriter(threading.Thread):
+    # the caller only copies positions (and velocities) into one of two staging frames, the
+    # copy into the mapping and the flush to disk are done on this thread
+
+    def __init__(self, path=SNAPSHOT_PATH, nb_body=NB_BODY, every=SNAPSHOT_EVERY, velocities=SNAPSHOT_VELOCITIES,
+                 max_frames=SNAPSHOT_MAX_FRAMES, dt=DT):
+        super().__init__(name="nbody-snapshot", daemon=True)
+
+        self.path = path
+        self.every = max(1, every)
+        self.nb_body = nb_body
+        self.nb_fields = 6 if velocities else 3
+        self.max_frames = max_frames
+
+        index_offset, data_offset, size = get_layout(nb_body, self.nb_fields, max_frames)
+
+        with open(path, "wb") as f:
+            f.truncate(size)
+
+        self.header = np.memmap(path, dtype=HEADER, mode='r+', shape=(1,))
+        self.index = np.memmap(path, dtype=INDEX, mode='r+', offset=index_offset, shape=(max_frames,))
+        self.frames = np.memmap(path, dtype='f4', mode='r+', offset=data_offset,
+                                shape=(max_frames, nb_body, self.nb_fields))
+
+        self.header[0] = (MAGIC, 1, nb_body, self.nb_fields, max_frames, 0, 0, dt, index_offset, data_offset, 0)
+        self.header.flush()
+        self.dt = dt
+
+        self.nb_frames = 0
+        self.submitted = 0
+        self.dropped = 0
+
+        self.staging = [np.empty((nb_body, self.nb_fields), dtype='f4') for _ in range(2)]
+        self.free = queue.Queue()
+        self.ready = queue.Queue()
+        for slot in range(len(self.staging)):
+            self.free.put(slot)
+
+        self.start()
+
+    def due(self, step):
+        return step % self.every == 0
+
+    def get_slot(self):
+        # only waits when the disk is two frames behind
+        if self.submitted == self.max_frames:
+            self.dropped += 1
+            return None
+
+        self.submitted += 1
+        return self.free.get()
+
+    def submit_store(self, step, store):
+        slot = self.get_slot()
+        if slot is None:
+            return
+
+        # bodies merged by collisions are written as zeros past the live count
+        frame = self.staging[slot]
+        n = store.nb_body
+        frame[:n, 0], frame[:n, 1], frame[:n, 2] = store.x, store.y, store.z
+        if self.nb_fields == 6:
+            frame[:n, 3], frame[:n, 4], frame[:n, 5] = store.vx, store.vy, store.vz
+        frame[n:] = 0.0
+
+        self.ready.put((slot, step))
+
+    def submit_bodies(self, step, bodies):
+        # (N, 16) Body records, e.g. read back from the SSBO
+        slot = self.get_slot()
+        if slot is None:
+            return
+
+        bodies = bodies.reshape(-1, 16)
+        frame = self.staging[slot]
+        frame[:, 0:3] = bodies[:, POSX:POSZ + 1]
+        if self.nb_fields == 6:
+            frame[:, 3:6] = bodies[:, VELX:VELZ + 1]
+
+        self.ready.put((slot, step))
+
+    def run(self):
+        while True:
+            item = self.ready.get()
+            if item is None:
+                break
+
+            slot, step = item
+            k = self.nb_frames
+
+            self.frames[k] = self.staging[slot]
+            self.free.put(slot)
+
+            self.index[k] = (step, step * self.dt)
+            self.frames.flush()
+            self.index.flush()
+
+            # publish the frame last
+            self.nb_frames += 1
+            self.header["nb_frames"] = self.nb_frames
+            self.header.flush()
+
+    def close(self):
+        self.ready.put(None)
+        self.join()
+
+        if self.dropped:
+            print(f"{self.path}: {self.dropped} frames dropped, SNAPSHOT_MAX_FRAMES = {self.max_frames} reached")
+
+        del self.frames, self.index, self.header
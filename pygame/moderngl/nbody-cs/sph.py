@@ -0,0 +1,190 @@
+from config import *
+import numpy as np
+import math
+from jit import numba
+
+# -----------------------------------------------------------------------------------------------------------
+# Smoothed particle hydrodynamics instead of gravity (Mueller, Charypar & Gross 2003)
+#
+#   1. cell list: a uniform grid of cells >= h over the box, counting sort of the particles by cell,
+#      cell_start = prefix sum of the counts, rebuilt every force evaluation
+#   2. density: rho_i = sum_j m_j W_poly6(r_ij, h), pressure p_i = k (rho_i - rho0), clamped at 0
+#   3. forces: symmetric pressure (spiky kernel gradient), viscosity (viscosity kernel laplacian),
+#      gravity along -y and spring + damper walls at the box faces
+#
+# only the 27 cells around a particle are visited, every pass is O(N). The smoothing length follows the
+# particle spacing: h = SPH_H_FACTOR * cbrt(m / rho0). The result is an acceleration, so the symplectic
+# integrators step the fluid as they step the bodies. The compute shader version (sph_cs.glsl,
+# gpu_sph.GPUSPH) applies the same passes
+
+def get_smoothing_length(mass, rest_density=SPH_REST_DENSITY, h_factor=SPH_H_FACTOR):
+    return h_factor * float(np.cbrt(np.max(mass) / rest_density))
+
+def get_grid_size(h, box=SPH_BOX):
+    # cells per axis, cell size box / grid_size >= h
+    return max(1, int(box / h))
+
+@numba.njit(nogil=True)
+def get_cell(p, half_box, inv_cell, grid_size):
+    c = int(math.floor((p + half_box) * inv_cell))
+    return min(max(c, 0), grid_size - 1)
+
+@numba.njit(fastmath=True, nogil=True)
+def wall(p, v, half_box, width, stiffness, damping):
+    # spring on the part of the particle past width from a face of the box, damped along the normal
+    a = 0.0
+
+    d = p + half_box
+    if d < width:
+        a += stiffness * (width - d) - damping * min(v, 0.0)
+
+    d = half_box - p
+    if d < width:
+        a -= stiffness * (width - d) + damping * max(v, 0.0)
+
+    return a
+
+@numba.njit(fastmath=True, nogil=True)
+def build_cells(x, y, z, half_box, inv_cell, grid_size, cell_start, sorted_index):
+    # particles of cell c: sorted_index[cell_start[c]:cell_start[c + 1]], c = (cz * G + cy) * G + cx
+    n = x.shape[0]
+    body_cell = np.empty(n, dtype=np.int64)
+
+    cell_start[:] = 0
+    for i in range(n):
+        c = (get_cell(z[i], half_box, inv_cell, grid_size) * grid_size
+             + get_cell(y[i], half_box, inv_cell, grid_size)) * grid_size + get_cell(x[i], half_box, inv_cell, grid_size)
+        body_cell[i] = c
+        cell_start[c + 1] += 1
+
+    for c in range(grid_size ** 3):
+        cell_start[c + 1] += cell_start[c]
+
+    cursor = cell_start[:-1].copy()
+    for i in range(n):
+        c = body_cell[i]
+        sorted_index[cursor[c]] = i
+        cursor[c] += 1
+
+@numba.njit(fastmath=True, parallel=True, nogil=True)
+def density(x, y, z, m, h, half_box, inv_cell, grid_size, cell_start, sorted_index, rest_density, stiffness,
+            rho, p):
+    n = x.shape[0]
+    H2 = np.float32(h * h)
+    POLY6 = np.float32(315.0 / (64.0 * math.pi * h ** 9))
+
+    for i in numba.prange(n):
+        PIX, PIY, PIZ = x[i], y[i], z[i]
+        cx = get_cell(PIX, half_box, inv_cell, grid_size)
+        cy = get_cell(PIY, half_box, inv_cell, grid_size)
+        cz = get_cell(PIZ, half_box, inv_cell, grid_size)
+        RHO = np.float32(0.0)
+
+        for kz in range(max(cz - 1, 0), min(cz + 2, grid_size)):
+            for ky in range(max(cy - 1, 0), min(cy + 2, grid_size)):
+                for kx in range(max(cx - 1, 0), min(cx + 2, grid_size)):
+                    c = (kz * grid_size + ky) * grid_size + kx
+
+                    # the particle itself included: W(0)
+                    for l in range(cell_start[c], cell_start[c + 1]):
+                        j = sorted_index[l]
+                        DRX = x[j] - PIX
+                        DRY = y[j] - PIY
+                        DRZ = z[j] - PIZ
+                        DR2 = DRX * DRX + DRY * DRY + DRZ * DRZ
+
+                        if DR2 < H2:
+                            Q = H2 - DR2
+                            RHO += m[j] * Q * Q * Q
+
+        rho[i] = RHO * POLY6
+        p[i] = max(stiffness * (rho[i] - rest_density), 0.0)
+
+@numba.njit(fastmath=True, parallel=True, nogil=True)
+def forces(x, y, z, m, vx, vy, vz, rho, p, h, half_box, inv_cell, grid_size, cell_start, sorted_index, viscosity,
+           gravity, wall_width, wall_stiffness, wall_damping, ax, ay, az):
+    n = x.shape[0]
+    H2 = np.float32(h * h)
+    SPIKY = np.float32(45.0 / (math.pi * h ** 6))
+
+    for i in numba.prange(n):
+        PIX, PIY, PIZ = x[i], y[i], z[i]
+        VIX, VIY, VIZ = vx[i], vy[i], vz[i]
+        cx = get_cell(PIX, half_box, inv_cell, grid_size)
+        cy = get_cell(PIY, half_box, inv_cell, grid_size)
+        cz = get_cell(PIZ, half_box, inv_cell, grid_size)
+        AX = AY = AZ = np.float32(0.0)
+
+        for kz in range(max(cz - 1, 0), min(cz + 2, grid_size)):
+            for ky in range(max(cy - 1, 0), min(cy + 2, grid_size)):
+                for kx in range(max(cx - 1, 0), min(cx + 2, grid_size)):
+                    c = (kz * grid_size + ky) * grid_size + kx
+
+                    for l in range(cell_start[c], cell_start[c + 1]):
+                        j = sorted_index[l]
+                        DRX = x[j] - PIX
+                        DRY = y[j] - PIY
+                        DRZ = z[j] - PIZ
+                        DR2 = DRX * DRX + DRY * DRY + DRZ * DRZ
+
+                        if j == i or DR2 >= H2:
+                            continue
+
+                        R = max(math.sqrt(DR2), np.float32(1e-6))
+                        Q = h - R
+
+                        # pressure pushes i away from j, viscosity pulls v_i towards v_j
+                        PRESS = -m[j] * (p[i] + p[j]) / (2.0 * rho[j]) * Q * Q / R
+                        VISC = viscosity * m[j] / rho[j] * Q
+
+                        AX += PRESS * DRX + VISC * (vx[j] - VIX)
+                        AY += PRESS * DRY + VISC * (vy[j] - VIY)
+                        AZ += PRESS * DRZ + VISC * (vz[j] - VIZ)
+
+        INV_RHO = SPIKY / rho[i]
+        AX *= INV_RHO
+        AY *= INV_RHO
+        AZ *= INV_RHO
+
+        AY -= gravity
+
+        AX += wall(PIX, VIX, half_box, wall_width, wall_stiffness, wall_damping)
+        AY += wall(PIY, VIY, half_box, wall_width, wall_stiffness, wall_damping)
+        AZ += wall(PIZ, VIZ, half_box, wall_width, wall_stiffness, wall_damping)
+
+        ax[i] = AX
+        ay[i] = AY
+        az[i] = AZ
+
+# -----------------------------------------------------------------------------------------------------------
+
+def get_wall(h, stiffness=SPH_STIFFNESS, h_factor=SPH_H_FACTOR):
+    # half a particle spacing thick, the spring of the pressure over one smoothing length, close to critically damped
+    wall_stiffness = stiffness / (h * h)
+    return 0.5 * h / h_factor, wall_stiffness, 2.0 * math.sqrt(wall_stiffness)
+
+def accel(store, box=SPH_BOX):
+    # SPH acceleration of every particle at the current positions and velocities
+    s = store
+
+    h = get_smoothing_length(s.mass)
+    grid_size = get_grid_size(h, box)
+    half_box = 0.5 * box
+    inv_cell = grid_size / box
+
+    cell_start = np.empty(grid_size ** 3 + 1, dtype=np.int64)
+    sorted_index = np.empty(s.nb_body, dtype=np.int64)
+    build_cells(s.x, s.y, s.z, half_box, inv_cell, grid_size, cell_start, sorted_index)
+
+    rho = np.empty(s.nb_body, dtype='f4')
+    p = np.empty(s.nb_body, dtype='f4')
+    density(s.x, s.y, s.z, s.mass, h, half_box, inv_cell, grid_size, cell_start, sorted_index,
+            SPH_REST_DENSITY, SPH_STIFFNESS, rho, p)
+
+    wall_width, wall_stiffness, wall_damping = get_wall(h)
+    forces(s.x, s.y, s.z, s.mass, s.vx, s.vy, s.vz, rho, p, h, half_box, inv_cell, grid_size, cell_start,
+           sorted_index, SPH_VISCOSITY, SPH_GRAVITY, wall_width, wall_stiffness, wall_damping, s.ax, s.ay, s.az)
+
+    # no gravitational potential in a fluid
+    s.pot.fill(0.0)
+    s.pot_source = None
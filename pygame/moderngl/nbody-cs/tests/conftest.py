@@ -0,0 +1,4 @@
+import os, sys
+
+# the app modules import each other by name (from config import *), like when run from nbody-cs/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,31 @@
+import numpy as np
+import gravity
+import initial_conditions
+from body_store import BodyStore
+from diagnostics import Diagnostics
+
+def make_store(preset="ball", nb_body=2048, seed=1):
+    return BodyStore.from_bodies(initial_conditions.make_bodies(preset, nb_body, seed))
+
+def test_pot_not_used_by_diagnostics():
+    # the mesh potential is biased (CIC self term, node sampled Green's function): exact pass instead
+    s = make_store()
+    gravity.calc_acc(s, "particle_mesh")
+
+    assert s.pot_source is None
+
+def test_energy_drift():
+    s = make_store()
+
+    diagnostics = Diagnostics(every=1, log=None)
+    gravity.calc_acc(s, "particle_mesh")
+    diagnostics.reset(s)
+
+    # a switch of potential estimator between step 0 and step 1 shows up as a jump of a few %
+    for _ in range(5):
+        gravity.calc_bodies(s, "particle_mesh", block_timesteps=0, integrator="leapfrog", collisions=0, fluid=0)
+        drift = diagnostics.update(s)["energy_drift"]
+
+        assert abs(drift) < 1e-3, drift
+
+    assert np.isfinite(s.x).all()
@@ -0,0 +1,27 @@
+import types
+
+# -----------------------------------------------------------------------------------------------------------
+# numba when it is installed, otherwise the same decorators as plain Python: model.py still imports on a
+# Python numba / llvmlite have no wheel for yet. config.py then switches NBODY_KERNEL to numpy_blocked, the
+# numba kernels (direct, symmetric) still run, interpreted and slowly
+
+try:
+    import numba
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+
+    def njit(*args, **kwargs):
+        # @njit and @njit(fastmath=True, ...)
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+
+        return lambda func: func
+
+    numba = types.SimpleNamespace(
+        njit            = njit,
+        prange          = range,
+        config          = types.SimpleNamespace(NUMBA_NUM_THREADS=1),
+        set_num_threads = lambda nb_threads: None,
+        get_num_threads = lambda: 1,
+    )
@@ -27,7 +27,9 @@ class App:
         print("XGROUPSIZE=", XGROUPSIZE)
         print("YGROUPSIZE=", YGROUPSIZE)
         print("ZGROUPSIZE=", ZGROUPSIZE)
+        print("CS_TILED=", CS_TILED)
         print("NB_BODY=", NB_BODY)
+        print("NBODY_KERNEL=", NBODY_KERNEL)
 
         #
         self.lastTime = time.time()
@@ -78,7 +80,7 @@ class App:
             compute_shader_source = compute_shader_source.replace("XGROUPSIZE_VAL", str(XGROUPSIZE)) \
                                                          .replace("YGROUPSIZE_VAL", str(YGROUPSIZE)) \
                                                          .replace("ZGROUPSIZE_VAL", str(ZGROUPSIZE)) \
-                                                         .replace("NB_BODY_VAL", str(NB_BODY)) \
+                                                         .replace("TILED_VAL", str(int(bool(CS_TILED))))
 
             self.compute_shader_program = compileProgram(compileShader(compute_shader_source, GL_COMPUTE_SHADER))
 
@@ -209,20 +211,9 @@ class App:
 
             self.camera.update(self.mouse_dx, self.mouse_dy, self.forward, self.backward, self.left, self.right, self.up, self.down)
 
+            # no CPU wait: the barriers order the passes and the draw
             if USE_COMPUTE_SHADER:
-                glUseProgram(self.compute_shader_program)
-                glBindBufferBase(GL_SHADER_STORAGE_BUFFER, 0, self.bodies.bodies_ssbo)
-
-                if NB_BODY > XGROUPSIZE:
-                    glDispatchCompute(NB_BODY // XGROUPSIZE, 1, 1)
-                else:
-                    glDispatchCompute(1, 1, 1)
-
-                #glMemoryBarrier(GL_SHADER_IMAGE_ACCESS_BARRIER_BIT)
-                glUseProgram(0)
-
-                # wait for compute shader to finish
-                gl_utils.gl_sync()
+                self.bodies.step_compute_shader()
 
             for obj in self.scene:
                 obj.update()
@@ -5,7 +5,8 @@ import moderngl as mgl
 import glm, math
 import pywavefront
 import random, copy
-import numba
+from jit import numba
+import numpy_blocked
 from OpenGL.GL.shaders import compileProgram,compileShader
 from OpenGL.GL import *
 import gl_utils as gl_utils
@@ -14,6 +15,10 @@ import gl_utils as gl_utils
 
 class Bodies:
 
+    # nbody_cs.glsl
+    PASS_INTEGRATE = 0
+    PASS_FORCE     = 1
+
     def __init__(self, app):
         self.app = app
 
@@ -50,45 +55,105 @@ class Bodies:
 
         particles_array = self.get_particles()
 
-        self.bodies_vbo = glGenBuffers(1)
-        glBindBuffer(GL_ARRAY_BUFFER, self.bodies_vbo)
-        glBufferData(GL_ARRAY_BUFFER, particles_array.nbytes, particles_array, GL_STATIC_DRAW)
+        # host copy for the CPU kernels, uploaded after each step
+        self.particles  = particles_array
+        self.nb_body    = particles_array.size // 16
+        self.dt         = DT
+        self.eps2       = EPS2
+        self.kernel     = self.get_kernel(NBODY_KERNEL)
+
+        # the compute shader reads the state of one buffer and writes the next one to the other (ping-pong),
+        # one VAO per buffer, the last written one is drawn
+        self.vbos = []
+        self.vaos = []
+
+        for k in range(2 if USE_COMPUTE_SHADER else 1):
+            vbo = glGenBuffers(1)
+            glBindBuffer(GL_ARRAY_BUFFER, vbo)
+
+            if USE_COMPUTE_SHADER:
+                # particles_array.nbytes = 16*4*nb_body
+                glBufferStorage(GL_ARRAY_BUFFER, particles_array.nbytes, particles_array.data, GL_MAP_READ_BIT | GL_MAP_WRITE_BIT | GL_MAP_PERSISTENT_BIT | GL_MAP_COHERENT_BIT)
+            else:
+                glBufferData(GL_ARRAY_BUFFER, particles_array.nbytes, particles_array, GL_DYNAMIC_DRAW)
+
+            vao = glGenVertexArrays(1)
+            glBindVertexArray(vao)
 
-        self.vao = glGenVertexArrays(1)
-        glBindVertexArray(self.vao)
+            # in_position, location = 0
+            glEnableVertexAttribArray(0)
+            glVertexAttribPointer(0, 4, GL_FLOAT, GL_FALSE, 16*4, ctypes.c_void_p(0))
 
-        # in_position, location = 0
-        glEnableVertexAttribArray(0)
-        glVertexAttribPointer(0, 4, GL_FLOAT, GL_FALSE, 16*4, ctypes.c_void_p(0))
+            # in_color, location = 1
+            glEnableVertexAttribArray(1)
+            glVertexAttribPointer(1, 4, GL_FLOAT, GL_FALSE, 16*4, ctypes.c_void_p(16))
 
-        # in_color, location = 1
-        glEnableVertexAttribArray(1)
-        glVertexAttribPointer(1, 4, GL_FLOAT, GL_FALSE, 16*4, ctypes.c_void_p(16))
+            self.vbos.append(vbo)
+            self.vaos.append(vao)
+
+        self.current = 0
+        self.bodies_vbo = self.vbos[0]
+        self.vao = self.vaos[0]
 
         if USE_COMPUTE_SHADER:
             glUseProgram(self.app.compute_shader_program)
-            self.bodies_ssbo = glGenBuffers(1)
-            glBindBuffer(GL_SHADER_STORAGE_BUFFER, self.bodies_ssbo)
+            self.ssbo_in, self.ssbo_out = self.vbos
 
-            # particles_array.nbytes = 16*4*NB_BODY
-            glBufferStorage(GL_SHADER_STORAGE_BUFFER, 16*4*NB_BODY, particles_array.data, GL_MAP_READ_BIT | GL_MAP_WRITE_BIT | GL_MAP_PERSISTENT_BIT | GL_MAP_COHERENT_BIT)
+            # body count and timestep are uniforms, not compiled in
+            glUniform1i(glGetUniformLocation(self.app.compute_shader_program, "nb_body"), self.nb_body)
+            glUniform1f(glGetUniformLocation(self.app.compute_shader_program, "dt"), self.dt)
+            glUniform1f(glGetUniformLocation(self.app.compute_shader_program, "eps2"), self.eps2)
             glUseProgram(0)
 
+    def step_compute_shader(self):
+        # one leapfrog step, IN -> OUT, see nbody_cs.glsl
+        program = self.app.compute_shader_program
+
+        glUseProgram(program)
+        glBindBufferBase(GL_SHADER_STORAGE_BUFFER, 0, self.ssbo_in)
+        glBindBufferBase(GL_SHADER_STORAGE_BUFFER, 1, self.ssbo_out)
+
+        # the shader skips the invocations past nb_body, round up
+        nb_group = (self.nb_body + XGROUPSIZE - 1) // XGROUPSIZE
+
+        glUniform1i(glGetUniformLocation(program, "pass_id"), self.PASS_INTEGRATE)
+        glDispatchCompute(nb_group, 1, 1)
+
+        # the force pass reads the new position of every body
+        glMemoryBarrier(GL_SHADER_STORAGE_BARRIER_BIT)
+
+        glUniform1i(glGetUniformLocation(program, "pass_id"), self.PASS_FORCE)
+        glDispatchCompute(nb_group, 1, 1)
+
+        # the VAO draws the buffer the shader wrote, the next step reads it
+        glMemoryBarrier(GL_VERTEX_ATTRIB_ARRAY_BARRIER_BIT | GL_SHADER_STORAGE_BARRIER_BIT)
+        glUseProgram(0)
+
+        self.ssbo_in, self.ssbo_out = self.ssbo_out, self.ssbo_in
+        self.current = 1 - self.current
+        self.bodies_vbo = self.vbos[self.current]
+        self.vao = self.vaos[self.current]
+
     @staticmethod
     @numba.njit(fastmath=True)
-    def calc_bodies(bodies):
+    def calc_bodies(bodies, dt, eps2):
 
-        bodies = bodies.reshape(NB_BODY, 16)
+        # body count and timestep are arguments: one compiled kernel for any N and dt
+        bodies = bodies.reshape(-1, 16)
+        half_dt = 0.5 * dt
 
         # leap 1/2
         for body in bodies:
-            body[VELX] += body[ACCX] * HALF_DT
-            body[VELY] += body[ACCY] * HALF_DT
-            body[VELZ] += body[ACCZ] * HALF_DT
+            body[VELX] += body[ACCX] * half_dt
+            body[VELY] += body[ACCY] * half_dt
+            body[VELZ] += body[ACCZ] * half_dt
 
-            body[POSX] += body[VELX] * DT
-            body[POSY] += body[VELY] * DT
-            body[POSZ] += body[VELZ] * DT
+            body[POSX] += body[VELX] * dt
+            body[POSY] += body[VELY] * dt
+            body[POSZ] += body[VELZ] * dt
+
+            # the kick above used the acc of the last step, accumulate the new one from zero
+            body[ACCX] = body[ACCY] = body[ACCZ] = 0.0
 
         # O2
         for pi in bodies:
@@ -99,7 +164,7 @@ class Bodies:
                     DRZ = pj[POSZ] - pi[POSZ]
 
                     DR2 = DRX * DRX + DRY * DRY + DRZ * DRZ
-                    DR2 += EPS2
+                    DR2 += eps2
 
                     PHI = pj[MASS] / (math.sqrt(DR2) * DR2)
 
@@ -109,14 +174,115 @@ class Bodies:
 
         # leap 1/2
         for body in bodies:
-            body[VELX] += body[ACCX] * HALF_DT
-            body[VELY] += body[ACCY] * HALF_DT
-            body[VELZ] += body[ACCZ] * HALF_DT
+            body[VELX] += body[ACCX] * half_dt
+            body[VELY] += body[ACCY] * half_dt
+            body[VELZ] += body[ACCZ] * half_dt
+
+        return bodies
+
+    @staticmethod
+    @numba.njit(fastmath=True)
+    def calc_bodies_symmetric(bodies, dt, eps2):
 
+        # body count and timestep are arguments: one compiled kernel for any N and dt
+        bodies = bodies.reshape(-1, 16)
+        nb_body = bodies.shape[0]
+        half_dt = 0.5 * dt
+
+        # leap 1/2
+        for body in bodies:
+            body[VELX] += body[ACCX] * half_dt
+            body[VELY] += body[ACCY] * half_dt
+            body[VELZ] += body[ACCZ] * half_dt
+
+            body[POSX] += body[VELX] * dt
+            body[POSY] += body[VELY] * dt
+            body[POSZ] += body[VELZ] * dt
+
+            # the kick above used the acc of the last step, accumulate the new one from zero
             body[ACCX] = body[ACCY] = body[ACCZ] = 0.0
 
+        # O2 / 2, every unordered pair once (Newton 3rd law), tile by tile so both tiles stay in cache
+        for ti in range(0, nb_body, TILE_SIZE):
+            ti_end = min(ti + TILE_SIZE, nb_body)
+
+            for tj in range(ti, nb_body, TILE_SIZE):
+                tj_end = min(tj + TILE_SIZE, nb_body)
+
+                for i in range(ti, ti_end):
+                    pi = bodies[i]
+                    PIX, PIY, PIZ, MI = pi[POSX], pi[POSY], pi[POSZ], pi[MASS]
+                    AX = AY = AZ = 0.0
+
+                    for j in range(i + 1 if tj == ti else tj, tj_end):
+                        pj = bodies[j]
+
+                        DRX = pj[POSX] - PIX
+                        DRY = pj[POSY] - PIY
+                        DRZ = pj[POSZ] - PIZ
+
+                        DR2 = DRX * DRX + DRY * DRY + DRZ * DRZ
+                        DR2 += eps2
+
+                        INV_DR3 = 1.0 / (math.sqrt(DR2) * DR2)
+                        PHI_I = pj[MASS] * INV_DR3
+                        PHI_J = MI * INV_DR3
+
+                        AX += DRX * PHI_I
+                        AY += DRY * PHI_I
+                        AZ += DRZ * PHI_I
+
+                        pj[ACCX] -= DRX * PHI_J
+                        pj[ACCY] -= DRY * PHI_J
+                        pj[ACCZ] -= DRZ * PHI_J
+
+                    pi[ACCX] += AX
+                    pi[ACCY] += AY
+                    pi[ACCZ] += AZ
+
+        # leap 1/2
+        for body in bodies:
+            body[VELX] += body[ACCX] * half_dt
+            body[VELY] += body[ACCY] * half_dt
+            body[VELZ] += body[ACCZ] * half_dt
+
+        return bodies
+
+    @staticmethod
+    def calc_bodies_numpy_blocked(bodies, dt, eps2):
+
+        # no numba: the leapfrog on whole columns, the forces from numpy_blocked.py on the column views
+        bodies = bodies.reshape(-1, 16)
+        half_dt = 0.5 * dt
+
+        pos = bodies[:, POSX:POSZ + 1]
+        vel = bodies[:, VELX:VELZ + 1]
+        acc = bodies[:, ACCX:ACCZ + 1]
+
+        # leap 1/2
+        vel += acc * half_dt
+        pos += vel * dt
+
+        # the kernel accumulates, the potential is not used
+        acc.fill(0.0)
+        pot = np.zeros(bodies.shape[0], dtype=bodies.dtype)
+        numpy_blocked.accel(bodies[:, POSX], bodies[:, POSY], bodies[:, POSZ], bodies[:, MASS],
+                            bodies[:, ACCX], bodies[:, ACCY], bodies[:, ACCZ], pot, eps2)
+
+        # leap 1/2
+        vel += acc * half_dt
+
         return bodies
 
+    def get_kernel(self, name):
+        kernels = {
+            "direct"        : self.calc_bodies,
+            "symmetric"     : self.calc_bodies_symmetric,
+            "numpy_blocked" : self.calc_bodies_numpy_blocked,
+        }
+
+        return kernels[name]
+
     def update(self):
         glUseProgram(self.app.nbody_program)
 
@@ -131,24 +297,20 @@ class Bodies:
         )
 
         if not USE_COMPUTE_SHADER:
-            print(type(self.bodies_vbo))
-            print(dir(self.bodies_vbo))
-            a = self.bodies_vbo.read(components=16, dtype='f4')
-            d = np.frombuffer(a, dtype='f4')
-
-            bodies = self.calc_bodies(copy.copy(d))
+            self.particles = self.kernel(self.particles, self.dt, self.eps2).reshape(-1)
 
-            #self.bodies_vbo.write(bodies)
+            glBindBuffer(GL_ARRAY_BUFFER, self.bodies_vbo)
+            glBufferSubData(GL_ARRAY_BUFFER, 0, self.particles.nbytes, self.particles)
 
     def render(self):
         glUseProgram(self.app.nbody_program)
         glBindVertexArray(self.vao)
-        glDrawArrays(GL_POINTS, 0, NB_BODY)
+        glDrawArrays(GL_POINTS, 0, self.nb_body)
 
     def destroy(self):
         glUseProgram(self.app.nbody_program)
-        glDeleteVertexArrays(1, (self.vao,))
-        glDeleteBuffers(1,(self.bodies_vbo,))
+        glDeleteVertexArrays(len(self.vaos), self.vaos)
+        glDeleteBuffers(len(self.vbos), self.vbos)
 
     def get_particles(self):
 
@@ -3,15 +3,22 @@
 #define XGROUPSIZE  XGROUPSIZE_VAL
 #define YGROUPSIZE  YGROUPSIZE_VAL
 #define ZGROUPSIZE  ZGROUPSIZE_VAL
-#define NB_BODY     NB_BODY_VAL
 
-// TODO set as uniform
-const float EPS     = 0.3;
-const float DT      = 1.0/256.0;
-const float EPS2    = EPS * EPS;
-const float HALF_DT = 0.5 * DT;
+// 1 = the workgroup stages the bodies through shared memory one tile (one body per invocation) at a time
+#define TILED       TILED_VAL
+#define TILE_SIZE   (XGROUPSIZE * YGROUPSIZE * ZGROUPSIZE)
 
-//uniform int nb_body;
+// one leapfrog step in two dispatches, IN = state at the start of the step, OUT = state at the end,
+// the app swaps the buffers after the step: no invocation reads a body another one is moving
+#define PASS_INTEGRATE  0 // IN -> OUT: vel += acc * dt / 2 (acc of the last step), pos += vel * dt
+#define PASS_FORCE      1 // OUT: acc at the new positions, vel += acc * dt / 2
+
+// set at dispatch time: one compiled shader for any body count and timestep
+uniform int   nb_body;
+uniform float dt;
+uniform float eps2;
+
+uniform int   pass_id;
 
 layout(local_size_x=XGROUPSIZE, local_size_y=YGROUPSIZE, local_size_z=ZGROUPSIZE) in;
 
@@ -28,38 +35,91 @@ layout(std430, binding=0) buffer bodies_in
     Body bodies[];
 } IN;
 
-
-void main()
+layout(std430, binding=1) buffer bodies_out
 {
-    int current_index = int(gl_GlobalInvocationID);
+    Body bodies[];
+} OUT;
 
-    // if went past number of particles, skip
-    //if (current_index >= NB_BODY_VAL + XGROUPSIZE) return;
+#if TILED
+shared vec4 tile[TILE_SIZE]; // x, y, z, w=mass
+#endif
+
+void integrate(int i)
+{
+    Body body = IN.bodies[i];
 
     // leap 1/2
-    IN.bodies[current_index].vel.xyz += IN.bodies[current_index].acc.xyz * HALF_DT;
-    IN.bodies[current_index].pos.xyz += IN.bodies[current_index].vel.xyz * DT;
+    body.vel.xyz += body.acc.xyz * (0.5 * dt);
+    body.pos.xyz += body.vel.xyz * dt;
+
+    OUT.bodies[i] = body;
+}
+
+void force(int i)
+{
+    // only the positions of OUT are read, only acc and vel are written
+    vec3 pos = i < nb_body ? OUT.bodies[i].pos.xyz : vec3(0.0);
+    vec3 acc = vec3(0.0);
 
-    // acc
-    for (int j=0; j < IN.bodies.length(); j++) {
-        if(IN.bodies[current_index].acc.w != IN.bodies[j].acc.w) { // body ID
+#if TILED
+    for (int t=0; t < nb_body; t += TILE_SIZE) {
+        // zero mass past the last body
+        int j = t + int(gl_LocalInvocationIndex);
+        tile[gl_LocalInvocationIndex] = j < nb_body ? OUT.bodies[j].pos : vec4(0.0);
+        barrier();
 
-            vec3 dr = IN.bodies[j].pos.xyz - IN.bodies[current_index].pos.xyz;
+        for (int k=0; k < TILE_SIZE; k++) {
+            // not the body itself: 0 / 0 when eps2 = 0
+            if (t + k == i) continue;
+
+            vec3 dr = tile[k].xyz - pos;
 
             float dr2 = dot(dr, dr);
-            dr2 += EPS2;
+            dr2 += eps2;
+
+            float phi = tile[k].w / (sqrt(dr2) * dr2);
 
-            float phi = IN.bodies[j].pos.w / (sqrt(dr2) * dr2);
+            acc += dr * phi;
+        }
 
-            IN.bodies[current_index].acc.xyz += dr.xyz * phi;
-       }
+        // the whole tile is consumed before the next one overwrites it
+        barrier();
     }
+#else
+    for (int j=0; j < nb_body; j++) {
+        // not the body itself: 0 / 0 when eps2 = 0
+        if (j == i) continue;
 
-    // leap 1/2
-    IN.bodies[current_index].vel.xyz += IN.bodies[current_index].acc.xyz * HALF_DT;
-    IN.bodies[current_index].acc = vec4(0, 0, 0, IN.bodies[current_index].acc.w);
+        vec3 dr = OUT.bodies[j].pos.xyz - pos;
+
+        float dr2 = dot(dr, dr);
+        dr2 += eps2;
+
+        float phi = OUT.bodies[j].pos.w / (sqrt(dr2) * dr2);
+
+        acc += dr * phi;
+    }
+#endif
+
+    if (i < nb_body) {
+        // leap 1/2
+        OUT.bodies[i].acc.xyz = acc;
+        OUT.bodies[i].vel.xyz += acc * (0.5 * dt);
+    }
+}
+
+void main()
+{
+    int current_index = int(gl_GlobalInvocationID);
+
+    // the force pass runs on every invocation: the tiled sum needs the whole workgroup at each barrier()
+    if (pass_id == PASS_FORCE) {
+        force(current_index);
+        return;
+    }
+
+    // if went past number of particles, skip
+    if (current_index >= nb_body) return;
 
-    // ensure that all threads are done reading particle data before continuing
-    barrier();
-    memoryBarrier();
-}
\ No newline at end of file
+    integrate(current_index);
+}